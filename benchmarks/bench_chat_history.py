@@ -0,0 +1,75 @@
+"""聊天歷史視窗查詢基準：全量載入後切片 vs. DESC + LIMIT
+
+在暫存SQLite資料庫中建立100 / 1,000 / 10,000則訊息的會話，
+比較建立提示詞時讀取最近10則訊息的延遲。
+
+執行方式：python benchmarks/bench_chat_history.py
+"""
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from flask import Flask
+from models.user import db
+from models.ai_chat import ChatSession, ChatMessage
+
+SESSION_SIZES = [100, 1000, 10000]
+WINDOW = 10
+REPEAT = 20
+
+def create_app(db_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    return app
+
+def seed(session_id, count):
+    db.session.add(ChatSession(session_id=session_id, user_id='bench', title=session_id))
+    start = datetime.utcnow() - timedelta(seconds=count)
+    db.session.bulk_insert_mappings(ChatMessage, [
+        {
+            'session_id': session_id,
+            'role': 'user' if i % 2 == 0 else 'assistant',
+            'content': f'訊息內容 {i} ' + '測試' * 50,
+            'timestamp': start + timedelta(seconds=i)
+        }
+        for i in range(count)
+    ])
+    db.session.commit()
+
+def full_scan(session_id):
+    messages = ChatMessage.query.filter_by(session_id=session_id).order_by(ChatMessage.timestamp.asc()).all()
+    return messages[-WINDOW:]
+
+def windowed(session_id):
+    return ChatMessage.get_recent(session_id, WINDOW)
+
+def measure(fn, session_id):
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        fn(session_id)
+        db.session.expunge_all()
+    return (time.perf_counter() - start) / REPEAT * 1000
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app(os.path.join(tmp, 'bench.db'))
+        with app.app_context():
+            db.create_all()
+            for size in SESSION_SIZES:
+                seed(f'session_{size}', size)
+
+            assert [m.id for m in full_scan('session_10000')] == [m.id for m in windowed('session_10000')]
+
+            print(f"{'訊息數':>8} {'全量載入(ms)':>14} {'DESC+LIMIT(ms)':>16}")
+            for size in SESSION_SIZES:
+                session_id = f'session_{size}'
+                print(f"{size:>8} {measure(full_scan, session_id):>14.2f} {measure(windowed, session_id):>16.2f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""EncryptionManager 效能基準：比較每次重新推導密鑰與快取密鑰的單次成本
+
+執行方式：python benchmarks/bench_encryption.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from utils.encryption import EncryptionManager, clear_fernet_cache
+
+ITERATIONS = 20
+SECRETS = ['sk-test-openai-key-0000000000', 'asst_123', 'cloud', 'cloud-key', 'cloud-secret']
+
+def bench(label, fn, iterations=ITERATIONS):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    elapsed = (time.perf_counter() - start) / iterations
+    print(f"{label:<40} {elapsed * 1000:8.3f} ms/次")
+    return elapsed
+
+def main():
+    manager = EncryptionManager()
+    token = manager.encrypt_api_key(SECRETS[0])
+    tokens = manager.encrypt_many(SECRETS)
+
+    def uncached_decrypt():
+        clear_fernet_cache()
+        manager.decrypt_api_key(token)
+
+    def uncached_dump():
+        for t in tokens:
+            clear_fernet_cache()
+            manager.decrypt_api_key(t)
+
+    before = bench('decrypt_api_key（每次推導密鑰）', uncached_decrypt)
+    manager.decrypt_api_key(token)
+    after = bench('decrypt_api_key（快取密鑰）', lambda: manager.decrypt_api_key(token), ITERATIONS * 100)
+
+    dump_before = bench('完整設定解密 x5（每次推導密鑰）', uncached_dump, ITERATIONS // 4)
+    dump_after = bench('decrypt_many x5（快取密鑰）', lambda: manager.decrypt_many(tokens), ITERATIONS * 100)
+
+    print(f"\n單次解密加速: {before / after:.0f}x")
+    print(f"完整設定解密加速: {dump_before / dump_after:.0f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+"""文件文字提取基準：原本的字串串接 vs. 產生器逐塊提取
+
+產生大型的DOCX（段落＋表格＋頁首）與PDF樣本，分別以
+1. 原本的做法（python-docx / PyPDF2 全量讀取，text += ... 串接）
+2. 產生器逐塊提取（lxml iterparse串流解析，list收集後join）
+3. 產生器逐塊提取＋字數上限（達到上限即停止解析）
+提取全文，比較耗時與峰值記憶體（每個案例在獨立子行程中執行，以ru_maxrss增量計算）。
+
+執行方式：python benchmarks/bench_extraction.py
+"""
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+import zipfile
+from xml.sax.saxutils import escape
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from utils.extraction import extract_docx_text, extract_pdf_text
+
+DOCX_PARAGRAPHS = 40000
+DOCX_TABLE_ROWS = 5000
+PDF_PAGES = 300
+LINES_PER_PAGE = 40
+BUDGET_CHARS = 100000
+NO_LIMIT = 10 ** 9
+
+W = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+R = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+
+def write_docx(path):
+    """以zipfile直接寫出最小可用的DOCX（不經過python-docx，產生速度快）"""
+    def paragraph(text):
+        return f'<w:p><w:r><w:t xml:space="preserve">{escape(text)}</w:t></w:r></w:p>'
+
+    body = []
+    for i in range(DOCX_PARAGRAPHS):
+        body.append(paragraph(f'第{i}段：七七七科技社群行銷簡報內容，包含活動目標、受眾分析與預算規劃。'))
+    rows = ''.join(
+        f'<w:tr><w:tc>{paragraph(f"項目{i}")}</w:tc><w:tc>{paragraph(str(i * 100))}</w:tc></w:tr>'
+        for i in range(DOCX_TABLE_ROWS)
+    )
+    body.append(f'<w:tbl>{rows}</w:tbl>')
+
+    document = (f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                f'<w:document xmlns:w="{W}" xmlns:r="{R}"><w:body>{"".join(body)}'
+                f'<w:sectPr><w:headerReference w:type="default" r:id="rId1"/></w:sectPr></w:body></w:document>')
+    header = f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?><w:hdr xmlns:w="{W}">{paragraph("七七七科技 內部簡報")}</w:hdr>'
+    content_types = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+        '<Override PartName="/word/header1.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.header+xml"/>'
+        '</Types>'
+    )
+    rels = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/>'
+        '</Relationships>'
+    )
+    document_rels = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/header" Target="header1.xml"/>'
+        '</Relationships>'
+    )
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', content_types)
+        archive.writestr('_rels/.rels', rels)
+        archive.writestr('word/_rels/document.xml.rels', document_rels)
+        archive.writestr('word/document.xml', document)
+        archive.writestr('word/header1.xml', header)
+
+def write_pdf(path):
+    """寫出只含Helvetica文字的最小PDF"""
+    objects = ['<< /Type /Catalog /Pages 2 0 R >>', None, '<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>']
+    kids = []
+    for page in range(PDF_PAGES):
+        lines = ''.join(
+            f'({escape_pdf(f"Page {page} line {line}: quarterly marketing campaign briefing notes")}) Tj 0 -16 Td '
+            for line in range(LINES_PER_PAGE)
+        )
+        stream = f'BT /F1 10 Tf 40 780 Td {lines}ET'
+        objects.append(f'<< /Length {len(stream)} >>\nstream\n{stream}\nendstream')
+        content_id = len(objects)
+        objects.append(f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] '
+                       f'/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>')
+        kids.append(f'{len(objects)} 0 R')
+    objects[1] = f'<< /Type /Pages /Kids [{" ".join(kids)}] /Count {PDF_PAGES} >>'
+
+    output = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += f'{number} 0 obj\n{body}\nendobj\n'.encode('latin-1')
+    xref = len(output)
+    output += f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n'.encode()
+    for offset in offsets:
+        output += f'{offset:010d} 00000 n \n'.encode()
+    output += f'trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n'.encode()
+    with open(path, 'wb') as f:
+        f.write(output)
+
+def escape_pdf(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+def legacy_docx(path):
+    import docx
+    doc = docx.Document(path)
+    text = ""
+    for paragraph in doc.paragraphs:
+        text += paragraph.text + "\n"
+    return text.strip()
+
+def legacy_pdf(path):
+    import PyPDF2
+    with open(path, 'rb') as f:
+        reader = PyPDF2.PdfReader(f)
+        text = ""
+        for page in reader.pages:
+            text += page.extract_text() + "\n"
+    return text.strip()
+
+def generator_docx(path, max_chars):
+    return extract_docx_text(path, None, max_chars, 600)['text']
+
+def generator_pdf(path, max_chars):
+    return extract_pdf_text(path, PDF_PAGES, max_chars, 600)['text']
+
+def measure(fn, args, queue):
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    text = fn(*args)
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+    queue.put((elapsed, peak, len(text)))
+
+def run_case(fn, *args):
+    # 每個案例在獨立的子行程中執行，避免記憶體峰值互相影響
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=measure, args=(fn, args, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        docx_path = os.path.join(tmp, 'sample.docx')
+        pdf_path = os.path.join(tmp, 'sample.pdf')
+        write_docx(docx_path)
+        write_pdf(pdf_path)
+        print(f"DOCX {os.path.getsize(docx_path) / 1024:.0f} KB（{DOCX_PARAGRAPHS}段落＋{DOCX_TABLE_ROWS}列表格），"
+              f"PDF {os.path.getsize(pdf_path) / 1024:.0f} KB（{PDF_PAGES}頁）\n")
+
+        cases = [
+            ('DOCX 原本做法（不含表格）', legacy_docx, docx_path),
+            ('DOCX 產生器全文', generator_docx, docx_path, NO_LIMIT),
+            (f'DOCX 產生器＋{BUDGET_CHARS}字上限', generator_docx, docx_path, BUDGET_CHARS),
+            ('PDF  原本做法', legacy_pdf, pdf_path),
+            ('PDF  產生器全文', generator_pdf, pdf_path, NO_LIMIT),
+            (f'PDF  產生器＋{BUDGET_CHARS}字上限', generator_pdf, pdf_path, BUDGET_CHARS),
+        ]
+        print(f"{'案例':<28}{'耗時(ms)':>10}{'峰值RSS增量(MB)':>18}{'字元數':>12}")
+        for label, fn, *args in cases:
+            elapsed, peak_kb, chars = run_case(fn, *args)
+            print(f"{label:<28}{elapsed * 1000:>10.1f}{peak_kb / 1024:>18.1f}{chars:>12}")
+
+if __name__ == '__main__':
+    main()
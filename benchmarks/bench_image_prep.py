@@ -0,0 +1,87 @@
+"""視覺模型圖片前處理基準：原圖 vs. 縮圖重新編碼
+
+以Pillow產生模擬手機照片（含EXIF的高品質JPEG），比較送出原圖與
+縮至不同長邊上限後的檔案大小、前處理耗時、估計傳輸時間與OpenAI計費token數。
+
+執行方式：python benchmarks/bench_image_prep.py
+"""
+import os
+import random
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from PIL import Image, ImageDraw, ImageFilter
+
+from utils.images import downscale_image
+from utils.tokens import image_tokens
+
+SAMPLES = [
+    ('手機照片 12MP 橫式', 4032, 3024),
+    ('手機照片 12MP 直式', 3024, 4032),
+    ('螢幕截圖 2K', 2560, 1440),
+    ('社群貼文 1080', 1080, 1080),
+    ('網頁圖片', 800, 600),
+]
+TARGETS = [1024, 768, 512]
+BANDWIDTH_MBPS = 20  # 模型端下載圖片的估計頻寬
+
+def synthesize_photo(width, height, seed):
+    """產生帶有漸層、色塊與雜訊的圖片（壓縮特性接近實際照片）"""
+    rng = random.Random(seed)
+    image = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+    draw = ImageDraw.Draw(image)
+    for _ in range(200):
+        x, y = rng.randrange(width), rng.randrange(height)
+        r = rng.randrange(20, max(21, width // 8))
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=tuple(rng.randrange(256) for _ in range(3)))
+    noise = Image.effect_noise((width, height), 40).convert('RGB')
+    image = Image.blend(image.filter(ImageFilter.GaussianBlur(2)), noise, 0.15)
+
+    exif = Image.Exif()
+    exif[0x010F] = 'PhoneMaker'     # Make
+    exif[0x0110] = 'PhoneModel X'   # Model
+    exif[0x0112] = 1                # Orientation
+    output = BytesIO()
+    image.save(output, format='JPEG', quality=95, exif=exif)
+    return output.getvalue()
+
+def transfer_ms(size):
+    return size * 8 / (BANDWIDTH_MBPS * 1_000_000) * 1000
+
+def main():
+    print(f"估計傳輸頻寬 {BANDWIDTH_MBPS} Mbps；token以高解析度模式計算\n")
+    header = f"{'樣本':<18}{'長邊上限':>8}{'大小(KB)':>10}{'前處理(ms)':>12}{'傳輸(ms)':>10}{'token':>8}"
+    print(header)
+    print('-' * len(header))
+
+    totals = {target: [0, 0, 0.0] for target in ['原圖'] + TARGETS}
+    for seed, (label, width, height) in enumerate(SAMPLES):
+        original = synthesize_photo(width, height, seed)
+        tokens = image_tokens(width, height)
+        print(f"{label:<18}{'原圖':>8}{len(original) / 1024:>10.0f}{0:>12.1f}"
+              f"{transfer_ms(len(original)):>10.0f}{tokens:>8}")
+        totals['原圖'][0] += len(original)
+        totals['原圖'][1] += tokens
+
+        for target in TARGETS:
+            start = time.perf_counter()
+            prepared, new_width, new_height = downscale_image(original, target)
+            elapsed = (time.perf_counter() - start) * 1000
+            tokens = image_tokens(new_width, new_height)
+            print(f"{'':<18}{target:>8}{len(prepared) / 1024:>10.0f}{elapsed:>12.1f}"
+                  f"{transfer_ms(len(prepared)):>10.0f}{tokens:>8}")
+            totals[target][0] += len(prepared)
+            totals[target][1] += tokens
+            totals[target][2] += elapsed
+
+    print('\n合計')
+    base_size, base_tokens, _ = totals['原圖']
+    for key, (size, tokens, elapsed) in totals.items():
+        print(f"  {str(key):<8} 大小 {size / 1024:>7.0f} KB（{size / base_size:>5.1%}）  "
+              f"token {tokens:>5}（{tokens / base_tokens:>5.1%}）  前處理 {elapsed:>6.1f} ms")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""OpenAI客戶端重用基準：每次請求建立新客戶端 vs. 登錄表中的共用客戶端
+
+啟動本機的OpenAI相容stub（只回傳固定的chat completion），
+比較每次請求的額外開銷（客戶端建立、TCP連線；實際環境中還有TLS交握）。
+
+執行方式：python benchmarks/bench_openai_client.py
+"""
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import openai
+from utils.openai_clients import openai_clients
+
+REQUESTS = 200
+COMPLETION = {
+    'id': 'chatcmpl-bench',
+    'object': 'chat.completion',
+    'created': 0,
+    'model': 'gpt-3.5-turbo',
+    'choices': [{
+        'index': 0,
+        'message': {'role': 'assistant', 'content': 'ok'},
+        'finish_reason': 'stop'
+    }],
+    'usage': {'prompt_tokens': 1, 'completion_tokens': 1, 'total_tokens': 2}
+}
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        body = json.dumps(COMPLETION).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def call(client):
+    client.chat.completions.create(
+        model='gpt-3.5-turbo',
+        messages=[{'role': 'user', 'content': 'ping'}],
+        max_tokens=1
+    )
+
+def main():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_address[1]}/v1'
+
+    def fresh():
+        client = openai.OpenAI(api_key='sk-bench', base_url=base_url)
+        call(client)
+        client.close()
+
+    def pooled():
+        call(openai_clients.get('sk-bench', owner='bench', base_url=base_url))
+
+    results = {}
+    for label, fn in (('每次建立新客戶端', fresh), ('登錄表共用客戶端', pooled)):
+        fn()  # 暖機
+        start = time.perf_counter()
+        for _ in range(REQUESTS):
+            fn()
+        results[label] = (time.perf_counter() - start) / REQUESTS * 1000
+        print(f"{label:<12} {results[label]:8.3f} ms/請求")
+
+    saved = results['每次建立新客戶端'] - results['登錄表共用客戶端']
+    print(f"\n每次請求節省: {saved:.3f} ms（未含TLS交握，實際HTTPS環境節省更多）")
+    server.shutdown()
+    openai_clients.clear()
+
+if __name__ == '__main__':
+    main()
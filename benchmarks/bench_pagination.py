@@ -0,0 +1,87 @@
+"""列表分頁基準：paginate()（COUNT(*) + OFFSET）vs. keyset游標分頁
+
+以100k筆貼文比較不同深度的頁面耗時：
+1. 原本的paginate()：每頁都計算總數並以OFFSET跳過前面的資料列
+2. 游標分頁：依(created_at, id)索引直接定位，不計算總數
+另外列出帶篩選條件（status）時的結果。
+
+執行方式：python benchmarks/bench_pagination.py
+"""
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from flask import Flask
+
+from models.user import db
+from models.post import Post
+from utils.pagination import encode_cursor, keyset_page
+
+ROWS = 100000
+PER_PAGE = 10
+PAGES = [1, 100, 1000, 3000, 6000]
+REPEAT = 5
+
+def seed(app):
+    start = datetime(2024, 1, 1)
+    rows = [{
+        'title': f'貼文 {i}',
+        'content': '本週活動與公告內容' * 5,
+        'scheduled_time': start,
+        'tag': '資訊',
+        'status': '已發佈' if i % 3 else '尚未發佈',
+        'author': 'bench',
+        'created_at': start + timedelta(seconds=i * 30),
+        'updated_at': start
+    } for i in range(ROWS)]
+    with app.app_context():
+        db.create_all()
+        db.session.execute(Post.__table__.insert(), rows)
+        db.session.commit()
+
+def timed(fn):
+    samples = []
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+def cursor_before_page(query, page):
+    """取得第page頁開始前一筆的游標（模擬使用者一路翻頁到此處）"""
+    if page == 1:
+        return None
+    last = query.order_by(Post.created_at.desc(), Post.id.desc()).offset((page - 1) * PER_PAGE - 1).first()
+    return encode_cursor(last.created_at, last.id)
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        db.init_app(app)
+        seed(app)
+
+        with app.app_context():
+            for label, make_query in (
+                ('全部貼文', lambda: Post.query),
+                ('status=已發佈', lambda: Post.query.filter(Post.status == '已發佈')),
+            ):
+                print(f"\n{label}（{ROWS}筆）")
+                print(f"{'頁數':>8}{'paginate(ms)':>16}{'游標(ms)':>12}{'倍數':>8}")
+                for page in PAGES:
+                    offset_ms = timed(lambda: make_query().order_by(Post.created_at.desc()).paginate(
+                        page=page, per_page=PER_PAGE, error_out=False
+                    ).items)
+                    cursor = cursor_before_page(make_query(), page)
+                    cursor_ms = timed(lambda: keyset_page(
+                        make_query(), Post.created_at, Post.id, cursor, PER_PAGE
+                    ))
+                    print(f"{page:>8}{offset_ms:>16.2f}{cursor_ms:>12.2f}{offset_ms / cursor_ms:>7.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""文件檢索基準：全文放入提示詞 vs. BM25檢索相關段落
+
+產生模擬的200頁行銷簡報（中英混合），在其中埋入數個事實，
+比較每個問題放入提示詞的token數、命中率（答案段落是否被選入）與檢索耗時。
+
+執行方式：python benchmarks/bench_retrieval.py
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from utils.retrieval import (
+    BM25Index, RETRIEVAL_MAX_TOKENS, RETRIEVAL_MIN_SCORE_RATIO, RETRIEVAL_TOP_K, chunk_text, tokenize
+)
+from utils.tokens import count_tokens
+
+PAGES = 200
+LINES_PER_PAGE = 25
+
+FILLER = [
+    '本季社群經營重點為提升粉絲互動率與貼文觸及率。',
+    '各平台的內容排程依據受眾上線時段調整，並持續追蹤成效。',
+    'Campaign performance is reviewed weekly with the marketing team.',
+    '營運項目需於每月月底前提交進度報告與預算使用情形。',
+    '廣告素材將依平台規格製作多種尺寸，並進行A/B測試。',
+    'KPI dashboards are updated daily from the analytics pipeline.',
+    '客服回覆時間目標為兩小時內，假日另行安排值班人員。',
+]
+
+FACTS = [
+    ('萬聖節活動的預算是多少？', '萬聖節主題活動預算為新台幣三十五萬元，由品牌行銷組負責執行。'),
+    ('誰負責Instagram Reels的腳本？', 'Instagram Reels短影音腳本由內容企劃陳小姐撰寫，每週三交稿。'),
+    ('What is the target CTR for the Q4 search ads?', 'Q4 search ads target a CTR of 4.2% with a max CPC of NT$18.'),
+    ('會員日折扣碼是什麼？', '會員日專屬折扣碼為MEMBER777，限當日使用一次。'),
+    ('跨年直播在哪個平台進行？', '跨年直播將於YouTube與Facebook同步進行，預計晚上十一點開播。'),
+    ('Which agency handles the influencer contracts?', 'Influencer contracts are handled by the Brightwave agency under a six-month retainer.'),
+]
+
+def build_document(seed=7):
+    rng = random.Random(seed)
+    lines = []
+    for page in range(PAGES):
+        lines.append(f'第{page + 1}頁 行銷簡報')
+        for _ in range(LINES_PER_PAGE):
+            lines.append(rng.choice(FILLER))
+    positions = rng.sample(range(len(lines)), len(FACTS))
+    for position, (_, fact) in zip(positions, FACTS):
+        lines[position] = fact
+    return '\n'.join(lines)
+
+def retrieve(index, query):
+    results = index.search(tokenize(query), RETRIEVAL_TOP_K)
+    cutoff = results[0][0] * RETRIEVAL_MIN_SCORE_RATIO if results else 0
+    selected = []
+    budget = RETRIEVAL_MAX_TOKENS
+    for score, payload in results:
+        if score < cutoff or payload['token_count'] > budget:
+            continue
+        selected.append(payload)
+        budget -= payload['token_count']
+    return selected
+
+def main():
+    document = build_document()
+    full_tokens = count_tokens(document)
+
+    start = time.perf_counter()
+    chunks = chunk_text(document)
+    chunk_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    index = BM25Index()
+    for position, text in enumerate(chunks):
+        index.add(tokenize(text), {'position': position, 'text': text, 'token_count': count_tokens(text)})
+    index_ms = (time.perf_counter() - start) * 1000
+
+    print(f"文件 {PAGES} 頁、{len(document)} 字元、全文 {full_tokens} token")
+    print(f"切成 {len(chunks)} 段（分段 {chunk_ms:.0f} ms，建立索引 {index_ms:.0f} ms）\n")
+    print(f"{'問題':<40}{'段落數':>6}{'token':>8}{'檢索(ms)':>10}{'命中':>6}")
+
+    total_tokens = 0
+    hits = 0
+    for question, fact in FACTS:
+        start = time.perf_counter()
+        selected = retrieve(index, question)
+        elapsed = (time.perf_counter() - start) * 1000
+        tokens = sum(payload['token_count'] for payload in selected)
+        hit = any(fact in payload['text'] for payload in selected)
+        total_tokens += tokens
+        hits += hit
+        print(f"{question:<40}{len(selected):>6}{tokens:>8}{elapsed:>10.2f}{'是' if hit else '否':>6}")
+
+    average = total_tokens / len(FACTS)
+    print(f"\n平均每個問題 {average:.0f} token（全文的 {average / full_tokens:.2%}），命中 {hits}/{len(FACTS)}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""貼文搜尋基準：LIKE '%x%' 全表掃描 vs. FTS5全文檢索
+
+以模擬的繁體中文貼文（標題＋內容）逐步填入 10k / 50k / 100k 筆資料，
+比較列表搜尋（計算總數＋取第一頁）在兩種做法下的耗時，並記錄寫入時同步維護索引的成本。
+
+執行方式：python benchmarks/bench_search.py
+"""
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from sqlalchemy import create_engine, text
+
+from utils.search import SEARCH_TITLE_WEIGHT, ensure_search_index, index_rows, match_expression
+
+SIZES = [10000, 50000, 100000]
+PER_PAGE = 10
+REPEAT = 5
+
+WORDS = [
+    '活動', '貼文', '粉絲', '互動', '觸及', '預算', '廣告', '素材', '排程', '直播', '優惠', '會員',
+    '品牌', '合作', '網紅', '短影音', '抽獎', '留言', '分享', '門市', '新品', '上市', '限時', '折扣',
+    '客服', '回覆', '報名', '講座', '問卷', '回饋', '社群', '經營', '成效', '報告', '企劃', '設計',
+]
+RARE = ['萬聖節派對', '周年慶快閃', 'KPI dashboard']
+QUERIES = [
+    ('高頻詞', '活動'),
+    ('兩個詞', '網紅 合作'),
+    ('罕見片語', '萬聖節派對'),
+    ('英文前綴', 'dash'),
+]
+
+def random_text(rng, words):
+    return '，'.join(''.join(rng.choice(WORDS) for _ in range(rng.randint(2, 4))) for _ in range(words))
+
+def insert_rows(engine, rng, start, stop, indexed=False):
+    rows = []
+    for row_id in range(start + 1, stop + 1):
+        title = random_text(rng, 2)
+        content = random_text(rng, 20)
+        if row_id % 997 == 0:
+            content += '，' + RARE[row_id % len(RARE)]
+        rows.append({'id': row_id, 'title': title, 'content': content})
+    started = time.perf_counter()
+    with engine.begin() as connection:
+        connection.execute(text(
+            "INSERT INTO posts (id, title, content, created_at) VALUES (:id, :title, :content, datetime('now'))"
+        ), rows)
+        if indexed:
+            # 與應用程式的ORM事件相同：在同一個交易中寫入索引
+            index_rows(connection, 'posts', rows)
+    return time.perf_counter() - started
+
+def like_search(connection, search):
+    pattern = f'%{search}%'
+    total = connection.execute(text(
+        "SELECT count(*) FROM posts WHERE title LIKE :p OR content LIKE :p"
+    ), {'p': pattern}).scalar()
+    connection.execute(text(
+        "SELECT id FROM posts WHERE title LIKE :p OR content LIKE :p ORDER BY created_at DESC LIMIT :n"
+    ), {'p': pattern, 'n': PER_PAGE}).all()
+    return total
+
+def fts_search(connection, search):
+    expression = match_expression(search)
+    total = connection.execute(text(
+        "SELECT count(*) FROM posts JOIN posts_fts ON posts_fts.rowid = posts.id WHERE posts_fts MATCH :q"
+    ), {'q': expression}).scalar()
+    connection.execute(text(
+        "SELECT posts.id FROM posts JOIN posts_fts ON posts_fts.rowid = posts.id "
+        "WHERE posts_fts MATCH :q ORDER BY bm25(posts_fts, :w, 1.0) LIMIT :n"
+    ), {'q': expression, 'w': SEARCH_TITLE_WEIGHT, 'n': PER_PAGE}).all()
+    return total
+
+def timed(fn, connection, search):
+    samples = []
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        total = fn(connection, search)
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples), total
+
+def main():
+    rng = random.Random(777)
+    with tempfile.TemporaryDirectory() as tmp:
+        plain = create_engine(f"sqlite:///{os.path.join(tmp, 'plain.db')}")
+        indexed = create_engine(f"sqlite:///{os.path.join(tmp, 'indexed.db')}")
+        for engine in (plain, indexed):
+            with engine.begin() as connection:
+                connection.execute(text(
+                    "CREATE TABLE posts (id INTEGER PRIMARY KEY, title VARCHAR(200) NOT NULL, "
+                    "content TEXT NOT NULL, created_at DATETIME)"
+                ))
+        ensure_search_index(indexed)
+
+        inserted = 0
+        for size in SIZES:
+            seed = rng.random()
+            plain_write = insert_rows(plain, random.Random(seed), inserted, size)
+            indexed_write = insert_rows(indexed, random.Random(seed), inserted, size, indexed=True)
+            print(f"\n=== {size} 筆（新增 {size - inserted} 筆：無索引 {plain_write:.2f}s，"
+                  f"含FTS5索引 {indexed_write:.2f}s）===")
+            inserted = size
+
+            print(f"{'查詢':<14}{'命中筆數':>10}{'命中率':>8}{'LIKE(ms)':>12}{'FTS5(ms)':>12}{'倍數':>8}")
+            with plain.connect() as plain_connection, indexed.connect() as indexed_connection:
+                for label, search in QUERIES:
+                    like_ms, like_total = timed(like_search, plain_connection, search)
+                    fts_ms, fts_total = timed(fts_search, indexed_connection, search)
+                    print(f"{label:<14}{fts_total:>10}{fts_total / size:>8.1%}"
+                          f"{like_ms:>12.1f}{fts_ms:>12.1f}{like_ms / fts_ms:>7.1f}x")
+                    if like_total != fts_total:
+                        print(f"  （LIKE命中 {like_total} 筆：LIKE比對整個字串，FTS5以各詞AND比對）")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""聊天端點壓力測試（搭配 openai_stub.py 可完全離線執行）
+
+1. python benchmarks/openai_stub.py --port 8900
+2. OPENAI_BASE_URL=http://127.0.0.1:8900/v1 python test_server.py
+   並以 /api/ai/settings 設定任意的 openai_api_key
+3. python benchmarks/load_test_chat.py --url http://127.0.0.1:5003 --concurrency 20 --requests 200 [--stream]
+
+回報成功率、延遲百分位數；串流模式另回報首個delta的延遲。
+"""
+import argparse
+import json
+import statistics
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+def post_json(url, payload, timeout=120):
+    request = urllib.request.Request(
+        url, data=json.dumps(payload).encode(),
+        headers={'Content-Type': 'application/json'}, method='POST'
+    )
+    return urllib.request.urlopen(request, timeout=timeout)
+
+def create_session(base_url):
+    with post_json(f"{base_url}/api/chat/sessions", {'title': 'load test'}) as response:
+        return json.load(response)['data']['session_id']
+
+def send_message(base_url, session_id, index):
+    start = time.perf_counter()
+    with post_json(f"{base_url}/api/chat/sessions/{session_id}/messages",
+                   {'message': f"請給我貼文建議 #{index}"}) as response:
+        data = json.load(response)
+    return time.perf_counter() - start, None, data.get('data', {}).get('fallback', False)
+
+def stream_message(base_url, session_id, index):
+    start = time.perf_counter()
+    first_delta = None
+    fallback = False
+    with post_json(f"{base_url}/api/chat/sessions/{session_id}/messages/stream",
+                   {'message': f"請給我貼文建議 #{index}"}) as response:
+        event = None
+        for raw in response:
+            line = raw.decode().strip()
+            if line.startswith('event:'):
+                event = line[6:].strip()
+            elif line.startswith('data:') and event == 'delta':
+                if first_delta is None:
+                    first_delta = time.perf_counter() - start
+                fallback = fallback or json.loads(line[5:]).get('fallback', False)
+            elif line.startswith('data:') and event == 'done':
+                break
+    return time.perf_counter() - start, first_delta, fallback
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+def main():
+    parser = argparse.ArgumentParser(description='Chat endpoint load test')
+    parser.add_argument('--url', default='http://127.0.0.1:5003')
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--sessions', type=int, default=10, help='分散請求的會話數')
+    parser.add_argument('--stream', action='store_true')
+    args = parser.parse_args()
+
+    sessions = [create_session(args.url) for _ in range(args.sessions)]
+    worker = stream_message if args.stream else send_message
+    latencies, first_deltas, errors = [], [], []
+    fallbacks = 0
+    lock = threading.Lock()
+
+    def run(index):
+        nonlocal fallbacks
+        try:
+            latency, first_delta, fallback = worker(args.url, sessions[index % len(sessions)], index)
+            with lock:
+                latencies.append(latency)
+                if first_delta is not None:
+                    first_deltas.append(first_delta)
+                fallbacks += fallback
+        except Exception as e:
+            with lock:
+                errors.append(str(e))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(run, range(args.requests)))
+    elapsed = time.perf_counter() - start
+
+    print(f"請求數 {args.requests}，併發 {args.concurrency}，耗時 {elapsed:.1f}s，"
+          f"吞吐量 {args.requests / elapsed:.1f} req/s")
+    print(f"成功 {len(latencies)}，失敗 {len(errors)}，範本回應（斷路器開啟）{fallbacks}")
+    if latencies:
+        print(f"延遲 (ms)   p50 {percentile(latencies, 50) * 1000:8.1f}  "
+              f"p95 {percentile(latencies, 95) * 1000:8.1f}  "
+              f"p99 {percentile(latencies, 99) * 1000:8.1f}  "
+              f"平均 {statistics.mean(latencies) * 1000:8.1f}")
+    if first_deltas:
+        print(f"首個delta (ms) p50 {percentile(first_deltas, 50) * 1000:8.1f}  "
+              f"p95 {percentile(first_deltas, 95) * 1000:8.1f}")
+    for error in errors[:5]:
+        print(f"  錯誤: {error}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+"""本機OpenAI相容stub伺服器（壓力測試用）
+
+實作 POST /v1/chat/completions（含stream=true的SSE分段與多模態content陣列）
+與 GET /v1/models，可設定首個token延遲、每個token延遲、錯誤率與429。
+
+執行方式：
+    python benchmarks/openai_stub.py --port 8900 --ttft 0.3 --token-latency 0.02 --error-rate 0.05
+
+讓應用程式改用stub：
+    OPENAI_BASE_URL=http://127.0.0.1:8900/v1 python test_server.py
+（或以 /api/ai/settings 設定 openai_base_url；API key可為任意值）
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from utils.tokens import count_content_tokens
+
+# 回應內容取自ai_mock的範本，讓長度與實際回應接近
+from routes.ai_mock import MOCK_RESPONSES
+
+RESPONSE_POOL = [text for texts in MOCK_RESPONSES.values() for text in texts]
+
+class StubConfig:
+    def __init__(self, args):
+        self.ttft = args.ttft
+        self.token_latency = args.token_latency
+        self.chars_per_token = args.chars_per_token
+        self.error_rate = args.error_rate
+        self.rate_limit_rate = args.rate_limit_rate
+        self.max_rps = args.max_rps
+        self.stream_abort_rate = args.stream_abort_rate
+
+        # 以token bucket模擬每秒請求上限，超出時回傳429
+        self._tokens = float(args.max_rps or 0)
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+        self.stats = {'requests': 0, 'streamed': 0, 'errors': 0, 'rate_limited': 0, 'aborted': 0}
+
+    def count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def acquire(self):
+        """token bucket有餘額時回傳True"""
+        if not self.max_rps:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.max_rps, self._tokens + (now - self._last_refill) * self.max_rps)
+            self._last_refill = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+def split_tokens(text, chars_per_token, max_tokens):
+    pieces = [text[i:i + chars_per_token] for i in range(0, len(text), chars_per_token)]
+    return pieces[:max_tokens] if max_tokens else pieces
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    config = None
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, status, body, headers=None):
+        payload = json.dumps(body, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def send_error_json(self, status, message, error_type, headers=None):
+        self.send_json(status, {
+            'error': {'message': message, 'type': error_type, 'param': None, 'code': None}
+        }, headers)
+
+    def write_chunk(self, data):
+        # HTTP/1.1 chunked transfer encoding
+        self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/v1/models':
+            models = ['gpt-3.5-turbo', 'gpt-4o-mini', 'gpt-4o', 'gpt-4-vision-preview']
+            self.send_json(200, {
+                'object': 'list',
+                'data': [{'id': m, 'object': 'model', 'created': 0, 'owned_by': 'stub'} for m in models]
+            })
+        elif self.path.rstrip('/') == '/stats':
+            self.send_json(200, self.config.stats)
+        else:
+            self.send_error_json(404, f"Unknown path {self.path}", 'invalid_request_error')
+
+    def do_POST(self):
+        config = self.config
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path.rstrip('/') != '/v1/chat/completions':
+            self.send_error_json(404, f"Unknown path {self.path}", 'invalid_request_error')
+            return
+
+        try:
+            request_data = json.loads(body or b'{}')
+            messages = request_data['messages']
+        except (ValueError, KeyError):
+            self.send_error_json(400, "'messages' is required", 'invalid_request_error')
+            return
+
+        config.count('requests')
+        if not config.acquire() or random.random() < config.rate_limit_rate:
+            config.count('rate_limited')
+            self.send_error_json(429, 'Rate limit reached (stub)', 'rate_limit_exceeded', {'Retry-After': '1'})
+            return
+        if random.random() < config.error_rate:
+            config.count('errors')
+            self.send_error_json(500, 'The server had an error (stub)', 'server_error')
+            return
+
+        # 字串或多模態陣列（text / image_url）皆以相同方式估算token
+        prompt_tokens = sum(count_content_tokens(message.get('content') or '') for message in messages)
+        pieces = split_tokens(random.choice(RESPONSE_POOL), config.chars_per_token, request_data.get('max_tokens'))
+        model = request_data.get('model', 'gpt-3.5-turbo')
+        completion_id = f"chatcmpl-stub-{uuid.uuid4().hex[:12]}"
+
+        time.sleep(config.ttft)
+        if request_data.get('stream'):
+            self.stream_completion(completion_id, model, pieces)
+            return
+
+        time.sleep(config.token_latency * len(pieces))
+        self.send_json(200, {
+            'id': completion_id,
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': ''.join(pieces)},
+                'finish_reason': 'stop'
+            }],
+            'usage': {
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': len(pieces),
+                'total_tokens': prompt_tokens + len(pieces)
+            }
+        })
+
+    def stream_completion(self, completion_id, model, pieces):
+        config = self.config
+        config.count('streamed')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        def event(delta, finish_reason=None):
+            chunk = {
+                'id': completion_id,
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]
+            }
+            self.write_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+
+        # 在串流中途中斷連線的位置（模擬上游異常）
+        abort_at = random.randrange(len(pieces)) if pieces and random.random() < config.stream_abort_rate else None
+
+        try:
+            event({'role': 'assistant', 'content': ''})
+            for index, piece in enumerate(pieces):
+                if index == abort_at:
+                    config.count('aborted')
+                    self.close_connection = True
+                    return
+                event({'content': piece})
+                time.sleep(config.token_latency)
+            event({}, 'stop')
+            self.write_chunk(b"data: [DONE]\n\n")
+            self.write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            # 用戶端已關閉串流
+            self.close_connection = True
+
+def parse_args():
+    env = os.environ.get
+    parser = argparse.ArgumentParser(description='OpenAI-compatible stub server')
+    parser.add_argument('--host', default=env('STUB_HOST', '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=int(env('STUB_PORT', 8900)))
+    parser.add_argument('--ttft', type=float, default=float(env('STUB_TTFT', 0.3)),
+                        help='首個token前的延遲（秒）')
+    parser.add_argument('--token-latency', type=float, default=float(env('STUB_TOKEN_LATENCY', 0.02)),
+                        help='每個token的延遲（秒）')
+    parser.add_argument('--chars-per-token', type=int, default=int(env('STUB_CHARS_PER_TOKEN', 2)))
+    parser.add_argument('--error-rate', type=float, default=float(env('STUB_ERROR_RATE', 0)),
+                        help='回傳500的機率')
+    parser.add_argument('--rate-limit-rate', type=float, default=float(env('STUB_RATE_LIMIT_RATE', 0)),
+                        help='隨機回傳429的機率')
+    parser.add_argument('--max-rps', type=float, default=float(env('STUB_MAX_RPS', 0)),
+                        help='每秒請求上限，超出時回傳429（0為不限制）')
+    parser.add_argument('--stream-abort-rate', type=float, default=float(env('STUB_STREAM_ABORT_RATE', 0)),
+                        help='串流中途中斷連線的機率')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    StubHandler.config = StubConfig(args)
+    server = ThreadingHTTPServer((args.host, args.port), StubHandler)
+    server.daemon_threads = True
+    print(f"OpenAI stub 執行中：http://{args.host}:{args.port}/v1（統計：/stats）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -20,6 +20,11 @@ from routes.ai_content_editor import ai_editor_bp
 from routes.ai_settings import ai_settings_bp
 from routes.auth import auth_bp
 from routes.file_upload import file_upload_bp
+from routes.ai_jobs import ai_jobs_bp
+from utils import job_queue
+from utils.chat_migration import CHAT_MIGRATION_ON_STARTUP, ensure_chat_message_schema, start_chat_migration
+from utils.search import ensure_search_index
+from utils.upload_index import upload_index
 
 app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
 app.wsgi_app = WhiteNoise(app.wsgi_app, root=app.static_folder)
@@ -29,22 +34,54 @@ app.config['SECRET_KEY'] = 'asdf#FGSgvasgf$5$WGT'
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///777tech.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# AI聊天設定
+# 組裝提示詞時最多考慮的歷史訊息數，實際放入數量由token預算決定
+app.config['CHAT_HISTORY_WINDOW'] = int(os.environ.get('CHAT_HISTORY_WINDOW', 50))
+# 提示詞token預算上限（未設定時使用各模型預設值）
+app.config['CHAT_PROMPT_TOKEN_BUDGET'] = int(os.environ.get('CHAT_PROMPT_TOKEN_BUDGET', 0)) or None
+
 # 初始化資料庫
 from models.user import db
 # 使用同一個db實例
 from models.ai_config import AIConfig
 from models.post import Post
+from models.marketing import MarketingItem
+from models.operation import OperationItem
+from models.ai_chat import ChatSession, ChatMessage, UploadedAsset
+from models.ai_job import AIJob
 
 db.init_app(app)
 
 # 建立資料表
 with app.app_context():
     db.create_all()
+    ensure_chat_message_schema(db.engine)
+    
+    # 為既有資料表補建索引（create_all只會在建立新表時建立索引）
+    for index in ChatSession.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
+    for index in ChatMessage.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
+    for index in AIJob.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
+    for model in (Post, MarketingItem, OperationItem, UploadedAsset):
+        for index in model.__table__.indexes:
+            index.create(db.engine, checkfirst=True)
+    
+    # 為上傳記錄資料表新增前上傳的文件補建記錄
+    upload_index.backfill_records()
+    
+    # 貼文、行銷與營運項目的全文檢索索引（FTS5，以ORM事件同步，啟動時補齊）
+    ensure_search_index(db.engine)
     
     # 建立預設管理員帳號
     from models.user import User
     User.create_admin_user()
 
+# 在背景將舊JSON格式的聊天訊息轉換為結構化格式
+if CHAT_MIGRATION_ON_STARTUP:
+    start_chat_migration(app)
+
 # 啟用CORS
 CORS(app)
 
@@ -59,6 +96,10 @@ app.register_blueprint(ai_editor_bp, url_prefix='/api')
 app.register_blueprint(ai_settings_bp, url_prefix='/api')
 app.register_blueprint(auth_bp, url_prefix='/api')
 app.register_blueprint(file_upload_bp, url_prefix='/api')
+app.register_blueprint(ai_jobs_bp, url_prefix='/api')
+
+# 啟動背景AI工作者（AI_JOB_WORKERS=0時改由 worker.py 獨立行程處理）
+job_queue.start_workers(app, int(os.environ.get('AI_JOB_WORKERS', 2)))
 
 @app.route('/')
 def index():
@@ -1,10 +1,19 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.orm import deferred, selectinload
 from datetime import datetime
+import json
+from utils.tokens import count_tokens, MESSAGE_OVERHEAD_TOKENS
 
-db = SQLAlchemy()
+# 使用共享的db實例
+from models.user import db
 
 class ChatSession(db.Model):
     __tablename__ = 'chat_sessions'
+    __table_args__ = (
+        # 會話列表的keyset分頁（依用戶篩選，依updated_at, id由新到舊）
+        db.Index('ix_chat_sessions_user_updated', 'user_id', 'is_active', 'updated_at', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     session_id = db.Column(db.String(255), unique=True, nullable=False)
@@ -17,7 +26,10 @@ class ChatSession(db.Model):
     # 關聯到聊天訊息
     messages = db.relationship('ChatMessage', backref='session', lazy=True, cascade='all, delete-orphan')
     
-    def to_dict(self):
+    def to_dict(self, message_count=None):
+        if message_count is None:
+            # 以COUNT查詢取代載入所有訊息
+            message_count = ChatMessage.query.filter_by(session_id=self.session_id).count()
         return {
             'id': self.id,
             'session_id': self.session_id,
@@ -26,28 +38,197 @@ class ChatSession(db.Model):
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None,
             'is_active': self.is_active,
-            'message_count': len(self.messages)
+            'message_count': message_count
         }
+    
+    @staticmethod
+    def count_messages(session_ids):
+        """以單一GROUP BY查詢計算多個會話的訊息數"""
+        if not session_ids:
+            return {}
+        rows = db.session.query(
+            ChatMessage.session_id, db.func.count(ChatMessage.id)
+        ).filter(
+            ChatMessage.session_id.in_(session_ids)
+        ).group_by(ChatMessage.session_id).all()
+        return dict(rows)
 
 class ChatMessage(db.Model):
     __tablename__ = 'chat_messages'
+    __table_args__ = (
+        # 依會話取最近N則訊息時使用（ORDER BY timestamp DESC LIMIT N）
+        db.Index('ix_chat_messages_session_timestamp', 'session_id', 'timestamp'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     session_id = db.Column(db.String(255), db.ForeignKey('chat_sessions.session_id'), nullable=False)
     role = db.Column(db.String(20), nullable=False)  # 'user', 'assistant', 'system'
-    content = db.Column(db.Text, nullable=False)
+    content = db.Column(db.Text, nullable=False)  # 純文字訊息
+    # 'text'：結構化格式（附件存於chat_attachments）；NULL：尚未遷移的舊JSON格式
+    content_format = db.Column(db.String(10), default='text')
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     token_count = db.Column(db.Integer, default=0)
     
+    # 關聯到附件（依原始順序）
+    attachments = db.relationship(
+        'ChatAttachment', backref='message', lazy=True,
+        cascade='all, delete-orphan', order_by='ChatAttachment.position'
+    )
+    
+    def _legacy_data(self):
+        """解析尚未遷移的JSON格式用戶訊息（非JSON時回傳None）"""
+        if self.content_format is not None:
+            return None
+        return self.parse_legacy_content(self.role, self.content)
+    
+    @staticmethod
+    def parse_legacy_content(role, content):
+        """解析舊JSON格式的用戶訊息內容（非用戶訊息或非JSON時回傳None）"""
+        if role != 'user':
+            return None
+        try:
+            data = json.loads(content)
+        except (json.JSONDecodeError, TypeError):
+            return None
+        return data if isinstance(data, dict) else None
+    
     def to_dict(self):
+        legacy = self._legacy_data()
+        if legacy is not None:
+            text = legacy.get('message', '')
+            files = legacy.get('files') or []
+            gdrive_links = legacy.get('gdrive_links') or []
+        else:
+            text = self.content
+            files = [a.to_dict() for a in self.attachments if a.source == 'file']
+            gdrive_links = [a.to_dict() for a in self.attachments if a.source == 'gdrive']
         return {
             'id': self.id,
             'session_id': self.session_id,
             'role': self.role,
-            'content': self.content,
+            'content': text,
+            'files': files,
+            'gdrive_links': gdrive_links,
             'timestamp': self.timestamp.isoformat() if self.timestamp else None,
             'token_count': self.token_count
         }
+    
+    def prompt_text(self):
+        """訊息作為歷史對話放入提示詞時的文字內容"""
+        legacy = self._legacy_data()
+        if legacy is not None:
+            text_content = legacy.get('message', '')
+            file_count = len(legacy.get('files') or [])
+            gdrive_count = len(legacy.get('gdrive_links') or [])
+        else:
+            text_content = self.content
+            file_count = sum(1 for a in self.attachments if a.source == 'file')
+            gdrive_count = len(self.attachments) - file_count
+        
+        # 附件只以數量摘要，不放入提取的文字內容
+        if file_count:
+            text_content += f" [包含{file_count}個文件]"
+        if gdrive_count:
+            text_content += f" [包含{gdrive_count}個Google Drive連結]"
+        return text_content
+    
+    def compute_token_count(self):
+        """計算此訊息在提示詞中佔用的token數"""
+        return count_tokens(self.prompt_text()) + MESSAGE_OVERHEAD_TOKENS
+    
+    @classmethod
+    def get_recent(cls, session_id, limit=10):
+        """獲取會話最近的limit則訊息（依時間由舊到新）"""
+        messages = cls.query.filter_by(session_id=session_id).options(
+            selectinload(cls.attachments)
+        ).order_by(
+            cls.timestamp.desc(), cls.id.desc()
+        ).limit(limit).all()
+        messages.reverse()
+        return messages
+
+@event.listens_for(ChatMessage, 'before_insert')
+def _set_token_count(mapper, connection, target):
+    """寫入時計算一次token數，組裝提示詞時不必重新計算"""
+    if not target.token_count:
+        target.token_count = target.compute_token_count()
+
+class ChatAttachment(db.Model):
+    __tablename__ = 'chat_attachments'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    message_id = db.Column(db.Integer, db.ForeignKey('chat_messages.id'), nullable=False, index=True)
+    position = db.Column(db.Integer, nullable=False, default=0)
+    source = db.Column(db.String(20), nullable=False)  # 'file', 'gdrive'
+    type = db.Column(db.String(100))  # 文件類型或 image/document/unknown
+    resource_type = db.Column(db.String(20))  # Cloudinary資源類型
+    url = db.Column(db.Text)
+    original_url = db.Column(db.Text)  # Google Drive原始連結
+    public_id = db.Column(db.String(255))
+    content_type = db.Column(db.String(100))
+    size = db.Column(db.Integer)
+    note = db.Column(db.String(255))  # 處理說明（例如不支援提取內容）
+    # 提取的文字內容可能很大，延遲載入（列表與組裝提示詞時不讀取）
+    extracted_text = deferred(db.Column(db.Text))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # 文件分段（供會話內檢索）
+    chunks = db.relationship(
+        'DocumentChunk', backref='attachment', lazy=True,
+        cascade='all, delete-orphan', order_by='DocumentChunk.position'
+    )
+    
+    @classmethod
+    def from_result(cls, source, position, result):
+        """由文件上傳或Google Drive處理結果建立附件"""
+        return cls(
+            source=source,
+            position=position,
+            type=result.get('type'),
+            resource_type=result.get('resource_type'),
+            url=result.get('url'),
+            original_url=result.get('original_url'),
+            public_id=result.get('public_id'),
+            content_type=result.get('content_type'),
+            size=result.get('size'),
+            note=result.get('message'),
+            extracted_text=result.get('content')
+        )
+    
+    def to_dict(self, include_text=False):
+        data = {
+            'id': self.id,
+            'type': self.type,
+            'url': self.url,
+            'size': self.size
+        }
+        if self.source == 'file':
+            data['resource_type'] = self.resource_type
+            data['public_id'] = self.public_id
+        else:
+            data['original_url'] = self.original_url
+            data['content_type'] = self.content_type
+            if self.note:
+                data['message'] = self.note
+        if include_text:
+            data['content'] = self.extracted_text
+        return data
+
+class DocumentChunk(db.Model):
+    """附件提取文字的分段（每個回合只將相關段落放入提示詞）"""
+    __tablename__ = 'document_chunks'
+    __table_args__ = (
+        # 依會話增量載入新段落（WHERE session_id = ? AND id > ?）
+        db.Index('ix_document_chunks_session_id', 'session_id', 'id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    session_id = db.Column(db.String(255), db.ForeignKey('chat_sessions.session_id'), nullable=False)
+    attachment_id = db.Column(db.Integer, db.ForeignKey('chat_attachments.id'), nullable=False, index=True)
+    position = db.Column(db.Integer, nullable=False, default=0)  # 在文件中的順序
+    label = db.Column(db.String(255))  # 來源說明（文件類型或Google Drive）
+    text = db.Column(db.Text, nullable=False)
+    token_count = db.Column(db.Integer, nullable=False, default=0)
 
 class AISettings(db.Model):
     __tablename__ = 'ai_settings'
@@ -71,3 +252,100 @@ class AISettings(db.Model):
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
 
+
+class GeneratedContentCache(db.Model):
+    __tablename__ = 'generated_content_cache'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    cache_key = db.Column(db.String(64), unique=True, nullable=False)
+    content = db.Column(db.Text, nullable=False)
+    content_type = db.Column(db.String(50))
+    platform = db.Column(db.String(50))
+    model = db.Column(db.String(50))
+    hit_count = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_accessed_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+
+class CacheGeneration(db.Model):
+    """快取的世代計數器，清除快取時遞增，用於跨worker使行程內快取失效"""
+    __tablename__ = 'cache_generations'
+    
+    name = db.Column(db.String(50), primary_key=True)
+    generation = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    @classmethod
+    def get_generation(cls, name):
+        """獲取目前世代（不存在時為0）"""
+        generation = db.session.query(cls.generation).filter_by(name=name).scalar()
+        return generation or 0
+    
+    @classmethod
+    def bump(cls, name):
+        """遞增世代（與清除快取在同一交易中提交），回傳新的世代"""
+        row = db.session.get(cls, name)
+        if row:
+            row.generation = (row.generation or 0) + 1
+        else:
+            row = cls(name=name, generation=1)
+            db.session.add(row)
+        return row.generation
+
+
+class UploadedAsset(db.Model):
+    """以內容SHA-256為鍵的上傳索引（重複上傳時沿用Cloudinary資源與提取的文字）"""
+    __tablename__ = 'uploaded_assets'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), unique=True, nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    file_type = db.Column(db.String(100))
+    resource_type = db.Column(db.String(20), nullable=False)
+    url = db.Column(db.Text, nullable=False)
+    public_id = db.Column(db.String(255), index=True)
+    # 提取的文字內容（可能因容量上限被淘汰，淘汰後text_evicted為True）
+    extracted_text = deferred(db.Column(db.Text))
+    content_truncated = db.Column(db.Boolean, default=False)
+    text_bytes = db.Column(db.Integer, nullable=False, default=0)
+    text_evicted = db.Column(db.Boolean, nullable=False, default=False)
+    # 重複上傳統計
+    hit_count = db.Column(db.Integer, nullable=False, default=0)
+    bytes_saved = db.Column(db.BigInteger, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_used_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+
+class UploadRecord(db.Model):
+    """伺服器上傳到Cloudinary的資源記錄（以public_id為鍵，不會被淘汰）
+
+    聊天訊息引用已上傳的文件時以此驗證；提取的文字依sha256取自uploaded_assets。
+    """
+    __tablename__ = 'upload_records'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    public_id = db.Column(db.String(255), unique=True, nullable=False)
+    url = db.Column(db.Text, nullable=False)
+    sha256 = db.Column(db.String(64), nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    file_type = db.Column(db.String(100))
+    resource_type = db.Column(db.String(20), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class GDriveFile(db.Model):
+    """Google Drive文件的下載快取（以文件ID為鍵，依ETag/Last-Modified重新驗證）"""
+    __tablename__ = 'gdrive_files'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    file_id = db.Column(db.String(255), unique=True, nullable=False)
+    etag = db.Column(db.String(255))
+    last_modified = db.Column(db.String(64))
+    content_type = db.Column(db.String(100))
+    size = db.Column(db.Integer)
+    result = db.Column(db.Text, nullable=False)  # 處理結果（JSON，不含提取的文字）
+    extracted_text = deferred(db.Column(db.Text))
+    hit_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    checked_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)  # 最後下載或重新驗證的時間
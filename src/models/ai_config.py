@@ -1,11 +1,113 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
-from utils.encryption import EncryptionManager
+from utils.encryption import encryption_manager
+from utils.secret_cache import secret_cache
+from utils.openai_clients import openai_clients
 import json
 
 # 使用共享的db實例
 from models.user import db
 
+def encrypt_data(data):
+    """加密單一欄位值"""
+    return encryption_manager.encrypt(data)
+
+def decrypt_data(encrypted_data):
+    """解密單一欄位值"""
+    return encryption_manager.decrypt(encrypted_data)
+
+# 輸入欄位名稱與加密欄位的對應
+ENCRYPTED_FIELDS = {
+    'openai_api_key': 'openai_api_key_encrypted',
+    'openai_assistant_id': 'openai_assistant_id_encrypted',
+    'cloudinary_cloud_name': 'cloudinary_cloud_name_encrypted',
+    'cloudinary_api_key': 'cloudinary_api_key_encrypted',
+    'cloudinary_api_secret': 'cloudinary_api_secret_encrypted',
+    'github_token': 'github_token_encrypted',
+    'turso_database_url': 'turso_database_url_encrypted',
+    'turso_auth_token': 'turso_auth_token_encrypted',
+}
+
+class AIConfigVersion(db.Model):
+    """AI配置的版本計數器，用於跨worker使已解密憑證快取失效"""
+    __tablename__ = 'ai_config_versions'
+    
+    user_id = db.Column(db.String(100), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    @classmethod
+    def get_version(cls, user_id):
+        """獲取目前版本號（不存在時為0）"""
+        version = db.session.query(cls.version).filter_by(user_id=str(user_id)).scalar()
+        return version or 0
+    
+    @classmethod
+    def bump(cls, user_id):
+        """遞增版本號（與設定變更在同一交易中提交）"""
+        row = db.session.get(cls, str(user_id))
+        if row:
+            row.version = (row.version or 0) + 1
+        else:
+            db.session.add(cls(user_id=str(user_id), version=1))
+
+class KeyRotationState(db.Model):
+    """密鑰輪替工作的進度、取消請求與執行鎖（單一資料列，所有worker共用）"""
+    __tablename__ = 'key_rotation_state'
+    
+    id = db.Column(db.Integer, primary_key=True)  # 固定為1
+    status = db.Column(db.String(20), nullable=False, default='idle')  # idle, running, completed, failed, cancelled
+    owner = db.Column(db.String(100))  # 執行中的行程
+    batch_size = db.Column(db.Integer)
+    total_rows = db.Column(db.Integer, nullable=False, default=0)
+    processed_rows = db.Column(db.Integer, nullable=False, default=0)
+    rotated_fields = db.Column(db.Integer, nullable=False, default=0)
+    failed_fields = db.Column(db.Integer, nullable=False, default=0)
+    conflict_rows = db.Column(db.Integer, nullable=False, default=0)  # 輪替期間被儲存而略過的資料列
+    last_id = db.Column(db.Integer, nullable=False, default=0)
+    cancel_requested = db.Column(db.Boolean, nullable=False, default=False)
+    error = db.Column(db.Text)
+    started_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)  # 每批提交時更新
+    finished_at = db.Column(db.DateTime)
+    
+    @classmethod
+    def load(cls):
+        """取得狀態資料列（不存在時建立）"""
+        state = db.session.get(cls, 1)
+        if state:
+            return state
+        try:
+            db.session.add(cls(id=1))
+            db.session.commit()
+        except Exception:
+            # 其他worker同時建立
+            db.session.rollback()
+        return db.session.get(cls, 1)
+    
+    def to_dict(self):
+        """進度與吞吐量"""
+        end = self.finished_at or datetime.utcnow()
+        elapsed = (end - self.started_at).total_seconds() if self.started_at else 0
+        return {
+            'status': self.status,
+            'batch_size': self.batch_size,
+            'total_rows': self.total_rows,
+            'processed_rows': self.processed_rows,
+            'rotated_fields': self.rotated_fields,
+            'failed_fields': self.failed_fields,
+            'conflict_rows': self.conflict_rows,
+            'last_id': self.last_id,
+            'cancel_requested': self.cancel_requested,
+            'progress': (self.processed_rows / self.total_rows) if self.total_rows else 1.0,
+            'elapsed_seconds': round(elapsed, 3),
+            'rows_per_second': round(self.processed_rows / elapsed, 2) if elapsed else None,
+            'error': self.error,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'heartbeat_at': self.heartbeat_at.isoformat() if self.heartbeat_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
 class AIConfig(db.Model):
     __tablename__ = 'ai_configs'
     
@@ -38,18 +140,17 @@ class AIConfig(db.Model):
     
     def __init__(self, user_id):
         self.user_id = user_id
-        self._encryption_manager = EncryptionManager()
     
     # OpenAI 相關方法
     def set_openai_api_key(self, api_key):
         """設定OpenAI API密鑰"""
         if api_key:
-            self.openai_api_key_encrypted = self._encryption_manager.encrypt(api_key)
+            self.openai_api_key_encrypted = encrypt_data(api_key)
     
     def get_openai_api_key(self):
         """獲取OpenAI API密鑰"""
         if self.openai_api_key_encrypted:
-            return self._encryption_manager.decrypt(self.openai_api_key_encrypted)
+            return decrypt_data(self.openai_api_key_encrypted)
         return None
     
     def set_openai_assistant_id(self, assistant_id):
@@ -125,6 +226,14 @@ class AIConfig(db.Model):
             config['auth_token'] = decrypt_data(self.turso_auth_token_encrypted)
         return config if config else None
     
+    def decrypt_all(self):
+        """一次解密所有加密欄位，回傳 {欄位名稱: 明文}"""
+        names = list(ENCRYPTED_FIELDS.keys())
+        decrypted = encryption_manager.decrypt_many(
+            [getattr(self, ENCRYPTED_FIELDS[name]) for name in names]
+        )
+        return dict(zip(names, decrypted))
+    
     # 驗證方法
     def test_openai_connection(self):
         """測試OpenAI連接"""
@@ -201,12 +310,27 @@ class AIConfig(db.Model):
         
         if include_sensitive:
             # 僅在需要時包含敏感資料（例如用於API調用）
+            decrypted = self.decrypt_all()
+            cloudinary_config = {
+                k: decrypted[f'cloudinary_{k}']
+                for k in ('cloud_name', 'api_key', 'api_secret')
+                if decrypted[f'cloudinary_{k}']
+            }
+            turso_config = {
+                k: decrypted[f'turso_{k}']
+                for k in ('database_url', 'auth_token')
+                if decrypted[f'turso_{k}']
+            }
             data.update({
-                'openai_api_key': self.get_openai_api_key(),
-                'openai_assistant_id': self.get_openai_assistant_id(),
-                'cloudinary_config': self.get_cloudinary_config(),
-                'github_config': self.get_github_config(),
-                'turso_config': self.get_turso_config()
+                'openai_api_key': decrypted['openai_api_key'],
+                'openai_assistant_id': decrypted['openai_assistant_id'],
+                'cloudinary_config': cloudinary_config or None,
+                'github_config': {
+                    'token': decrypted['github_token'],
+                    'username': self.github_username,
+                    'repo': self.github_repo
+                },
+                'turso_config': turso_config or None
             })
         
         return data
@@ -216,6 +340,22 @@ class AIConfig(db.Model):
         """根據用戶ID獲取AI配置"""
         return cls.query.filter_by(user_id=user_id, is_active=True).first()
     
+    @classmethod
+    def get_cached_credentials(cls, user_id):
+        """從行程內快取獲取已解密的憑證（to_dict(include_sensitive=True)格式，無配置時為None）"""
+        def load(_key):
+            config = cls.get_by_user_id(user_id)
+            return config.to_dict(include_sensitive=True) if config else None
+        
+        return secret_cache.get(str(user_id), load, AIConfigVersion.get_version)
+    
+    @classmethod
+    def invalidate_cache(cls, user_id):
+        """遞增版本號使所有worker的快取失效（需由呼叫端提交交易）"""
+        AIConfigVersion.bump(user_id)
+        secret_cache.invalidate(str(user_id))
+        openai_clients.evict(f'user:{user_id}')
+    
     @classmethod
     def create_or_update(cls, user_id, **kwargs):
         """建立或更新AI配置"""
@@ -224,38 +364,24 @@ class AIConfig(db.Model):
             config = cls(user_id=user_id)
             db.session.add(config)
         
-        # 更新OpenAI配置
-        if 'openai_api_key' in kwargs:
-            config.set_openai_api_key(kwargs['openai_api_key'])
-        if 'openai_assistant_id' in kwargs:
-            config.set_openai_assistant_id(kwargs['openai_assistant_id'])
+        # 批次加密所有提供的敏感欄位（只推導一次密鑰）
+        names = [name for name in ENCRYPTED_FIELDS if kwargs.get(name)]
+        encrypted = encryption_manager.encrypt_many([kwargs[name] for name in names])
+        for name, value in zip(names, encrypted):
+            setattr(config, ENCRYPTED_FIELDS[name], value)
+        
+        # 更新非加密欄位
         if 'openai_model' in kwargs:
             config.openai_model = kwargs['openai_model']
-        
-        # 更新Cloudinary配置
-        if any(k in kwargs for k in ['cloudinary_cloud_name', 'cloudinary_api_key', 'cloudinary_api_secret']):
-            config.set_cloudinary_config(
-                kwargs.get('cloudinary_cloud_name'),
-                kwargs.get('cloudinary_api_key'),
-                kwargs.get('cloudinary_api_secret')
-            )
-        
-        # 更新GitHub配置
-        if any(k in kwargs for k in ['github_token', 'github_username', 'github_repo']):
-            config.set_github_config(
-                kwargs.get('github_token'),
-                kwargs.get('github_username'),
-                kwargs.get('github_repo')
-            )
-        
-        # 更新Turso配置
-        if any(k in kwargs for k in ['turso_database_url', 'turso_auth_token']):
-            config.set_turso_config(
-                kwargs.get('turso_database_url'),
-                kwargs.get('turso_auth_token')
-            )
+        if kwargs.get('github_username'):
+            config.github_username = kwargs['github_username']
+        if kwargs.get('github_repo'):
+            config.github_repo = kwargs['github_repo']
         
         config.updated_at = datetime.utcnow()
+        cls.invalidate_cache(user_id)
         db.session.commit()
+        # 提交後再清除一次，避免提交前被其他執行緒以舊資料重新填入
+        secret_cache.invalidate(str(user_id))
         return config
 
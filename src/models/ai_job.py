@@ -0,0 +1,51 @@
+from flask_sqlalchemy import SQLAlchemy
+from datetime import datetime
+import json
+
+# 使用共享的db實例
+from models.user import db
+
+class AIJob(db.Model):
+    __tablename__ = 'ai_jobs'
+    __table_args__ = (
+        # 工作者依狀態與可執行時間取出下一個工作
+        db.Index('ix_ai_jobs_status_run_after', 'status', 'run_after'),
+    )
+
+    id = db.Column(db.String(36), primary_key=True)
+    job_type = db.Column(db.String(50), nullable=False)  # chat_message, generate_content
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, succeeded, failed, cancelled
+    payload = db.Column(db.Text, nullable=False)  # JSON
+    result = db.Column(db.Text)  # JSON
+    error = db.Column(db.Text)
+
+    # 重試設定
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    # 執行狀態
+    cancel_requested = db.Column(db.Boolean, nullable=False, default=False)
+    worker_id = db.Column(db.String(100))
+    locked_at = db.Column(db.DateTime)
+
+    # 時間戳記
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'job_type': self.job_type,
+            'status': self.status,
+            'result': json.loads(self.result) if self.result else None,
+            'error': self.error,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'cancel_requested': self.cancel_requested,
+            'run_after': self.run_after.isoformat() if self.run_after else None,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
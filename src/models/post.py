@@ -7,6 +7,10 @@ from models.user import db
 
 class Post(db.Model):
     __tablename__ = 'posts'
+    __table_args__ = (
+        # 列表依建立時間排序與keyset分頁（ORDER BY created_at DESC, id DESC）
+        db.Index('ix_posts_created_id', 'created_at', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
@@ -1,20 +1,51 @@
-from flask import Blueprint, request, jsonify, current_app
-import openai
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
 import uuid
 from datetime import datetime
 import json
 import os
-import requests
-from models.ai_chat import ChatSession, ChatMessage, AISettings, db
+import mimetypes
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy.orm import selectinload
+from models.ai_chat import ChatSession, ChatMessage, ChatAttachment, AISettings, db
+from models.ai_config import AIConfig
+from models.post import Post
+from routes.ai_mock import mock_chat_response, mock_generated_content
+from routes.file_upload import (
+    FileProcessingError, spool_base64, upload_file_to_cloudinary, process_gdrive_url, reextract_uploaded_file
+)
+from utils.circuit_breaker import CircuitOpenError
+from utils.images import IMAGE_DETAIL, image_preparer
+from utils.openai_clients import openai_clients, openai_breaker, breaker_client, is_retryable_error
+from utils.response_cache import generate_content_cache
+from utils.retrieval import document_retriever, format_chunks
+from utils import job_queue
+from utils.pagination import InvalidCursor, encode_cursor, keyset_rows, parse_limit
+from utils.upload_index import upload_index
+from utils.tokens import (
+    count_tokens, count_content_tokens, truncate_to_tokens, get_prompt_budget,
+    MESSAGE_OVERHEAD_TOKENS, IMAGE_TOKENS
+)
 
 ai_chat_bp = Blueprint('ai_chat', __name__)
 
 # 初始化OpenAI客戶端
-def get_openai_client():
-    api_key = get_ai_setting('openai_api_key')
+def get_openai_client(user_id=None):
+    """從登錄表獲取可重用的OpenAI客戶端（共用keep-alive連線池）"""
+    api_key = None
+    owner = 'global'
+    if user_id is not None:
+        # 優先使用用戶的AI配置（已解密憑證有行程內快取）
+        credentials = AIConfig.get_cached_credentials(user_id)
+        if credentials and credentials.get('openai_api_key'):
+            api_key = credentials['openai_api_key']
+            owner = f'user:{user_id}'
+    if not api_key:
+        api_key = get_ai_setting('openai_api_key')
     if not api_key:
         raise ValueError("OpenAI API key not configured")
-    return openai.OpenAI(api_key=api_key)
+    # 可指向OpenAI相容的端點（例如壓力測試用的本機stub），未設定時使用OPENAI_BASE_URL
+    base_url = get_ai_setting('openai_base_url')
+    return openai_clients.get(api_key, owner=owner, base_url=base_url)
 
 def get_ai_setting(key):
     setting = AISettings.query.filter_by(setting_key=key).first()
@@ -25,12 +56,36 @@ def get_chat_sessions():
     """獲取聊天會話列表"""
     try:
         user_id = request.args.get('user_id', 'anonymous')
-        sessions = ChatSession.query.filter_by(user_id=user_id, is_active=True).order_by(ChatSession.updated_at.desc()).all()
+        limit = parse_limit(request.args.get('limit'), default=50)
+        
+        # keyset分頁：依(updated_at, id)由新到舊
+        sessions = keyset_rows(
+            ChatSession.query.filter_by(user_id=user_id, is_active=True),
+            ChatSession.updated_at, ChatSession.id,
+            request.args.get('cursor'), limit + 1
+        )
+        has_more = len(sessions) > limit
+        sessions = sessions[:limit]
+        
+        # 一次查詢取得本頁所有會話的訊息數
+        counts = ChatSession.count_messages([session.session_id for session in sessions])
+        
+        next_cursor = None
+        if has_more:
+            last = sessions[-1]
+            next_cursor = encode_cursor(last.updated_at, last.id)
         
         return jsonify({
             'success': True,
-            'data': [session.to_dict() for session in sessions]
+            'data': [session.to_dict(message_count=counts.get(session.session_id, 0)) for session in sessions],
+            'pagination': {
+                'limit': limit,
+                'has_more': has_more,
+                'next_cursor': next_cursor
+            }
         })
+    except InvalidCursor as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -55,7 +110,7 @@ def create_chat_session():
         
         return jsonify({
             'success': True,
-            'data': new_session.to_dict()
+            'data': new_session.to_dict(message_count=0)
         })
     except Exception as e:
         db.session.rollback()
@@ -65,284 +120,881 @@ def create_chat_session():
 def get_chat_messages(session_id):
     """獲取聊天訊息"""
     try:
-        messages = ChatMessage.query.filter_by(session_id=session_id).order_by(ChatMessage.timestamp.asc()).all()
+        limit = parse_limit(request.args.get('limit'), default=50, maximum=200)
+        before = request.args.get('before')
+        after = request.args.get('after')
+        query = ChatMessage.query.filter_by(session_id=session_id).options(
+            selectinload(ChatMessage.attachments)
+        )
+        
+        if after:
+            # 較新的訊息（由舊到新）
+            messages = keyset_rows(query, ChatMessage.timestamp, ChatMessage.id, after, limit + 1, newest_first=False)
+            has_more_after = len(messages) > limit
+            messages = messages[:limit]
+            has_more_before = True
+        else:
+            # 最新一頁或較舊的訊息：由新到舊取出後反轉
+            messages = keyset_rows(query, ChatMessage.timestamp, ChatMessage.id, before, limit + 1)
+            has_more_before = len(messages) > limit
+            messages = messages[:limit]
+            messages.reverse()
+            has_more_after = bool(before)
+        
+        first = messages[0] if messages else None
+        last = messages[-1] if messages else None
         
         return jsonify({
             'success': True,
-            'data': [message.to_dict() for message in messages]
+            'data': [message.to_dict() for message in messages],
+            'pagination': {
+                'limit': limit,
+                'has_more_before': has_more_before and bool(messages),
+                'has_more_after': has_more_after,
+                # 以before_cursor載入更早的訊息，以after_cursor載入更新的訊息
+                'before_cursor': encode_cursor(first.timestamp, first.id) if first else before,
+                'after_cursor': encode_cursor(last.timestamp, last.id) if last else after
+            }
         })
+    except InvalidCursor as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@ai_chat_bp.route('/chat/sessions/<session_id>/messages', methods=['POST'])
-def send_chat_message(session_id):
-    """發送聊天訊息並獲取AI回應（支援多模態輸入）"""
-    try:
-        data = request.get_json()
-        user_message = data.get('message', '').strip()
-        files = data.get('files', [])  # 上傳的文件
-        gdrive_links = data.get('gdrive_links', [])  # Google Drive連結
-        
-        # 檢查是否有任何內容
-        if not user_message and not files and not gdrive_links:
-            return jsonify({'success': False, 'error': '請提供訊息、文件或連結'}), 400
-        
-        # 檢查會話是否存在
-        session = ChatSession.query.filter_by(session_id=session_id).first()
-        if not session:
-            return jsonify({'success': False, 'error': '會話不存在'}), 404
-        
-        # 處理上傳的文件
-        processed_files = []
-        for file_info in files:
-            try:
-                # 上傳文件到Cloudinary並提取內容
-                upload_response = requests.post(
-                    f"{request.host_url}api/upload-file",
-                    files={'file': file_info},
-                    data={'session_id': session_id}
-                )
-                if upload_response.status_code == 200:
-                    upload_data = upload_response.json()
-                    if upload_data['success']:
-                        processed_files.append(upload_data['data'])
-            except Exception as e:
-                current_app.logger.error(f"文件處理錯誤: {str(e)}")
-        
-        # 處理Google Drive連結
-        processed_gdrive = []
-        for link in gdrive_links:
-            try:
-                gdrive_response = requests.post(
-                    f"{request.host_url}api/process-gdrive-link",
-                    json={'url': link, 'session_id': session_id}
-                )
-                if gdrive_response.status_code == 200:
-                    gdrive_data = gdrive_response.json()
-                    if gdrive_data['success']:
-                        processed_gdrive.append(gdrive_data['data'])
-            except Exception as e:
-                current_app.logger.error(f"Google Drive連結處理錯誤: {str(e)}")
-        
-        # 構建完整的用戶訊息內容
-        full_user_content = []
-        
-        # 添加文字訊息
-        if user_message:
+SYSTEM_PROMPT = "你是七七七科技後台管理系統的AI助手。你可以幫助用戶管理社群貼文、行銷活動、營運項目等。你能夠理解和分析圖片、文檔內容，並提供專業且有用的建議。請用繁體中文回答。"
+AI_UNAVAILABLE_MESSAGE = "抱歉，AI服務暫時不可用，請稍後再試。"
+
+# 附件處理的執行緒池（上傳與下載皆為I/O等待，可並行處理）
+ATTACHMENT_WORKERS = int(os.environ.get('CHAT_ATTACHMENT_WORKERS', 4))
+attachment_executor = ThreadPoolExecutor(max_workers=ATTACHMENT_WORKERS, thread_name_prefix='chat-attachment')
+
+def upload_chat_file(file_info, session_id):
+    """處理聊天訊息中的單一文件（已上傳的結果或base64/data URL內容）"""
+    if not isinstance(file_info, dict):
+        raise FileProcessingError('不支援的文件格式')
+    
+    # 已透過 /upload-file 上傳的文件：網址與提取的文字一律取自伺服器的上傳記錄，
+    # 不採用用戶端傳來的content等欄位
+    if file_info.get('url'):
+        asset = upload_index.find(file_info['url'], file_info.get('public_id'))
+        if not asset:
+            raise FileProcessingError('找不到已上傳的文件記錄，請重新上傳')
+        text, truncated = asset['text'], asset['content_truncated']
+        if asset['text_evicted']:
+            # 提取的文字已被淘汰：從上傳記錄的網址重新下載並提取
+            text, truncated = reextract_uploaded_file(asset)
+        return {
+            'url': asset['url'],
+            'public_id': asset['public_id'],
+            'type': asset['file_type'],
+            'size': asset['size'],
+            'resource_type': asset['resource_type'],
+            'content': text,
+            'content_truncated': truncated,
+            'deduplicated': True
+        }
+    
+    filename = file_info.get('name') or file_info.get('filename')
+    content_type = file_info.get('type') or file_info.get('content_type')
+    encoded = file_info.get('data') or ''
+    if encoded.startswith('data:'):
+        # data:<mime>;base64,<內容>
+        header, encoded = encoded.split(',', 1)
+        content_type = content_type or header[5:].split(';')[0] or None
+    
+    content_type = content_type or (mimetypes.guess_type(filename)[0] if filename else None)
+    spooled = spool_base64(encoded, content_type)
+    return upload_file_to_cloudinary(spooled, filename, content_type=content_type, session_id=session_id)
+
+def run_in_app_context(app, fn, *args):
+    """在執行緒池中以應用程式上下文執行（附件處理需查詢上傳去重索引）"""
+    with app.app_context():
+        try:
+            return fn(*args)
+        finally:
+            db.session.remove()
+
+def process_attachments(session_id, files, gdrive_links):
+    """並行處理上傳的文件與Google Drive連結（直接呼叫服務函式，不經過HTTP）"""
+    app = current_app._get_current_object()
+    file_futures = [
+        attachment_executor.submit(run_in_app_context, app, upload_chat_file, file_info, session_id)
+        for file_info in files
+    ]
+    gdrive_futures = [
+        attachment_executor.submit(run_in_app_context, app, process_gdrive_url, link, session_id)
+        for link in gdrive_links
+    ]
+    
+    # 依原始順序收集結果，總延遲取決於最慢的附件
+    processed_files = []
+    for future in file_futures:
+        try:
+            processed_files.append(future.result())
+        except Exception as e:
+            current_app.logger.error(f"文件處理錯誤: {str(e)}")
+    
+    processed_gdrive = []
+    for future in gdrive_futures:
+        try:
+            processed_gdrive.append(future.result())
+        except Exception as e:
+            current_app.logger.error(f"Google Drive連結處理錯誤: {str(e)}")
+    
+    return processed_files, processed_gdrive
+
+def build_user_content(user_message, processed_files, processed_gdrive, document_context=None):
+    """構建完整的用戶訊息內容（多模態）
+
+    文件與Google Drive文件的文字不直接放入，改由document_context
+    （會話文件檢索出的相關段落）提供。
+    """
+    full_user_content = []
+    
+    # 添加文字訊息
+    if user_message:
+        full_user_content.append({
+            "type": "text",
+            "text": user_message
+        })
+    
+    # 添加圖片
+    for file_data in processed_files:
+        if file_data['resource_type'] == 'image':
+            full_user_content.append({
+                "type": "image_url",
+                "image_url": {
+                    "url": file_data['url']
+                }
+            })
+    
+    # 添加Google Drive圖片
+    for gdrive_data in processed_gdrive:
+        if gdrive_data['type'] == 'image':
             full_user_content.append({
-                "type": "text",
-                "text": user_message
+                "type": "image_url",
+                "image_url": {
+                    "url": gdrive_data['url']
+                }
             })
+    
+    # 添加相關的文件段落
+    if document_context:
+        full_user_content.append({
+            "type": "text",
+            "text": document_context
+        })
+    
+    return full_user_content
+
+def build_user_message(session_id, user_message, processed_files, processed_gdrive):
+    """建立用戶訊息與附件（尚未加入資料庫session），並將文件文字切成段落
+
+    回傳(user_msg, 本回合新增的段落)。
+    """
+    user_msg = ChatMessage(
+        session_id=session_id,
+        role='user',
+        content=user_message
+    )
+    new_chunks = []
+    position = 0
+    for source, results in (('file', processed_files), ('gdrive', processed_gdrive)):
+        for result in results:
+            attachment = ChatAttachment.from_result(source, position, result)
+            user_msg.attachments.append(attachment)
+            position += 1
+            if attachment.extracted_text and attachment.resource_type != 'image':
+                if source == 'file':
+                    label = f"文件: {result.get('type') or '未知類型'}"
+                else:
+                    label = "Google Drive文件"
+                new_chunks += document_retriever.build_chunks(session_id, attachment, label)
+    return user_msg, new_chunks
+
+def fit_user_content(full_user_content, budget):
+    """將目前訊息限制在token預算內（依序保留，超出時截斷文字、略過圖片）"""
+    if count_content_tokens(full_user_content) <= budget:
+        return full_user_content
+    
+    remaining = budget - MESSAGE_OVERHEAD_TOKENS
+    fitted = []
+    for part in full_user_content:
+        if part["type"] == "image_url":
+            if IMAGE_TOKENS <= remaining:
+                fitted.append(part)
+                remaining -= IMAGE_TOKENS
+            continue
         
-        # 添加圖片
-        for file_data in processed_files:
-            if file_data['resource_type'] == 'image':
-                full_user_content.append({
-                    "type": "image_url",
-                    "image_url": {
-                        "url": file_data['url']
-                    }
-                })
-            elif file_data.get('content'):  # 文檔內容
-                full_user_content.append({
-                    "type": "text",
-                    "text": f"[文件內容: {file_data.get('type', '未知類型')}]\n{file_data['content']}"
-                })
-        
-        # 添加Google Drive內容
-        for gdrive_data in processed_gdrive:
-            if gdrive_data['type'] == 'image':
-                full_user_content.append({
-                    "type": "image_url",
-                    "image_url": {
-                        "url": gdrive_data['url']
-                    }
-                })
-            elif gdrive_data.get('content'):
-                full_user_content.append({
-                    "type": "text",
-                    "text": f"[Google Drive文件內容]\n{gdrive_data['content']}"
-                })
-        
-        # 儲存用戶訊息（包含文件和連結資訊）
-        user_content_json = {
-            'message': user_message,
-            'files': processed_files,
-            'gdrive_links': processed_gdrive
+        text = truncate_to_tokens(part["text"], remaining)
+        if text:
+            fitted.append({"type": "text", "text": text})
+            remaining -= count_tokens(text)
+    return fitted
+
+def build_prompt_messages(session_id, full_user_content, model):
+    """準備OpenAI API請求的訊息列表（系統提示、歷史對話與目前訊息）
+
+    依模型的token預算，由新到舊放入歷史訊息，直到預算用盡為止。
+    """
+    budget = get_prompt_budget(model, current_app.config.get('CHAT_PROMPT_TOKEN_BUDGET'))
+    
+    system_message = {
+        "role": "system",
+        "content": SYSTEM_PROMPT
+    }
+    budget -= count_content_tokens(SYSTEM_PROMPT)
+    
+    # 當前用戶訊息（包含附件文字）優先放入
+    full_user_content = fit_user_content(full_user_content, budget)
+    if len(full_user_content) == 1 and full_user_content[0]["type"] == "text":
+        # 純文字訊息
+        current_message = {
+            "role": "user",
+            "content": full_user_content[0]["text"]
         }
-        
-        user_msg = ChatMessage(
-            session_id=session_id,
-            role='user',
-            content=json.dumps(user_content_json, ensure_ascii=False)
-        )
-        db.session.add(user_msg)
-        
-        # 獲取歷史訊息
-        history_messages = ChatMessage.query.filter_by(session_id=session_id).order_by(ChatMessage.timestamp.asc()).all()
-        
-        # 準備OpenAI API請求
-        messages = [
-            {
-                "role": "system",
-                "content": "你是七七七科技後台管理系統的AI助手。你可以幫助用戶管理社群貼文、行銷活動、營運項目等。你能夠理解和分析圖片、文檔內容，並提供專業且有用的建議。請用繁體中文回答。"
+    else:
+        # 多模態訊息
+        current_message = {
+            "role": "user",
+            "content": full_user_content
+        }
+    budget -= count_content_tokens(current_message["content"])
+    
+    # 獲取候選歷史訊息（只在SQL層取出最近的視窗）
+    history_window = current_app.config.get('CHAT_HISTORY_WINDOW', 50)
+    candidates = ChatMessage.get_recent(session_id, history_window)
+    
+    # 由新到舊放入歷史對話，直到token預算用盡
+    history = []
+    for msg in reversed(candidates):
+        tokens = msg.token_count or msg.compute_token_count()
+        if tokens > budget:
+            break
+        budget -= tokens
+        history.append({
+            "role": msg.role,
+            "content": msg.prompt_text()
+        })
+    history.reverse()
+    
+    return [system_message] + history + [current_message]
+
+def select_model(full_user_content):
+    """依是否包含圖片決定使用的模型與max_tokens"""
+    has_images = any(
+        content.get("type") == "image_url"
+        for content in (full_user_content if isinstance(full_user_content, list) else [])
+    )
+    
+    if has_images:
+        # 使用GPT-4V處理圖片
+        return "gpt-4-vision-preview", 1000
+    # 使用標準模型
+    return "gpt-3.5-turbo", 1000
+
+def prepare_images(full_user_content, model):
+    """將圖片替換為依模型縮圖、重新編碼後的版本（Cloudinary轉換網址或本機縮圖）"""
+    prepared = []
+    for part in full_user_content:
+        if part["type"] == "image_url":
+            part = {
+                "type": "image_url",
+                "image_url": {
+                    "url": image_preparer.prepare_url(part["image_url"]["url"], model),
+                    "detail": IMAGE_DETAIL
+                }
             }
-        ]
+        prepared.append(part)
+    return prepared
+
+class ChatRequestError(Exception):
+    """聊天請求無效（附帶建議的HTTP狀態碼）"""
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+def validate_chat_request(session_id, data):
+    """檢查請求內容與會話，回傳ChatSession"""
+    user_message = (data.get('message') or '').strip()
+    
+    # 檢查是否有任何內容
+    if not user_message and not data.get('files') and not data.get('gdrive_links'):
+        raise ChatRequestError('請提供訊息、文件或連結')
+    
+    # 檢查會話是否存在
+    session = ChatSession.query.filter_by(session_id=session_id).first()
+    if not session:
+        raise ChatRequestError('會話不存在', 404)
+    return session
+
+def prepare_chat_turn(session_id, data):
+    """驗證請求、處理附件並建立用戶訊息（尚未加入資料庫session），回傳回合資料
+
+    用戶訊息在呼叫模型後才與AI回應一併寫入（見save_assistant_message），
+    避免等待模型回應期間持有SQLite的寫入鎖。
+    """
+    session = validate_chat_request(session_id, data)
+    user_message = (data.get('message') or '').strip()
+    files = data.get('files', [])  # 上傳的文件
+    gdrive_links = data.get('gdrive_links', [])  # Google Drive連結
+    
+    processed_files, processed_gdrive = process_attachments(session_id, files, gdrive_links)
+    
+    # 用戶訊息與附件（文字與附件分開儲存，文件文字切成段落）
+    user_msg, new_chunks = build_user_message(session_id, user_message, processed_files, processed_gdrive)
+    
+    # 只將與目前問題相關的文件段落放入提示詞（含先前回合上傳的文件）
+    retrieved = document_retriever.retrieve(session_id, user_message, new_chunks)
+    full_user_content = build_user_content(
+        user_message, processed_files, processed_gdrive, format_chunks(retrieved)
+    )
+    model, max_tokens = select_model(full_user_content)
+    full_user_content = prepare_images(full_user_content, model)
+    
+    # 在寫入目前訊息之前組裝提示詞，避免目前訊息同時出現在歷史對話中
+    messages = build_prompt_messages(session_id, full_user_content, model)
+    
+    return {
+        'session': session,
+        'user_msg': user_msg,
+        'user_message': user_message,
+        'processed_files': processed_files,
+        'processed_gdrive': processed_gdrive,
+        'full_user_content': full_user_content,
+        'model': model,
+        'max_tokens': max_tokens,
+        'messages': messages
+    }
+
+def user_message_payload(turn):
+    """用戶訊息的回應格式"""
+    user_msg = turn['user_msg']
+    return {
+        'id': user_msg.id,
+        'content': turn['user_message'],
+        'files': turn['processed_files'],
+        'gdrive_links': turn['processed_gdrive'],
+        'timestamp': user_msg.timestamp.isoformat() if user_msg.timestamp else None
+    }
+
+def call_model(client, **kwargs):
+    """透過斷路器呼叫Chat Completions（可重試的錯誤會以退避重試）
+
+    客戶端不自行重試且每次嘗試的逾時較短，每次嘗試的結果都計入斷路器統計。
+    """
+    return openai_breaker.call(
+        breaker_client(client).chat.completions.create, is_retryable=is_retryable_error, **kwargs
+    )
+
+def request_chat_completion(turn, **kwargs):
+    """以回合資料呼叫OpenAI Chat Completions"""
+    client = get_openai_client(turn['session'].user_id)
+    return call_model(
+        client,
+        model=turn['model'],
+        messages=turn['messages'],
+        max_tokens=turn['max_tokens'],
+        temperature=0.7,
+        **kwargs
+    )
+
+def is_async_request(data):
+    """請求是否要求以背景工作執行（async=true）"""
+    value = data.get('async', request.args.get('async', 'false'))
+    return str(value).lower() == 'true'
+
+def job_accepted_response(job):
+    """背景工作已排入佇列的202回應"""
+    return jsonify({
+        'success': True,
+        'data': {
+            'job_id': job.id,
+            'status': job.status,
+            'status_url': f"/api/ai/jobs/{job.id}"
+        }
+    }), 202
+
+def fallback_chat_response(turn):
+    """斷路器開啟時改用範本回應，不等待上游逾時"""
+    openai_breaker.record_fallback()
+    return mock_chat_response(turn['user_message'])
+
+def save_assistant_message(turn, ai_response):
+    """儲存用戶訊息（尚未寫入時）與AI回應並更新會話時間"""
+    db.session.add(turn['user_msg'])
+    ai_msg = ChatMessage(
+        session_id=turn['session'].session_id,
+        role='assistant',
+        content=ai_response
+    )
+    db.session.add(ai_msg)
+    
+    # 更新會話時間
+    turn['session'].updated_at = datetime.utcnow()
+    
+    # 背景工作已被取消時不寫入對話紀錄
+    job_queue.commit_unless_cancelled()
+    return ai_msg
+
+@ai_chat_bp.route('/chat/sessions/<session_id>/messages', methods=['POST'])
+def send_chat_message(session_id):
+    """發送聊天訊息並獲取AI回應（支援多模態輸入）"""
+    try:
+        data = request.get_json()
         
-        # 添加歷史對話（限制最近10條，避免token過多）
-        for msg in history_messages[-10:]:
-            try:
-                # 嘗試解析JSON格式的訊息
-                msg_data = json.loads(msg.content)
-                if msg.role == 'user' and isinstance(msg_data, dict):
-                    # 用戶訊息，簡化顯示
-                    text_content = msg_data.get('message', '')
-                    if msg_data.get('files'):
-                        text_content += f" [包含{len(msg_data['files'])}個文件]"
-                    if msg_data.get('gdrive_links'):
-                        text_content += f" [包含{len(msg_data['gdrive_links'])}個Google Drive連結]"
-                    messages.append({
-                        "role": msg.role,
-                        "content": text_content
-                    })
-                else:
-                    messages.append({
-                        "role": msg.role,
-                        "content": msg.content
-                    })
-            except (json.JSONDecodeError, TypeError):
-                # 舊格式訊息，直接使用
-                messages.append({
-                    "role": msg.role,
-                    "content": msg.content
-                })
-        
-        # 添加當前用戶訊息
-        if len(full_user_content) == 1 and full_user_content[0]["type"] == "text":
-            # 純文字訊息
-            messages.append({
-                "role": "user",
-                "content": full_user_content[0]["text"]
-            })
-        else:
-            # 多模態訊息
-            messages.append({
-                "role": "user",
-                "content": full_user_content
+        # 背景執行：只做基本驗證，AI呼叫交由工作者處理
+        if is_async_request(data):
+            validate_chat_request(session_id, data)
+            job = job_queue.enqueue('chat_message', {
+                'session_id': session_id,
+                'message': data.get('message', ''),
+                'files': data.get('files', []),
+                'gdrive_links': data.get('gdrive_links', [])
             })
+            return job_accepted_response(job)
+        
+        turn = prepare_chat_turn(session_id, data)
+        fallback = False
         
         # 調用OpenAI API
         try:
-            client = get_openai_client()
-            
-            # 檢查是否有圖片內容，決定使用的模型
-            has_images = any(
-                content.get("type") == "image_url" 
-                for content in (full_user_content if isinstance(full_user_content, list) else [])
-            )
-            
-            if has_images:
-                # 使用GPT-4V處理圖片
-                model = "gpt-4-vision-preview"
-                max_tokens = 1000
-            else:
-                # 使用標準模型
-                model = "gpt-3.5-turbo"
-                max_tokens = 1000
-            
-            response = client.chat.completions.create(
-                model=model,
-                messages=messages,
-                max_tokens=max_tokens,
-                temperature=0.7
-            )
+            response = request_chat_completion(turn)
             ai_response = response.choices[0].message.content
-                
+        
+        except CircuitOpenError:
+            ai_response = fallback_chat_response(turn)
+            fallback = True
         except Exception as openai_error:
             current_app.logger.error(f"OpenAI API error: {str(openai_error)}")
-            ai_response = "抱歉，AI服務暫時不可用，請稍後再試。"
-        
-        # 儲存AI回應
-        ai_msg = ChatMessage(
-            session_id=session_id,
-            role='assistant',
-            content=ai_response
-        )
-        db.session.add(ai_msg)
-        
-        # 更新會話時間
-        session.updated_at = datetime.utcnow()
+            ai_response = AI_UNAVAILABLE_MESSAGE
         
-        db.session.commit()
+        ai_msg = save_assistant_message(turn, ai_response)
         
         return jsonify({
             'success': True,
             'data': {
-                'user_message': {
-                    'id': user_msg.id,
-                    'content': user_message,
-                    'files': processed_files,
-                    'gdrive_links': processed_gdrive,
-                    'timestamp': user_msg.timestamp.isoformat()
-                },
-                'ai_response': ai_msg.to_dict()
+                'user_message': user_message_payload(turn),
+                'ai_response': ai_msg.to_dict(),
+                'fallback': fallback
             }
         })
         
+    except ChatRequestError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': e.message}), e.status_code
     except Exception as e:
         db.session.rollback()
         current_app.logger.error(f"Chat error: {str(e)}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@ai_chat_bp.route('/chat/generate-content', methods=['POST'])
-def generate_content():
-    """AI內容生成功能"""
+def run_chat_message_job(payload):
+    """背景工作：處理聊天訊息並儲存AI回應（OpenAI失敗時拋出例外以便重試）"""
     try:
-        data = request.get_json()
-        content_type = data.get('type', 'post')  # post, marketing, operation
-        prompt = data.get('prompt', '')
-        platform = data.get('platform', 'facebook')
-        
-        if not prompt:
-            return jsonify({'success': False, 'error': '請提供內容提示'}), 400
-        
-        # 根據內容類型和平台調整提示詞
-        system_prompts = {
-            'post': f"你是一個專業的社群媒體內容創作者。請為{platform}平台創作一篇貼文，要求：1.吸引人的標題 2.有趣且有價值的內容 3.適當的hashtag 4.符合平台特色。請用繁體中文回答。",
-            'marketing': "你是一個行銷專家。請創作行銷活動內容，包含：1.活動主題 2.目標受眾 3.活動內容 4.預期效果。請用繁體中文回答。",
-            'operation': "你是一個營運專家。請創作營運計畫內容，包含：1.項目目標 2.執行步驟 3.時程安排 4.成功指標。請用繁體中文回答。"
-        }
+        turn = prepare_chat_turn(payload['session_id'], payload)
+    except ChatRequestError as e:
+        raise job_queue.PermanentJobError(e.message)
+    
+    fallback = False
+    try:
+        response = request_chat_completion(turn)
+        ai_response = response.choices[0].message.content
+    except CircuitOpenError:
+        ai_response = fallback_chat_response(turn)
+        fallback = True
+    
+    ai_msg = save_assistant_message(turn, ai_response)
+    return {
+        'user_message': user_message_payload(turn),
+        'ai_response': ai_msg.to_dict(),
+        'fallback': fallback
+    }
+
+job_queue.register_handler('chat_message', run_chat_message_job)
+
+def sse_event(event, data):
+    """格式化一則Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@ai_chat_bp.route('/chat/sessions/<session_id>/messages/stream', methods=['POST'])
+def stream_chat_message(session_id):
+    """發送聊天訊息並以Server-Sent Events逐段回傳AI回應"""
+    try:
+        turn = prepare_chat_turn(session_id, request.get_json())
         
+        # 先提交用戶訊息，串流中斷時對話紀錄仍然完整
+        db.session.add(turn['user_msg'])
+        db.session.commit()
+    except ChatRequestError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': e.message}), e.status_code
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Chat error: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+    
+    def generate():
+        chunks = []
+        stream = None
+        completed = False
         try:
-            client = get_openai_client()
-            response = client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": system_prompts.get(content_type, system_prompts['post'])},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=800,
-                temperature=0.8
-            )
+            yield sse_event('start', {'user_message': user_message_payload(turn)})
             
-            generated_content = response.choices[0].message.content
+            try:
+                stream = request_chat_completion(turn, stream=True)
+                for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        chunks.append(delta)
+                        yield sse_event('delta', {'content': delta})
+            except CircuitOpenError:
+                fallback_response = fallback_chat_response(turn)
+                chunks.append(fallback_response)
+                yield sse_event('delta', {'content': fallback_response, 'fallback': True})
+            except Exception as openai_error:
+                if stream is not None and openai_breaker.is_failure(openai_error):
+                    # 串流中途中斷也計入斷路器的錯誤率
+                    openai_breaker.record_failure(openai_error)
+                current_app.logger.error(f"OpenAI API error: {str(openai_error)}")
+                if not chunks:
+                    chunks.append(AI_UNAVAILABLE_MESSAGE)
+                    yield sse_event('delta', {'content': AI_UNAVAILABLE_MESSAGE})
             
-            return jsonify({
-                'success': True,
-                'data': {
-                    'content': generated_content,
+            ai_msg = save_assistant_message(turn, ''.join(chunks))
+            completed = True
+            yield sse_event('done', {'ai_response': ai_msg.to_dict()})
+        finally:
+            if stream is not None:
+                # 用戶端中斷時關閉上游連線，停止繼續產生token
+                stream.close()
+            if not completed:
+                try:
+                    if chunks:
+                        # 保留中斷前已收到的部分回應
+                        save_assistant_message(turn, ''.join(chunks))
+                    else:
+                        db.session.rollback()
+                except Exception as e:
+                    db.session.rollback()
+                    current_app.logger.error(f"Chat stream cleanup error: {str(e)}")
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+def generate_content_result(data):
+    """依內容類型與平台生成內容（含回應快取），OpenAI錯誤會直接拋出"""
+    content_type = data.get('type', 'post')  # post, marketing, operation
+    prompt = data.get('prompt', '')
+    platform = data.get('platform', 'facebook')
+    
+    if not prompt:
+        raise ChatRequestError('請提供內容提示')
+    
+    # 根據內容類型和平台調整提示詞
+    system_prompts = {
+        'post': f"你是一個專業的社群媒體內容創作者。請為{platform}平台創作一篇貼文，要求：1.吸引人的標題 2.有趣且有價值的內容 3.適當的hashtag 4.符合平台特色。請用繁體中文回答。",
+        'marketing': "你是一個行銷專家。請創作行銷活動內容，包含：1.活動主題 2.目標受眾 3.活動內容 4.預期效果。請用繁體中文回答。",
+        'operation': "你是一個營運專家。請創作營運計畫內容，包含：1.項目目標 2.執行步驟 3.時程安排 4.成功指標。請用繁體中文回答。"
+    }
+    
+    model = "gpt-3.5-turbo"
+    temperature = 0.8
+    
+    # 查詢回應快取（fresh=true時略過）
+    fresh = str(data.get('fresh', 'false')).lower() == 'true'
+    cache_key = None
+    if generate_content_cache.enabled:
+        cache_key = generate_content_cache.make_key(content_type, platform, model, temperature, prompt)
+        if fresh:
+            generate_content_cache.record_bypass()
+        else:
+            try:
+                cached_content = generate_content_cache.get(cache_key)
+            except Exception as cache_error:
+                db.session.rollback()
+                current_app.logger.error(f"Response cache error: {str(cache_error)}")
+                cached_content = None
+            if cached_content is not None:
+                return {
+                    'content': cached_content,
                     'type': content_type,
-                    'platform': platform
+                    'platform': platform,
+                    'cached': True,
+                    'fallback': False
                 }
+    
+    client = get_openai_client(data.get('user_id'))
+    try:
+        response = call_model(
+            client,
+            model=model,
+            messages=[
+                {"role": "system", "content": system_prompts.get(content_type, system_prompts['post'])},
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=800,
+            temperature=temperature
+        )
+    except CircuitOpenError:
+        # 斷路器開啟時改用範本內容（不寫入快取）
+        openai_breaker.record_fallback()
+        return {
+            'content': mock_generated_content(content_type),
+            'type': content_type,
+            'platform': platform,
+            'cached': False,
+            'fallback': True
+        }
+    
+    generated_content = response.choices[0].message.content
+    
+    if cache_key and generated_content:
+        try:
+            generate_content_cache.set(
+                cache_key, generated_content,
+                content_type=content_type, platform=platform, model=model
+            )
+        except Exception as cache_error:
+            db.session.rollback()
+            current_app.logger.error(f"Response cache error: {str(cache_error)}")
+    
+    return {
+        'content': generated_content,
+        'type': content_type,
+        'platform': platform,
+        'cached': False,
+        'fallback': False
+    }
+
+@ai_chat_bp.route('/chat/generate-content', methods=['POST'])
+def generate_content():
+    """AI內容生成功能"""
+    try:
+        data = request.get_json()
+        if 'fresh' not in data and request.args.get('fresh'):
+            data['fresh'] = request.args.get('fresh')
+        
+        # 背景執行：只做基本驗證，AI呼叫交由工作者處理
+        if is_async_request(data):
+            if not data.get('prompt'):
+                return jsonify({'success': False, 'error': '請提供內容提示'}), 400
+            job = job_queue.enqueue('generate_content', {
+                key: data[key]
+                for key in ('type', 'prompt', 'platform', 'fresh', 'user_id')
+                if key in data
             })
-            
+            return job_accepted_response(job)
+        
+        try:
+            result = generate_content_result(data)
+        except ChatRequestError:
+            raise
         except Exception as openai_error:
             current_app.logger.error(f"OpenAI API error: {str(openai_error)}")
             return jsonify({'success': False, 'error': 'AI服務暫時不可用'}), 500
-            
+        
+        return jsonify({
+            'success': True,
+            'data': result
+        })
+        
+    except ChatRequestError as e:
+        return jsonify({'success': False, 'error': e.message}), e.status_code
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def run_generate_content_job(payload):
+    """背景工作：生成內容（OpenAI失敗時拋出例外以便重試）"""
+    try:
+        return generate_content_result(payload)
+    except ChatRequestError as e:
+        raise job_queue.PermanentJobError(e.message)
+
+job_queue.register_handler('generate_content', run_generate_content_job)
+
+# 各平台欄位與字數限制
+PLATFORM_VARIANTS = {
+    'facebook': {'column': 'fb_content', 'name': 'Facebook', 'max_length': 2000},
+    'instagram': {'column': 'ig_content', 'name': 'Instagram', 'max_length': 2200},
+    'tiktok': {'column': 'tiktok_content', 'name': 'TikTok', 'max_length': 2200},
+    'threads': {'column': 'threads_content', 'name': 'Threads', 'max_length': 500},
+    'x': {'column': 'x_content', 'name': 'X (Twitter)', 'max_length': 280}
+}
+
+# 多平台版本生成的執行緒池（同時進行的模型呼叫數上限）
+VARIANT_WORKERS = int(os.environ.get('POST_VARIANT_WORKERS', 5))
+variant_executor = ThreadPoolExecutor(max_workers=VARIANT_WORKERS, thread_name_prefix='post-variant')
+
+def enforce_length(text, max_length):
+    """將內容限制在平台字數內，盡量在句尾或換行處截斷"""
+    text = (text or '').strip()
+    if len(text) <= max_length:
+        return text
+    
+    cut = text[:max_length]
+    boundary = max(cut.rfind(mark) for mark in '。！？!?\n')
+    if boundary >= max_length // 2:
+        return cut[:boundary + 1].rstrip()
+    return cut[:max_length - 1].rstrip() + '…'
+
+def generate_platform_variant(client, platform, title, content):
+    """為單一平台生成貼文版本（在執行緒池中執行，不使用應用程式上下文）"""
+    rule = PLATFORM_VARIANTS[platform]
+    response = call_model(
+        client,
+        model="gpt-3.5-turbo",
+        messages=[
+            {
+                "role": "system",
+                "content": f"你是一個專業的社群媒體內容創作者。請將貼文改寫為適合{rule['name']}平台的版本，"
+                           f"符合平台特色並加上適當的hashtag，總長度不可超過{rule['max_length']}個字元。"
+                           "只輸出貼文內容。請用繁體中文回答。"
+            },
+            {"role": "user", "content": f"標題：{title}\n\n內容：\n{content}"}
+        ],
+        max_tokens=800,
+        temperature=0.8
+    )
+    return enforce_length(response.choices[0].message.content, rule['max_length'])
+
+def generate_post_variants(data):
+    """並行生成多個平台的貼文版本，指定post_id時於單一交易中寫回Post"""
+    post = None
+    if data.get('post_id'):
+        post = db.session.get(Post, data['post_id'])
+        if not post:
+            raise ChatRequestError('貼文不存在', 404)
+    
+    title = data.get('title') or (post.title if post else '')
+    content = data.get('content') or (post.content if post else '')
+    if not content:
+        raise ChatRequestError('請提供貼文內容或貼文ID')
+    
+    platforms = data.get('platforms') or list(PLATFORM_VARIANTS.keys())
+    unknown = [p for p in platforms if p not in PLATFORM_VARIANTS]
+    if unknown:
+        raise ChatRequestError(f"不支援的平台: {', '.join(unknown)}")
+    
+    client = get_openai_client(data.get('user_id'))
+    futures = {
+        platform: variant_executor.submit(generate_platform_variant, client, platform, title, content)
+        for platform in platforms
+    }
+    
+    variants = {}
+    errors = {}
+    for platform, future in futures.items():
+        try:
+            variants[platform] = future.result()
+        except Exception as e:
+            current_app.logger.error(f"OpenAI API error ({platform}): {str(e)}")
+            errors[platform] = 'AI服務暫時不可用'
+    
+    if not variants:
+        raise RuntimeError('所有平台的內容生成皆失敗')
+    
+    saved = False
+    if post and data.get('save', True):
+        for platform, text in variants.items():
+            setattr(post, PLATFORM_VARIANTS[platform]['column'], text)
+        post.updated_at = datetime.utcnow()
+        job_queue.commit_unless_cancelled()
+        saved = True
+    
+    return {
+        'post_id': post.id if post else None,
+        'variants': variants,
+        'errors': errors,
+        'saved': saved
+    }
+
+@ai_chat_bp.route('/chat/generate-variants', methods=['POST'])
+def generate_variants():
+    """一次生成多個平台的貼文版本"""
+    try:
+        data = request.get_json()
+        
+        # 背景執行：只做基本驗證，AI呼叫交由工作者處理
+        if is_async_request(data):
+            if not data.get('post_id') and not data.get('content'):
+                return jsonify({'success': False, 'error': '請提供貼文內容或貼文ID'}), 400
+            job = job_queue.enqueue('generate_variants', {
+                key: data[key]
+                for key in ('post_id', 'title', 'content', 'platforms', 'save', 'user_id')
+                if key in data
+            })
+            return job_accepted_response(job)
+        
+        try:
+            result = generate_post_variants(data)
+        except ChatRequestError:
+            raise
+        except Exception as openai_error:
+            db.session.rollback()
+            current_app.logger.error(f"Variant generation error: {str(openai_error)}")
+            return jsonify({'success': False, 'error': 'AI服務暫時不可用'}), 500
+        
+        return jsonify({
+            'success': True,
+            'data': result
+        })
+        
+    except ChatRequestError as e:
+        return jsonify({'success': False, 'error': e.message}), e.status_code
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+def run_generate_variants_job(payload):
+    """背景工作：生成多平台貼文版本"""
+    try:
+        return generate_post_variants(payload)
+    except ChatRequestError as e:
+        raise job_queue.PermanentJobError(e.message)
+
+job_queue.register_handler('generate_variants', run_generate_variants_job)
+
+@ai_chat_bp.route('/ai/metrics', methods=['GET'])
+def get_ai_metrics():
+    """獲取模型呼叫的斷路器狀態與相關統計"""
+    return jsonify({
+        'success': True,
+        'data': {
+            'circuit_breaker': openai_breaker.stats(),
+            'openai_clients': openai_clients.stats(),
+            'generate_content_cache': generate_content_cache.stats(),
+            'image_preparer': image_preparer.stats(),
+            'document_retriever': document_retriever.stats()
+        }
+    })
+
+@ai_chat_bp.route('/chat/generate-content/cache', methods=['GET'])
+def get_generate_content_cache_stats():
+    """獲取內容生成快取的命中統計"""
+    return jsonify({
+        'success': True,
+        'data': generate_content_cache.stats()
+    })
+
+@ai_chat_bp.route('/chat/generate-content/cache', methods=['DELETE'])
+def clear_generate_content_cache():
+    """清除內容生成快取"""
+    try:
+        generate_content_cache.clear()
+        return jsonify({'success': True, 'message': '內容生成快取已清除'})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @ai_chat_bp.route('/ai/settings', methods=['GET'])
 def get_ai_settings():
     """獲取AI設定"""
@@ -376,6 +1028,10 @@ def update_ai_settings():
         
         db.session.commit()
         
+        if 'openai_api_key' in data or 'openai_base_url' in data:
+            # 密鑰或端點已變更，移除舊的OpenAI客戶端
+            openai_clients.evict('global')
+        
         return jsonify({'success': True, 'message': 'AI設定已更新'})
         
     except Exception as e:
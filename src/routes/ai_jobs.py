@@ -0,0 +1,44 @@
+from flask import Blueprint, jsonify
+from models.ai_job import AIJob, db
+from utils import job_queue
+
+ai_jobs_bp = Blueprint('ai_jobs', __name__)
+
+@ai_jobs_bp.route('/ai/jobs/<job_id>', methods=['GET'])
+def get_ai_job(job_id):
+    """獲取背景AI工作的狀態與結果"""
+    try:
+        job = db.session.get(AIJob, job_id)
+        if not job:
+            return jsonify({'success': False, 'error': '工作不存在'}), 404
+        
+        return jsonify({
+            'success': True,
+            'data': job.to_dict()
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@ai_jobs_bp.route('/ai/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_ai_job(job_id):
+    """取消背景AI工作"""
+    try:
+        job = job_queue.cancel(job_id)
+        if not job:
+            return jsonify({'success': False, 'error': '工作不存在'}), 404
+        
+        if job.status in ('succeeded', 'failed'):
+            return jsonify({
+                'success': False,
+                'error': '工作已完成，無法取消',
+                'data': job.to_dict()
+            }), 409
+        
+        return jsonify({
+            'success': True,
+            'message': '工作已取消' if job.status == 'cancelled' else '已要求取消，執行中的工作將在寫入結果前停止',
+            'data': job.to_dict()
+        })
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
@@ -39,6 +39,33 @@ MOCK_RESPONSES = {
     ]
 }
 
+def mock_chat_response(message):
+    """根據用戶訊息的關鍵字選擇範本回應"""
+    user_message = (message or '').lower()
+    
+    if any(keyword in user_message for keyword in ['貼文', '內容', '文案', '發布', '社群']):
+        response_type = 'post_generation'
+    elif any(keyword in user_message for keyword in ['行銷', '廣告', '推廣', '策略', '活動']):
+        response_type = 'marketing_advice'
+    elif any(keyword in user_message for keyword in ['營運', '管理', '流程', '效率', '團隊']):
+        response_type = 'operation_help'
+    else:
+        response_type = 'general'
+    
+    # 隨機選擇一個回應
+    responses = MOCK_RESPONSES.get(response_type, MOCK_RESPONSES['general'])
+    return random.choice(responses)
+
+def mock_generated_content(content_type):
+    """根據內容類型選擇範本內容"""
+    if content_type == 'post':
+        return random.choice(MOCK_RESPONSES['post_generation'])
+    elif content_type == 'marketing':
+        return random.choice(MOCK_RESPONSES['marketing_advice'])
+    elif content_type == 'operation':
+        return random.choice(MOCK_RESPONSES['operation_help'])
+    return "這是一個模擬的AI生成內容，展示系統功能正常運作。"
+
 @ai_mock_bp.route('/sessions', methods=['POST'])
 def create_session():
     """建立新的聊天會話"""
@@ -60,24 +87,11 @@ def create_session():
 def send_message(session_id):
     """發送訊息並獲得AI回應"""
     data = request.get_json()
-    user_message = data.get('message', '').lower()
     
     # 模擬處理時間
     time.sleep(1)
     
-    # 根據用戶訊息選擇適當的回應類型
-    if any(keyword in user_message for keyword in ['貼文', '內容', '文案', '發布', '社群']):
-        response_type = 'post_generation'
-    elif any(keyword in user_message for keyword in ['行銷', '廣告', '推廣', '策略', '活動']):
-        response_type = 'marketing_advice'
-    elif any(keyword in user_message for keyword in ['營運', '管理', '流程', '效率', '團隊']):
-        response_type = 'operation_help'
-    else:
-        response_type = 'general'
-    
-    # 隨機選擇一個回應
-    responses = MOCK_RESPONSES.get(response_type, MOCK_RESPONSES['general'])
-    ai_response = random.choice(responses)
+    ai_response = mock_chat_response(data.get('message', ''))
     
     return jsonify({
         'success': True,
@@ -107,14 +121,7 @@ def generate_content():
     time.sleep(1.5)
     
     # 根據內容類型生成回應
-    if content_type == 'post':
-        content = random.choice(MOCK_RESPONSES['post_generation'])
-    elif content_type == 'marketing':
-        content = random.choice(MOCK_RESPONSES['marketing_advice'])
-    elif content_type == 'operation':
-        content = random.choice(MOCK_RESPONSES['operation_help'])
-    else:
-        content = "這是一個模擬的AI生成內容，展示系統功能正常運作。"
+    content = mock_generated_content(content_type)
     
     return jsonify({
         'success': True,
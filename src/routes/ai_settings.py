@@ -1,6 +1,8 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from models.ai_config import AIConfig, db
 from utils.encryption import encryption_manager
+from utils import key_rotation
+from utils.secret_cache import secret_cache
 from datetime import datetime
 import requests
 
@@ -112,8 +114,12 @@ def update_ai_settings():
         # 更新時間戳記
         config.updated_at = datetime.utcnow()
         
+        # 使所有worker的已解密憑證快取失效
+        AIConfig.invalidate_cache(user_id)
+        
         # 保存到資料庫
         db.session.commit()
+        secret_cache.invalidate(str(user_id))
         
         return jsonify({
             'success': True,
@@ -219,7 +225,11 @@ def reset_ai_settings():
         config.image_generation_enabled = False
         config.updated_at = datetime.utcnow()
         
+        # 使所有worker的已解密憑證快取失效
+        AIConfig.invalidate_cache(user_id)
+        
         db.session.commit()
+        secret_cache.invalidate(str(user_id))
         
         return jsonify({
             'success': True,
@@ -234,3 +244,85 @@ def reset_ai_settings():
             'error': f'重置設定失敗: {str(e)}'
         }), 500
 
+
+@ai_settings_bp.route('/ai-settings/rotate-keys', methods=['POST'])
+def rotate_encryption_keys():
+    """啟動背景密鑰輪替（以最新MASTER_KEY重新加密所有AI設定）"""
+    try:
+        data = request.get_json(silent=True) or {}
+        batch_size = int(data.get('batch_size', 100))
+        start_after_id = int(data.get('start_after_id', 0))
+        pause_seconds = float(data.get('pause_seconds', 0))
+        
+        if batch_size < 1:
+            return jsonify({
+                'success': False,
+                'error': 'batch_size必須大於0'
+            }), 400
+        
+        job = key_rotation.start_key_rotation(
+            current_app._get_current_object(),
+            batch_size=batch_size,
+            start_after_id=start_after_id,
+            pause_seconds=pause_seconds
+        )
+        if not job:
+            return jsonify({
+                'success': False,
+                'error': '已有密鑰輪替工作執行中',
+                'data': key_rotation.get_rotation_status()
+            }), 409
+        
+        return jsonify({
+            'success': True,
+            'message': '密鑰輪替已開始',
+            'data': key_rotation.get_rotation_status()
+        }), 202
+        
+    except (TypeError, ValueError) as e:
+        return jsonify({
+            'success': False,
+            'error': f'參數錯誤: {str(e)}'
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'啟動密鑰輪替失敗: {str(e)}'
+        }), 500
+
+@ai_settings_bp.route('/ai-settings/rotate-keys', methods=['GET'])
+def get_key_rotation_status():
+    """獲取密鑰輪替進度與吞吐量（進度存放在資料庫，可由任何worker查詢）"""
+    try:
+        return jsonify({
+            'success': True,
+            'data': key_rotation.get_rotation_status()
+        })
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'error': f'獲取密鑰輪替進度失敗: {str(e)}'
+        }), 500
+
+@ai_settings_bp.route('/ai-settings/rotate-keys/cancel', methods=['POST'])
+def cancel_key_rotation():
+    """在目前批次完成後停止密鑰輪替（可由任何worker處理）"""
+    try:
+        if not key_rotation.cancel_key_rotation():
+            return jsonify({
+                'success': False,
+                'error': '沒有執行中的密鑰輪替工作'
+            }), 400
+        
+        return jsonify({
+            'success': True,
+            'message': '已要求停止密鑰輪替，可使用last_id續跑',
+            'data': key_rotation.get_rotation_status()
+        })
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'error': f'停止密鑰輪替失敗: {str(e)}'
+        }), 500
@@ -1,37 +1,324 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 import cloudinary
 import cloudinary.uploader
 import cloudinary.api
 import os
+import base64
+import binascii
+import hashlib
+import threading
 from datetime import datetime
 import mimetypes
 import tempfile
+import re
+import html
 import requests
-from urllib.parse import urlparse
-import PyPDF2
-import docx
-from io import BytesIO
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlparse, unquote
+from models.ai_chat import db
+from utils.gdrive_cache import gdrive_cache
+from utils.upload_index import upload_index
+from utils.extraction import (
+    EXTRACTION_MAX_CHARS, PDF_TYPE, DOCX_TYPE, extract_document, extraction_result
+)
 
 # 建立藍圖
 file_upload_bp = Blueprint('file_upload', __name__)
 
+MB = 1024 * 1024
+
+# 各資源類型的大小上限
+UPLOAD_SIZE_LIMITS = {
+    'image': int(float(os.environ.get('UPLOAD_MAX_IMAGE_MB', 10)) * MB),
+    'video': int(float(os.environ.get('UPLOAD_MAX_VIDEO_MB', 100)) * MB),
+    'raw': int(float(os.environ.get('UPLOAD_MAX_RAW_MB', 20)) * MB)
+}
+# 超過此大小的內容暫存到磁碟，而非保留在記憶體中
+UPLOAD_SPOOL_THRESHOLD = int(float(os.environ.get('UPLOAD_SPOOL_THRESHOLD_MB', 1)) * MB)
+# 超過此大小改以分段上傳（upload_large），每次只讀取一個分段到記憶體
+UPLOAD_CHUNKED_THRESHOLD = int(float(os.environ.get('UPLOAD_CHUNKED_THRESHOLD_MB', 8)) * MB)
+UPLOAD_CHUNK_SIZE = int(float(os.environ.get('UPLOAD_CHUNK_SIZE_MB', 6)) * MB)  # Cloudinary最小5MB
+COPY_BUFFER_SIZE = 64 * 1024
+
+# Google Drive下載設定
+GDRIVE_DOWNLOAD_URL = 'https://drive.google.com/uc'
+GDRIVE_MAX_BYTES = int(float(os.environ.get('GDRIVE_MAX_MB', 20)) * MB)
+GDRIVE_CONNECT_TIMEOUT = float(os.environ.get('GDRIVE_CONNECT_TIMEOUT', 5))
+GDRIVE_READ_TIMEOUT = float(os.environ.get('GDRIVE_READ_TIMEOUT', 30))
+GDRIVE_CONFIRM_PAGE_LIMIT = 256 * 1024
+GDRIVE_DOCUMENT_TYPES = (PDF_TYPE, DOCX_TYPE, 'text/plain')
+
+# Google Drive下載共用的連線池（重複使用keep-alive連線）
+gdrive_http = requests.Session()
+gdrive_http.mount('https://', HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=int(os.environ.get('GDRIVE_POOL_SIZE', 8))
+))
+
+_cloudinary_configured = False
+_cloudinary_lock = threading.Lock()
+
 # 配置Cloudinary
-def configure_cloudinary():
-    """配置Cloudinary設定"""
-    cloudinary.config(
-        cloud_name=os.getenv('CLOUDINARY_CLOUD_NAME'),
-        api_key=os.getenv('CLOUDINARY_API_KEY'),
-        api_secret=os.getenv('CLOUDINARY_API_SECRET'),
-        secure=True
+def configure_cloudinary(force=False):
+    """配置Cloudinary設定（只在首次使用時從環境變數讀取，之後沿用）"""
+    global _cloudinary_configured
+    if _cloudinary_configured and not force:
+        return
+    with _cloudinary_lock:
+        if _cloudinary_configured and not force:
+            return
+        cloudinary.config(
+            cloud_name=os.getenv('CLOUDINARY_CLOUD_NAME'),
+            api_key=os.getenv('CLOUDINARY_API_KEY'),
+            api_secret=os.getenv('CLOUDINARY_API_SECRET'),
+            secure=True
+        )
+        _cloudinary_configured = True
+
+class FileProcessingError(Exception):
+    """文件處理失敗（附帶建議的HTTP狀態碼）"""
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+def get_resource_type(file_type):
+    """依MIME類型決定Cloudinary資源類型"""
+    if file_type and file_type.startswith('image/'):
+        return 'image'
+    elif file_type and file_type.startswith('video/'):
+        return 'video'
+    return 'raw'
+
+def size_limit_error(resource_type):
+    limit_mb = UPLOAD_SIZE_LIMITS[resource_type] / MB
+    return FileProcessingError(f'文件大小超過{limit_mb:g}MB限制', 413)
+
+def spool_stream(source, limit):
+    """以固定大小的緩衝區複製到暫存檔（超過門檻時寫入磁碟）並同時計算SHA-256，超過上限時立即停止"""
+    spooled = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_THRESHOLD)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        while True:
+            chunk = source.read(COPY_BUFFER_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > limit:
+                raise FileProcessingError(f'文件大小超過{limit / MB:g}MB限制', 413)
+            digest.update(chunk)
+            spooled.write(chunk)
+    except Exception:
+        spooled.close()
+        raise
+    spooled.seek(0)
+    return spooled, size, digest.hexdigest()
+
+def spool_base64(encoded, content_type=None):
+    """將base64內容分段解碼到暫存檔（解碼前先依長度估算大小並檢查上限）"""
+    if any(char.isspace() for char in encoded[:1024]):
+        encoded = ''.join(encoded.split())
+    resource_type = get_resource_type(content_type)
+    if len(encoded) * 3 // 4 - encoded[-2:].count('=') > UPLOAD_SIZE_LIMITS[resource_type]:
+        raise size_limit_error(resource_type)
+    
+    spooled = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_THRESHOLD)
+    # 每段長度為4的倍數，可獨立解碼
+    step = COPY_BUFFER_SIZE // 3 * 4
+    try:
+        for start in range(0, len(encoded), step):
+            spooled.write(base64.b64decode(encoded[start:start + step], validate=True))
+    except (binascii.Error, ValueError):
+        spooled.close()
+        raise FileProcessingError('文件內容不是有效的base64編碼')
+    spooled.seek(0)
+    return spooled
+
+def open_upload_stream(file, resource_type):
+    """取得可seek的檔案串流、大小與SHA-256，並檢查資源類型的大小上限
+
+    Werkzeug已將較大的上傳內容暫存到磁碟，可直接使用其底層串流（分段讀取一次計算雜湊）；
+    無法seek的串流則在分段複製到暫存檔的同時計算雜湊。
+    """
+    limit = UPLOAD_SIZE_LIMITS[resource_type]
+    stream = getattr(file, 'stream', file)
+    
+    if not (hasattr(stream, 'seekable') and stream.seekable()):
+        return spool_stream(stream, limit)
+    
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    if size > limit:
+        raise size_limit_error(resource_type)
+    
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(COPY_BUFFER_SIZE), b''):
+        digest.update(chunk)
+    stream.seek(0)
+    return stream, size, digest.hexdigest()
+
+def find_uploaded_asset(digest, size, stream, file_type, resource_type):
+    """查詢去重索引，命中時回傳上傳結果（文字已被淘汰時只重新提取，不重新上傳）"""
+    if not upload_index.enabled:
+        return None
+    try:
+        asset = upload_index.lookup(digest, size)
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"上傳索引查詢錯誤: {str(e)}")
+        return None
+    if not asset or asset['resource_type'] != resource_type:
+        return None
+    
+    text, truncated = asset['text'], asset['content_truncated']
+    if asset['text_evicted'] and resource_type == 'raw' and file_type:
+        extracted = extract_file_content(stream, file_type)
+        text = extracted['text'] if extracted else None
+        truncated = extracted['truncated'] if extracted else False
+        try:
+            upload_index.store_text(digest, extracted)
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"上傳索引寫入錯誤: {str(e)}")
+    
+    return {
+        'url': asset['url'],
+        'public_id': asset['public_id'],
+        'type': file_type or asset['file_type'],
+        'size': size,
+        'resource_type': resource_type,
+        'content': text,
+        'content_truncated': truncated,
+        'deduplicated': True
+    }
+
+def reextract_uploaded_file(asset):
+    """重新下載伺服器上傳過的文件並提取文字（上傳記錄的文字已被淘汰時），回傳(文字, 是否截斷)
+
+    網址取自伺服器的上傳記錄，不是用戶端提供的網址。
+    """
+    if asset['resource_type'] != 'raw' or asset['file_type'] not in (PDF_TYPE, DOCX_TYPE, 'text/plain'):
+        return None, False
+    try:
+        response = requests.get(
+            asset['url'], stream=True,
+            timeout=(GDRIVE_CONNECT_TIMEOUT, GDRIVE_READ_TIMEOUT)
+        )
+        response.raise_for_status()
+    except requests.RequestException as e:
+        raise FileProcessingError(f'下載文件失敗: {str(e)}', 500)
+    try:
+        response.raw.decode_content = True
+        spooled, _, digest = spool_stream(response.raw, UPLOAD_SIZE_LIMITS['raw'])
+    finally:
+        response.close()
+    try:
+        extracted = extract_file_content(spooled, asset['file_type'])
+    finally:
+        spooled.close()
+    
+    # 內容與上傳記錄相符時寫回去重索引，下次不必重新下載
+    if digest == asset['sha256']:
+        try:
+            upload_index.restore_text(asset, extracted)
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"上傳索引寫入錯誤: {str(e)}")
+    if not extracted:
+        return None, False
+    return extracted['text'], extracted['truncated']
+
+def upload_stream_to_cloudinary(stream, size, filename=None, **options):
+    """上傳串流到Cloudinary，大檔案以分段上傳（完成後串流會被關閉）"""
+    if size > UPLOAD_CHUNKED_THRESHOLD:
+        return cloudinary.uploader.upload_large(
+            stream,
+            chunk_size=UPLOAD_CHUNK_SIZE,
+            filename=filename or 'stream',
+            **options
+        )
+    try:
+        return cloudinary.uploader.upload(stream, **options)
+    finally:
+        stream.close()
+
+def upload_file_to_cloudinary(file, filename, content_type=None, session_id=None):
+    """上傳文件到Cloudinary並提取文件內容（供路由與聊天流程直接呼叫）
+
+    file 為檔案物件（Werkzeug FileStorage、暫存檔或BytesIO），上傳後會被關閉。
+    """
+    # 配置Cloudinary
+    configure_cloudinary()
+    
+    if not filename:
+        raise FileProcessingError('沒有選擇文件')
+    
+    # 獲取文件類型
+    file_type = content_type or mimetypes.guess_type(filename)[0]
+    
+    # 決定資源類型並檢查文件大小
+    resource_type = get_resource_type(file_type)
+    stream, file_size, digest = open_upload_stream(file, resource_type)
+    
+    # 相同內容已上傳過：沿用既有資源與提取的文字
+    try:
+        existing = find_uploaded_asset(digest, file_size, stream, file_type, resource_type)
+    except Exception:
+        stream.close()
+        raise
+    if existing:
+        stream.close()
+        return existing
+    
+    # 提取文件內容（如果是文檔）；分段上傳會關閉串流，因此先於上傳進行
+    extracted = None
+    if resource_type == 'raw' and file_type:
+        extracted = extract_file_content(stream, file_type)
+        stream.seek(0)
+    
+    # 生成唯一的public_id
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    public_id = f"ai_chat/{session_id}/{timestamp}_{filename}"
+    
+    # 上傳到Cloudinary
+    upload_result = upload_stream_to_cloudinary(
+        stream,
+        file_size,
+        filename=filename,
+        resource_type=resource_type,
+        public_id=public_id,
+        unique_filename=False,
+        overwrite=True,
+        folder="ai_chat"
     )
+    
+    # 上傳記錄同時用於驗證聊天訊息引用的文件，停用去重時也寫入
+    try:
+        upload_index.store(
+            digest, file_size, file_type, resource_type,
+            upload_result['secure_url'], upload_result['public_id'], extracted
+        )
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"上傳索引寫入錯誤: {str(e)}")
+    
+    return {
+        'url': upload_result['secure_url'],
+        'public_id': upload_result['public_id'],
+        'type': file_type,
+        'size': file_size,
+        'resource_type': resource_type,
+        'content': extracted['text'] if extracted else None,  # 提取的文字內容
+        'content_truncated': extracted['truncated'] if extracted else False,  # 是否因頁數、字數或時間上限而截斷
+        'deduplicated': False
+    }
 
 @file_upload_bp.route('/api/upload-file', methods=['POST'])
 def upload_file():
     """處理文件上傳到Cloudinary"""
     try:
-        # 配置Cloudinary
-        configure_cloudinary()
-        
         # 檢查是否有文件
         if 'file' not in request.files:
             return jsonify({
@@ -42,66 +329,23 @@ def upload_file():
         file = request.files['file']
         session_id = request.form.get('session_id')
         
-        if file.filename == '':
-            return jsonify({
-                'success': False,
-                'error': '沒有選擇文件'
-            }), 400
-        
-        # 檢查文件大小（限制10MB）
-        file.seek(0, os.SEEK_END)
-        file_size = file.tell()
-        file.seek(0)
-        
-        if file_size > 10 * 1024 * 1024:  # 10MB
-            return jsonify({
-                'success': False,
-                'error': '文件大小超過10MB限制'
-            }), 400
-        
-        # 獲取文件類型
-        file_type = file.content_type or mimetypes.guess_type(file.filename)[0]
-        
-        # 決定資源類型
-        if file_type and file_type.startswith('image/'):
-            resource_type = 'image'
-        elif file_type and file_type.startswith('video/'):
-            resource_type = 'video'
-        else:
-            resource_type = 'raw'
-        
-        # 生成唯一的public_id
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        public_id = f"ai_chat/{session_id}/{timestamp}_{file.filename}"
-        
-        # 上傳到Cloudinary
-        upload_result = cloudinary.uploader.upload(
+        data = upload_file_to_cloudinary(
             file,
-            resource_type=resource_type,
-            public_id=public_id,
-            unique_filename=False,
-            overwrite=True,
-            folder="ai_chat"
+            file.filename,
+            content_type=file.content_type,
+            session_id=session_id
         )
         
-        # 提取文件內容（如果是文檔）
-        file_content = None
-        if resource_type == 'raw' and file_type:
-            file.seek(0)
-            file_content = extract_file_content(file, file_type)
-        
         return jsonify({
             'success': True,
-            'data': {
-                'url': upload_result['secure_url'],
-                'public_id': upload_result['public_id'],
-                'type': file_type,
-                'size': file_size,
-                'resource_type': resource_type,
-                'content': file_content  # 提取的文字內容
-            }
+            'data': data
         })
         
+    except FileProcessingError as e:
+        return jsonify({
+            'success': False,
+            'error': e.message
+        }), e.status_code
     except Exception as e:
         print(f"文件上傳錯誤: {str(e)}")
         return jsonify({
@@ -110,14 +354,14 @@ def upload_file():
         }), 500
 
 def extract_file_content(file, file_type):
-    """提取文件的文字內容"""
+    """提取文件的文字內容，回傳含text與truncated的結果（不支援的類型回傳None）"""
     try:
-        if file_type == 'application/pdf':
+        if file_type == PDF_TYPE:
             return extract_pdf_content(file)
-        elif file_type in ['application/vnd.openxmlformats-officedocument.wordprocessingml.document']:
+        elif file_type == DOCX_TYPE:
             return extract_docx_content(file)
         elif file_type == 'text/plain':
-            return file.read().decode('utf-8')
+            return extract_text_content(file)
         else:
             return None
     except Exception as e:
@@ -125,135 +369,256 @@ def extract_file_content(file, file_type):
         return None
 
 def extract_pdf_content(file):
-    """提取PDF文件的文字內容"""
+    """提取PDF文件的文字內容（在獨立的工作行程中執行，有頁數、字數與時間上限）"""
     try:
-        pdf_reader = PyPDF2.PdfReader(file)
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text() + "\n"
-        return text.strip()
+        return extract_document(file, PDF_TYPE)
     except Exception as e:
         print(f"PDF提取錯誤: {str(e)}")
         return None
 
 def extract_docx_content(file):
-    """提取Word文檔的文字內容"""
+    """提取Word文檔的文字內容（在獨立的工作行程中執行，有字數與時間上限）"""
     try:
-        doc = docx.Document(file)
-        text = ""
-        for paragraph in doc.paragraphs:
-            text += paragraph.text + "\n"
-        return text.strip()
+        return extract_document(file, DOCX_TYPE)
     except Exception as e:
         print(f"DOCX提取錯誤: {str(e)}")
         return None
 
+def extract_text_content(file):
+    """讀取純文字文件（最多EXTRACTION_MAX_CHARS個字元）"""
+    # UTF-8每個字元最多4個位元組，多讀一個位元組以判斷是否截斷
+    raw = file.read(EXTRACTION_MAX_CHARS * 4 + 1)
+    text = raw.decode('utf-8', errors='ignore')
+    truncated = len(raw) > EXTRACTION_MAX_CHARS * 4 or len(text) > EXTRACTION_MAX_CHARS
+    return extraction_result([text[:EXTRACTION_MAX_CHARS]], truncated)
+
+def gdrive_request(url, headers=None, params=None):
+    """以共用連線池發出串流GET請求（連線與讀取分別逾時）"""
+    try:
+        return gdrive_http.get(
+            url, headers=headers, params=params, stream=True,
+            timeout=(GDRIVE_CONNECT_TIMEOUT, GDRIVE_READ_TIMEOUT)
+        )
+    except requests.RequestException as e:
+        raise FileProcessingError(f'下載文件失敗: {str(e)}', 500)
+
+def parse_gdrive_confirm(page, cookies, file_id):
+    """解析大型文件的病毒掃描確認頁面，回傳(下載網址, 參數)（不是確認頁面時回傳None）"""
+    # 新版確認頁面：<form id="download-form" action="..."> 內含id、export、confirm、uuid欄位
+    form = re.search(r'<form[^>]*id="download-form"[^>]*action="([^"]+)"', page)
+    if form:
+        fields = dict(re.findall(r'<input[^>]*name="([^"]+)"[^>]*value="([^"]*)"', page))
+        if fields.get('confirm'):
+            return html.unescape(form.group(1)), {
+                name: html.unescape(value) for name, value in fields.items()
+            }
+    
+    # 舊版確認頁面：download_warning cookie或連結中的confirm參數
+    token = next((value for name, value in cookies.items() if name.startswith('download_warning')), None)
+    if not token:
+        match = re.search(r'confirm=([0-9A-Za-z_\-]+)', page)
+        token = match.group(1) if match else None
+    if token:
+        return GDRIVE_DOWNLOAD_URL, {'export': 'download', 'id': file_id, 'confirm': token}
+    return None
+
+def open_gdrive_download(file_id, cached=None):
+    """開始下載Google Drive文件（處理大型文件的確認頁面），回傳尚未讀取內容的回應
+
+    有快取時附帶If-None-Match/If-Modified-Since，內容未變更時回應為304。
+    """
+    headers = {}
+    if cached:
+        if cached['etag']:
+            headers['If-None-Match'] = cached['etag']
+        if cached['last_modified']:
+            headers['If-Modified-Since'] = cached['last_modified']
+    
+    response = gdrive_request(GDRIVE_DOWNLOAD_URL, headers, {'export': 'download', 'id': file_id})
+    if response.status_code == 200 and get_content_type(response) == 'text/html':
+        # 超過掃描大小的文件會先回傳確認頁面（頁面很小，只讀取有限的內容）
+        try:
+            page = response.raw.read(GDRIVE_CONFIRM_PAGE_LIMIT, decode_content=True).decode('utf-8', errors='ignore')
+        finally:
+            response.close()
+        confirm = parse_gdrive_confirm(page, response.cookies, file_id)
+        if not confirm:
+            raise FileProcessingError('無法訪問Google Drive文件，請確認連結是公開的')
+        confirm_url, params = confirm
+        response = gdrive_request(confirm_url, headers, params)
+    
+    if response.status_code not in (200, 304):
+        response.close()
+        raise FileProcessingError('無法訪問Google Drive文件，請確認連結是公開的')
+    return response
+
+def get_content_type(response):
+    return response.headers.get('content-type', '').split(';')[0].strip().lower()
+
+def get_gdrive_filename(response, file_id, content_type):
+    """由Content-Disposition取得檔名（沒有時以文件ID與類型組成）"""
+    disposition = response.headers.get('content-disposition', '')
+    match = re.search(r"filename\*=UTF-8''([^;]+)", disposition) or re.search(r'filename="?([^";]+)"?', disposition)
+    if match:
+        return os.path.basename(unquote(match.group(1)))
+    return f"gdrive_{file_id}{mimetypes.guess_extension(content_type) or ''}"
+
+def spool_gdrive_response(response):
+    """將回應內容串流寫入暫存檔，超過GDRIVE_MAX_BYTES時中止下載"""
+    try:
+        length = int(response.headers.get('content-length') or 0)
+        if length > GDRIVE_MAX_BYTES:
+            raise FileProcessingError(f'文件大小超過{GDRIVE_MAX_BYTES / MB:g}MB限制', 413)
+        response.raw.decode_content = True
+        return spool_stream(response.raw, GDRIVE_MAX_BYTES)
+    finally:
+        response.close()
+
+def download_gdrive_file(file_id, session_id, cached=None):
+    """下載並處理Google Drive文件，回傳(處理結果, 回應)；內容未變更（304）時處理結果為None"""
+    response = open_gdrive_download(file_id, cached)
+    if response.status_code == 304:
+        response.close()
+        return None, response
+    
+    content_type = get_content_type(response)
+    
+    # 如果是圖片，上傳到Cloudinary（經過上傳去重索引與大小上限檢查）
+    if content_type.startswith('image/'):
+        filename = get_gdrive_filename(response, file_id, content_type)
+        spooled, size, _ = spool_gdrive_response(response)
+        uploaded = upload_file_to_cloudinary(spooled, filename, content_type=content_type, session_id=session_id)
+        return {
+            'type': 'image',
+            'url': uploaded['url'],
+            'content_type': content_type,
+            'size': size
+        }, response
+    
+    # 如果是文檔，提取文字內容
+    if content_type in GDRIVE_DOCUMENT_TYPES:
+        spooled, size, _ = spool_gdrive_response(response)
+        try:
+            extracted = extract_file_content(spooled, content_type)
+        finally:
+            spooled.close()
+        return {
+            'type': 'document',
+            'content': extracted['text'] if extracted else None,
+            'content_truncated': extracted['truncated'] if extracted else False,
+            'content_type': content_type,
+            'size': size
+        }, response
+    
+    # 不支援的類型不下載內容
+    response.close()
+    return {
+        'type': 'unknown',
+        'content_type': content_type,
+        'message': '文件類型不支援內容提取，但連結已記錄'
+    }, response
+
+def process_gdrive_url(url, session_id=None):
+    """下載Google Drive公開文件並處理內容（供路由與聊天流程直接呼叫）
+
+    處理結果以文件ID快取：GDRIVE_CACHE_TTL秒內直接回傳快取，
+    之後以ETag/Last-Modified重新驗證，內容未變更時不重新下載與處理。
+    """
+    if not url:
+        raise FileProcessingError('沒有提供連結')
+    
+    # 解析Google Drive連結
+    parsed_url = urlparse(url)
+    if 'drive.google.com' not in parsed_url.netloc:
+        raise FileProcessingError('不是有效的Google Drive連結')
+    
+    # 嘗試轉換為直接下載連結
+    file_id = extract_file_id_from_gdrive_url(url)
+    if not file_id:
+        raise FileProcessingError('無法解析Google Drive文件ID')
+    
+    cached = None
+    if gdrive_cache.enabled:
+        try:
+            cached = gdrive_cache.lookup(file_id)
+            if cached and cached['fresh']:
+                gdrive_cache.hit(file_id)
+                return dict(cached['result'], original_url=url, cached=True)
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"Google Drive快取查詢錯誤: {str(e)}")
+            cached = None
+    
+    result, response = download_gdrive_file(file_id, session_id, cached)
+    if result is None:
+        # 304：內容未變更，沿用快取的處理結果
+        try:
+            gdrive_cache.hit(file_id, revalidated=True)
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"Google Drive快取寫入錯誤: {str(e)}")
+        return dict(cached['result'], original_url=url, cached=True)
+    
+    if gdrive_cache.enabled:
+        try:
+            gdrive_cache.store(
+                file_id, result,
+                etag=response.headers.get('etag'),
+                last_modified=response.headers.get('last-modified'),
+                size=result.get('size')
+            )
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"Google Drive快取寫入錯誤: {str(e)}")
+    
+    return dict(result, original_url=url, cached=False)
+
+@file_upload_bp.route('/api/upload-index', methods=['GET'])
+def get_upload_index_stats():
+    """獲取上傳去重索引的統計（命中次數、節省的上傳量）"""
+    try:
+        return jsonify({
+            'success': True,
+            'data': upload_index.stats()
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@file_upload_bp.route('/api/gdrive-cache', methods=['GET'])
+def get_gdrive_cache_stats():
+    """獲取Google Drive下載快取的統計"""
+    try:
+        return jsonify({
+            'success': True,
+            'data': gdrive_cache.stats()
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
 @file_upload_bp.route('/api/process-gdrive-link', methods=['POST'])
 def process_gdrive_link():
     """處理Google Drive公開連結"""
     try:
         data = request.get_json()
-        url = data.get('url')
-        session_id = data.get('session_id')
         
-        if not url:
-            return jsonify({
-                'success': False,
-                'error': '沒有提供連結'
-            }), 400
+        result = process_gdrive_url(data.get('url'), data.get('session_id'))
         
-        # 解析Google Drive連結
-        parsed_url = urlparse(url)
-        if 'drive.google.com' not in parsed_url.netloc:
-            return jsonify({
-                'success': False,
-                'error': '不是有效的Google Drive連結'
-            }), 400
-        
-        # 嘗試轉換為直接下載連結
-        file_id = extract_file_id_from_gdrive_url(url)
-        if not file_id:
-            return jsonify({
-                'success': False,
-                'error': '無法解析Google Drive文件ID'
-            }), 400
-        
-        # 構建直接下載連結
-        download_url = f"https://drive.google.com/uc?export=download&id={file_id}"
-        
-        # 嘗試下載文件內容
-        try:
-            response = requests.get(download_url, timeout=30)
-            if response.status_code == 200:
-                content_type = response.headers.get('content-type', '')
-                
-                # 如果是圖片，上傳到Cloudinary
-                if content_type.startswith('image/'):
-                    # 配置Cloudinary
-                    configure_cloudinary()
-                    
-                    # 上傳圖片到Cloudinary
-                    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                    public_id = f"ai_chat/{session_id}/gdrive_{timestamp}"
-                    
-                    upload_result = cloudinary.uploader.upload(
-                        BytesIO(response.content),
-                        resource_type='image',
-                        public_id=public_id,
-                        folder="ai_chat"
-                    )
-                    
-                    return jsonify({
-                        'success': True,
-                        'data': {
-                            'type': 'image',
-                            'url': upload_result['secure_url'],
-                            'original_url': url,
-                            'content_type': content_type
-                        }
-                    })
-                
-                # 如果是文檔，提取文字內容
-                elif content_type in ['application/pdf', 'text/plain']:
-                    file_content = None
-                    if content_type == 'application/pdf':
-                        file_content = extract_pdf_content(BytesIO(response.content))
-                    elif content_type == 'text/plain':
-                        file_content = response.text
-                    
-                    return jsonify({
-                        'success': True,
-                        'data': {
-                            'type': 'document',
-                            'content': file_content,
-                            'original_url': url,
-                            'content_type': content_type
-                        }
-                    })
-                
-                else:
-                    return jsonify({
-                        'success': True,
-                        'data': {
-                            'type': 'unknown',
-                            'original_url': url,
-                            'content_type': content_type,
-                            'message': '文件類型不支援內容提取，但連結已記錄'
-                        }
-                    })
-            
-            else:
-                return jsonify({
-                    'success': False,
-                    'error': '無法訪問Google Drive文件，請確認連結是公開的'
-                }), 400
-                
-        except requests.RequestException as e:
-            return jsonify({
-                'success': False,
-                'error': f'下載文件失敗: {str(e)}'
-            }), 500
+        return jsonify({
+            'success': True,
+            'data': result
+        })
         
+    except FileProcessingError as e:
+        return jsonify({
+            'success': False,
+            'error': e.message
+        }), e.status_code
     except Exception as e:
         print(f"處理Google Drive連結錯誤: {str(e)}")
         return jsonify({
@@ -2,9 +2,15 @@ from flask import Blueprint, request, jsonify
 from datetime import datetime
 from models.user import db
 from models.operation import OperationItem
+from utils.pagination import InvalidCursor, is_cursor_mode, keyset_page, list_count_cache, parse_limit
+from utils.search import apply_search, search_result, track_search
 
 operation_bp = Blueprint('operation', __name__)
 
+# 資料異動時清除列表總數快取並更新全文檢索索引
+list_count_cache.track(OperationItem)
+track_search(OperationItem)
+
 @operation_bp.route('/operation/items', methods=['GET'])
 def get_operation_items():
     """取得營運項目列表"""
@@ -12,25 +18,48 @@ def get_operation_items():
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 10, type=int)
         search = request.args.get('search', '')
+        # sort=relevance：依搜尋相關度排序（預設依建立時間）
+        ranked = bool(search) and request.args.get('sort') == 'relevance'
         tag = request.args.get('tag', '')
         status = request.args.get('status', '')
         
         query = OperationItem.query
         
         if search:
-            query = query.filter(OperationItem.title.contains(search) | OperationItem.content.contains(search))
+            query = apply_search(query, OperationItem, search, ranked)
         if tag:
             query = query.filter(OperationItem.tag == tag)
         if status:
             query = query.filter(OperationItem.status == status)
         
+        # 游標分頁：依(created_at, id)由新到舊，不使用OFFSET，總數只在要求時計算（有快取）
+        if is_cursor_mode(request.args):
+            if ranked:
+                return jsonify({'success': False, 'error': '游標分頁不支援依相關度排序'}), 400
+            limit = parse_limit(request.args.get('per_page'), default=10)
+            items, next_cursor = keyset_page(
+                query, OperationItem.created_at, OperationItem.id, request.args.get('cursor'), limit
+            )
+            pagination = {
+                'per_page': limit,
+                'has_more': next_cursor is not None,
+                'next_cursor': next_cursor
+            }
+            if request.args.get('include_total') == 'true':
+                pagination['total'] = list_count_cache.get(('operation_items', search, tag, status), query)
+            return jsonify({
+                'success': True,
+                'data': [search_result(item, search) for item in items],
+                'pagination': pagination
+            })
+        
         items = query.order_by(OperationItem.created_at.desc()).paginate(
             page=page, per_page=per_page, error_out=False
         )
         
         return jsonify({
             'success': True,
-            'data': [item.to_dict() for item in items.items],
+            'data': [search_result(item, search) for item in items.items],
             'pagination': {
                 'page': page,
                 'per_page': per_page,
@@ -38,6 +67,8 @@ def get_operation_items():
                 'pages': items.pages
             }
         })
+    except InvalidCursor as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
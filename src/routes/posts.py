@@ -2,9 +2,15 @@ from flask import Blueprint, request, jsonify
 from datetime import datetime
 from models.user import db
 from models.post import Post
+from utils.pagination import InvalidCursor, is_cursor_mode, keyset_page, list_count_cache, parse_limit
+from utils.search import apply_search, search_result, track_search
 
 posts_bp = Blueprint('posts', __name__)
 
+# 資料異動時清除列表總數快取並更新全文檢索索引
+list_count_cache.track(Post)
+track_search(Post)
+
 @posts_bp.route('/posts', methods=['GET'])
 def get_posts():
     """取得貼文列表"""
@@ -13,6 +19,8 @@ def get_posts():
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 10, type=int)
         search = request.args.get('search', '')
+        # sort=relevance：依搜尋相關度排序（預設依建立時間）
+        ranked = bool(search) and request.args.get('sort') == 'relevance'
         tag = request.args.get('tag', '')
         status = request.args.get('status', '')
         
@@ -20,12 +28,33 @@ def get_posts():
         query = Post.query
         
         if search:
-            query = query.filter(Post.title.contains(search) | Post.content.contains(search))
+            query = apply_search(query, Post, search, ranked)
         if tag:
             query = query.filter(Post.tag == tag)
         if status:
             query = query.filter(Post.status == status)
         
+        # 游標分頁：依(created_at, id)由新到舊，不使用OFFSET，總數只在要求時計算（有快取）
+        if is_cursor_mode(request.args):
+            if ranked:
+                return jsonify({'success': False, 'error': '游標分頁不支援依相關度排序'}), 400
+            limit = parse_limit(request.args.get('per_page'), default=10)
+            posts, next_cursor = keyset_page(
+                query, Post.created_at, Post.id, request.args.get('cursor'), limit
+            )
+            pagination = {
+                'per_page': limit,
+                'has_more': next_cursor is not None,
+                'next_cursor': next_cursor
+            }
+            if request.args.get('include_total') == 'true':
+                pagination['total'] = list_count_cache.get(('posts', search, tag, status), query)
+            return jsonify({
+                'success': True,
+                'data': [search_result(post, search) for post in posts],
+                'pagination': pagination
+            })
+        
         # 分頁
         posts = query.order_by(Post.created_at.desc()).paginate(
             page=page, per_page=per_page, error_out=False
@@ -33,7 +62,7 @@ def get_posts():
         
         return jsonify({
             'success': True,
-            'data': [post.to_dict() for post in posts.items],
+            'data': [search_result(post, search) for post in posts.items],
             'pagination': {
                 'page': page,
                 'per_page': per_page,
@@ -41,6 +70,8 @@ def get_posts():
                 'pages': posts.pages
             }
         })
+    except InvalidCursor as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -14,8 +14,13 @@ class AIAssistant {
         this.aiChatImageBtn = document.getElementById("aiChatImageBtn");
         this.quickActionBtns = document.querySelectorAll(".quick-action-btn");
 
-        this.currentChatSessionId = null;
+        this.currentChatSessionId = localStorage.getItem("aiChatSessionId");
+        this.historyCursor = null;
+        this.hasOlderHistory = false;
+        this.loadingHistory = false;
         this.uploadedFiles = [];
+        // 已上傳的附件結果（重試時不必重新上傳）
+        this.uploadResults = new WeakMap();
         this.editMode = false;
 
         // 綁定 this 到方法，確保在回調中上下文正確
@@ -31,13 +36,18 @@ class AIAssistant {
         this.enableEditMode = this.enableEditMode.bind(this);
         this.disableEditMode = this.disableEditMode.bind(this);
         this.handleEditCommand = this.handleEditCommand.bind(this);
+        this.handleHistoryScroll = this.handleHistoryScroll.bind(this);
 
         this.init();
     }
 
     init() {
         this.bindEvents();
-        this.loadInitialMessage();
+        if (this.currentChatSessionId) {
+            this.loadHistory();
+        } else {
+            this.loadInitialMessage();
+        }
     }
 
     bindEvents() {
@@ -75,6 +85,9 @@ class AIAssistant {
         if (this.aiChatFileInput) {
             this.aiChatFileInput.addEventListener("change", this.handleFileSelect);
         }
+        if (this.chatMessages) {
+            this.chatMessages.addEventListener("scroll", this.handleHistoryScroll);
+        }
 
         this.quickActionBtns.forEach(btn => {
             btn.addEventListener("click", (e) => {
@@ -110,7 +123,61 @@ class AIAssistant {
         }
     }
 
-    addMessage(text, sender) {
+    // 先載入最新一頁，往上捲動時再載入更早的訊息
+    async loadHistory(older = false) {
+        if (this.loadingHistory || (older && !this.hasOlderHistory)) return;
+        this.loadingHistory = true;
+
+        try {
+            const params = { limit: 30 };
+            if (older && this.historyCursor) {
+                params.before = this.historyCursor;
+            }
+            const response = await API.getAIChatMessages(this.currentChatSessionId, params);
+            const messages = response.data || [];
+            this.historyCursor = response.pagination.before_cursor;
+            this.hasOlderHistory = response.pagination.has_more_before;
+
+            if (!older) {
+                messages.forEach(msg => this.addMessage(this.getMessageText(msg), msg.role));
+                if (messages.length === 0) this.loadInitialMessage();
+                return;
+            }
+
+            // 在頂端插入較早的訊息，並維持目前的捲動位置
+            const previousHeight = this.chatMessages.scrollHeight;
+            const firstChild = this.chatMessages.firstChild;
+            messages.forEach(msg => {
+                const element = this.createMessageElement(this.getMessageText(msg), msg.role);
+                this.chatMessages.insertBefore(element, firstChild);
+            });
+            this.chatMessages.scrollTop += this.chatMessages.scrollHeight - previousHeight;
+        } catch (error) {
+            console.error("載入聊天紀錄失敗:", error);
+            if (!older) {
+                // 會話可能已不存在，改用新會話
+                this.currentChatSessionId = null;
+                localStorage.removeItem("aiChatSessionId");
+                this.loadInitialMessage();
+            }
+        } finally {
+            this.loadingHistory = false;
+        }
+    }
+
+    handleHistoryScroll() {
+        if (this.chatMessages.scrollTop < 40 && this.hasOlderHistory) {
+            this.loadHistory(true);
+        }
+    }
+
+    getMessageText(msg) {
+        // 附件另外以files/gdrive_links回傳，只顯示數量
+        const attachments = (msg.files || []).length + (msg.gdrive_links || []).length;
+        return attachments ? `${msg.content}\n\n📎 ${attachments}個附件` : msg.content;
+    }
+
+    createMessageElement(text, sender) {
         const messageElement = document.createElement("div");
         messageElement.classList.add("message", sender);
 
@@ -122,41 +189,93 @@ class AIAssistant {
 
         const contentElement = document.createElement("div");
         contentElement.classList.add("content");
-        // 檢查 marked 是否存在，如果不存在則直接使用 text
-        contentElement.innerHTML = typeof marked !== 'undefined' ? marked.parse(text) : text;
+        this.renderMessageContent(contentElement, text);
 
         messageElement.appendChild(avatarElement);
         messageElement.appendChild(contentElement);
+        return messageElement;
+    }
+
+    addMessage(text, sender) {
+        const messageElement = this.createMessageElement(text, sender);
         this.chatMessages.appendChild(messageElement);
         this.chatMessages.scrollTop = this.chatMessages.scrollHeight;
+        return messageElement.querySelector(".content");
+    }
+
+    renderMessageContent(contentElement, text) {
+        // 檢查 marked 是否存在，如果不存在則直接使用 text
+        contentElement.innerHTML = typeof marked !== 'undefined' ? marked.parse(text) : text;
+    }
+
+    async ensureChatSession() {
+        if (!this.currentChatSessionId) {
+            const response = await API.createAIChatSession();
+            this.currentChatSessionId = response.data.session_id;
+            localStorage.setItem("aiChatSessionId", this.currentChatSessionId);
+        }
+        return this.currentChatSessionId;
     }
 
     async sendMessage() {
         const message = this.chatInput.value.trim();
-        if (!message && this.uploadedFiles.length === 0) return;
+        const files = [...this.uploadedFiles];
+        if (!message && files.length === 0) return;
 
         this.addMessage(message, "user");
         this.chatInput.value = "";
-        this.clearUploadedFiles();
+
+        const contentElement = this.addMessage("思考中...", "assistant");
+        let replyText = "";
 
         try {
-            this.addMessage("思考中...", "assistant");
-            // 確保 API 物件存在且 sendAIChatMessage 方法存在
-            if (typeof API !== 'undefined' && typeof API.sendAIChatMessage === 'function') {
-                const response = await API.sendAIChatMessage(this.currentChatSessionId, message, this.uploadedFiles);
-                this.chatMessages.lastChild.remove(); // 移除“思考中...”
-                this.addMessage(response.reply, "assistant");
-                this.currentChatSessionId = response.session_id; // 更新會話ID
-            } else {
-                throw new Error("API.sendAIChatMessage is not defined or not a function.");
+            // 確保 API 物件存在且 streamAIChatMessage 方法存在
+            if (typeof API === 'undefined' || typeof API.streamAIChatMessage !== 'function') {
+                throw new Error("API.streamAIChatMessage is not defined or not a function.");
+            }
+
+            const sessionId = await this.ensureChatSession();
+            const uploaded = await this.uploadPendingFiles(files, sessionId);
+            await API.streamAIChatMessage(sessionId, { message, files: uploaded }, {
+                onDelta: (delta) => {
+                    // 逐段顯示收到的 token
+                    replyText += delta;
+                    this.renderMessageContent(contentElement, replyText);
+                    this.chatMessages.scrollTop = this.chatMessages.scrollHeight;
+                }
+            });
+
+            // 送出成功後才移除附件，失敗時保留以便重試
+            this.removeSentFiles(files);
+
+            if (!replyText) {
+                this.renderMessageContent(contentElement, "抱歉，AI助手暫時無法回應。請稍後再試。");
             }
         } catch (error) {
             console.error("發送訊息失敗:", error);
-            this.chatMessages.lastChild.remove();
-            this.addMessage("抱歉，AI助手暫時無法回應。請稍後再試。", "assistant");
+            if (!replyText) {
+                this.renderMessageContent(contentElement, "抱歉，AI助手暫時無法回應。請稍後再試。");
+                if (!this.chatInput.value) {
+                    this.chatInput.value = message;
+                }
+            }
         }
     }
 
+    async uploadPendingFiles(files, sessionId) {
+        // 依序上傳尚未上傳的附件，只將伺服器回傳的 url 與 public_id 帶入訊息
+        const uploaded = [];
+        for (const file of files) {
+            let result = this.uploadResults.get(file);
+            if (!result) {
+                result = await API.uploadChatFile(file, sessionId);
+                this.uploadResults.set(file, result);
+            }
+            uploaded.push({ url: result.url, public_id: result.public_id });
+        }
+        return uploaded;
+    }
+
     handlePaste(e) {
         const items = (e.clipboardData || e.originalEvent.clipboardData).items;
         for (const item of items) {
@@ -225,6 +344,17 @@ class AIAssistant {
         this.updateUploadAreaVisibility();
     }
 
+    removeSentFiles(files) {
+        // 只移除已送出的附件，傳送期間新加入的附件保留
+        this.uploadedFiles = this.uploadedFiles.filter(file => !files.includes(file));
+        for (const preview of [...this.uploadedFilesPreview.children]) {
+            if (!this.uploadedFiles.some(file => file.name === preview.dataset.name)) {
+                preview.remove();
+            }
+        }
+        this.updateUploadAreaVisibility();
+    }
+
     clearUploadedFiles() {
         this.uploadedFiles = [];
         this.uploadedFilesPreview.innerHTML = "";
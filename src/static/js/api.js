@@ -106,6 +106,11 @@ class API {
         return this.post(`/posts/publish/${id}`, { platforms });
     }
     
+    // 一次生成所有平台版本並寫回貼文
+    static async generatePostVariants(id, platforms) {
+        return this.post('/chat/generate-variants', platforms ? { post_id: id, platforms } : { post_id: id });
+    }
+    
     // 行銷 API
     static async getMarketingItems(params = {}) {
         return this.get('/marketing/items', params);
@@ -220,6 +225,103 @@ class API {
     static async markNotificationRead(id) {
         return this.put(`/settings/notifications/${id}/read`);
     }
+    
+    // AI 聊天 API
+    static async createAIChatSession(title) {
+        return this.post('/chat/sessions', title ? { title } : {});
+    }
+    
+    // 分頁取得聊天訊息：params 可為 { limit, before } 或 { limit, after }
+    static async getAIChatMessages(sessionId, params = {}) {
+        return this.get(`/chat/sessions/${sessionId}/messages`, params);
+    }
+    
+    // 上傳聊天附件（multipart），回傳伺服器的上傳結果（url、public_id等）
+    static async uploadChatFile(file, sessionId) {
+        const formData = new FormData();
+        formData.append('file', file);
+        if (sessionId) formData.append('session_id', sessionId);
+        
+        // 檔案上傳路由宣告於 /api 之下，實際路徑為 /api/api/upload-file
+        const response = await fetch(`${this.baseURL}/api/upload-file`, {
+            method: 'POST',
+            body: formData
+        });
+        const data = await response.json();
+        if (!response.ok || !data.success) {
+            throw new Error(data.error || `HTTP error! status: ${response.status}`);
+        }
+        return data.data;
+    }
+    
+    // 以 Server-Sent Events 串流接收 AI 回應
+    // handlers: { onStart(data), onDelta(text), onDone(data) }
+    static async streamAIChatMessage(sessionId, payload, handlers = {}) {
+        const response = await fetch(`${this.baseURL}/chat/sessions/${sessionId}/messages/stream`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'Accept': 'text/event-stream'
+            },
+            body: JSON.stringify(payload)
+        });
+        
+        if (!response.ok || !response.body) {
+            let error = `HTTP error! status: ${response.status}`;
+            try {
+                const data = await response.json();
+                error = data.error || error;
+            } catch (e) {
+                // 非JSON錯誤回應
+            }
+            throw new Error(error);
+        }
+        
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let result = null;
+        
+        const dispatch = (rawEvent) => {
+            let eventName = 'message';
+            const dataLines = [];
+            for (const line of rawEvent.split('\n')) {
+                if (line.startsWith('event:')) {
+                    eventName = line.slice(6).trim();
+                } else if (line.startsWith('data:')) {
+                    dataLines.push(line.slice(5).trimStart());
+                }
+            }
+            if (dataLines.length === 0) return;
+            const data = JSON.parse(dataLines.join('\n'));
+            
+            if (eventName === 'start' && handlers.onStart) {
+                handlers.onStart(data);
+            } else if (eventName === 'delta' && handlers.onDelta) {
+                handlers.onDelta(data.content);
+            } else if (eventName === 'done') {
+                result = data;
+                if (handlers.onDone) handlers.onDone(data);
+            }
+        };
+        
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                dispatch(buffer.slice(0, boundary));
+                buffer = buffer.slice(boundary + 2);
+            }
+        }
+        if (buffer.trim()) {
+            dispatch(buffer);
+        }
+        
+        return result;
+    }
 }
 
 // 資料快取類別
@@ -0,0 +1,136 @@
+import json
+import os
+import threading
+import time
+import uuid
+
+from sqlalchemy import inspect, text, update
+
+# 啟動時是否在背景遷移舊格式的聊天訊息
+CHAT_MIGRATION_ON_STARTUP = os.environ.get('CHAT_MIGRATION_ON_STARTUP', 'true').lower() == 'true'
+CHAT_MIGRATION_BATCH_SIZE = int(os.environ.get('CHAT_MIGRATION_BATCH_SIZE', 500))
+
+def ensure_chat_message_schema(engine):
+    """為既有的chat_messages資料表補上content_format欄位（create_all不會新增欄位）"""
+    columns = {column['name'] for column in inspect(engine).get_columns('chat_messages')}
+    if 'content_format' not in columns:
+        with engine.begin() as connection:
+            # 既有資料列為NULL，代表尚未遷移
+            connection.execute(text('ALTER TABLE chat_messages ADD COLUMN content_format VARCHAR(10)'))
+
+class ChatMessageMigration:
+    """將JSON格式的用戶訊息轉換為純文字內容加上chat_attachments附件
+
+    依主鍵順序分批處理content_format為NULL的資料列，每批提交一次；
+    已遷移的資料列不會再被選取，因此中斷後重跑即可續行。
+    每個gunicorn工作行程與worker.py啟動時都會執行遷移，因此每批先以條件式UPDATE
+    將資料列標記為本行程認領（只更新仍為NULL的資料列），與轉換在同一個交易中提交；
+    其他行程在交易提交後不會再選到這些資料列，不會重複建立附件。
+    """
+
+    def __init__(self, batch_size=CHAT_MIGRATION_BATCH_SIZE, pause_seconds=0.0):
+        self.batch_size = batch_size
+        self.pause_seconds = pause_seconds
+        self.status = 'idle'  # idle, running, completed, failed
+        self.processed_rows = 0
+        self.converted_rows = 0
+        self.attachments_created = 0
+        self.last_id = 0
+        self.error = None
+        # 認領標記（content_format欄位長度為10）
+        self.claim = f'm:{uuid.uuid4().hex[:8]}'
+
+    def claim_batch(self):
+        """認領下一批尚未遷移的資料列並回傳（在目前的交易中，提交前其他行程無法認領）"""
+        from models.ai_chat import ChatMessage, db
+
+        candidates = (db.session.query(ChatMessage.id)
+                      .filter(ChatMessage.content_format.is_(None), ChatMessage.id > self.last_id)
+                      .order_by(ChatMessage.id.asc())
+                      .limit(self.batch_size)
+                      .scalar_subquery())
+        db.session.execute(
+            update(ChatMessage)
+            .where(ChatMessage.id.in_(candidates), ChatMessage.content_format.is_(None))
+            .values(content_format=self.claim)
+            .execution_options(synchronize_session=False)
+        )
+        return (ChatMessage.query
+                .filter(ChatMessage.content_format == self.claim)
+                .order_by(ChatMessage.id.asc())
+                .all())
+
+    def run(self):
+        """同步執行遷移（需在應用程式上下文中呼叫）"""
+        from models.ai_chat import ChatMessage, ChatAttachment, db
+
+        self.status = 'running'
+        try:
+            while True:
+                rows = self.claim_batch()
+                if not rows:
+                    db.session.rollback()
+                    # 其他行程可能已認領剩餘的資料列
+                    if not ChatMessage.query.filter(ChatMessage.content_format.is_(None),
+                                                    ChatMessage.id > self.last_id).first():
+                        break
+                    continue
+
+                for row in rows:
+                    data = ChatMessage.parse_legacy_content(row.role, row.content)
+                    if data is not None:
+                        row.content = data.get('message') or ''
+                        position = 0
+                        for source, key in (('file', 'files'), ('gdrive', 'gdrive_links')):
+                            for result in data.get(key) or []:
+                                if isinstance(result, dict):
+                                    row.attachments.append(ChatAttachment.from_result(source, position, result))
+                                    position += 1
+                        self.attachments_created += position
+                        self.converted_rows += 1
+                    row.content_format = 'text'
+                    self.last_id = row.id
+
+                db.session.commit()
+                # 釋放已處理的物件，讓記憶體用量與資料表大小無關
+                db.session.expunge_all()
+                self.processed_rows += len(rows)
+
+                if self.pause_seconds:
+                    time.sleep(self.pause_seconds)
+
+            self.status = 'completed'
+        except Exception as e:
+            db.session.rollback()
+            self.status = 'failed'
+            self.error = str(e)
+            print(f"聊天訊息遷移失敗 (last_id={self.last_id}): {e}")
+        return self
+
+    def to_dict(self):
+        return {
+            'status': self.status,
+            'processed_rows': self.processed_rows,
+            'converted_rows': self.converted_rows,
+            'attachments_created': self.attachments_created,
+            'last_id': self.last_id,
+            'error': self.error
+        }
+
+def start_chat_migration(app, **kwargs):
+    """在背景執行緒中遷移舊格式的聊天訊息"""
+    migration = ChatMessageMigration(**kwargs)
+
+    def target():
+        from models.ai_chat import db
+
+        with app.app_context():
+            try:
+                migration.run()
+                if migration.converted_rows:
+                    print(f"聊天訊息遷移完成：{json.dumps(migration.to_dict(), ensure_ascii=False)}")
+            finally:
+                db.session.remove()
+
+    threading.Thread(target=target, name='chat-message-migration', daemon=True).start()
+    return migration
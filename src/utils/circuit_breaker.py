@@ -0,0 +1,220 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+
+# 斷路器設定
+AI_BREAKER_FAILURE_RATE = float(os.environ.get('AI_BREAKER_FAILURE_RATE', 0.5))
+AI_BREAKER_SLOW_CALL_SECONDS = float(os.environ.get('AI_BREAKER_SLOW_CALL_SECONDS', 15))
+AI_BREAKER_SLOW_CALL_RATE = float(os.environ.get('AI_BREAKER_SLOW_CALL_RATE', 0.8))
+AI_BREAKER_WINDOW = int(os.environ.get('AI_BREAKER_WINDOW', 20))
+AI_BREAKER_MIN_CALLS = int(os.environ.get('AI_BREAKER_MIN_CALLS', 5))
+AI_BREAKER_OPEN_SECONDS = float(os.environ.get('AI_BREAKER_OPEN_SECONDS', 30))
+AI_BREAKER_HALF_OPEN_CALLS = int(os.environ.get('AI_BREAKER_HALF_OPEN_CALLS', 2))
+
+# 可重試錯誤的重試設定（總嘗試次數與退避時間）
+AI_RETRY_ATTEMPTS = int(os.environ.get('AI_RETRY_ATTEMPTS', 3))
+AI_RETRY_BASE_DELAY = float(os.environ.get('AI_RETRY_BASE_DELAY', 0.5))
+AI_RETRY_MAX_DELAY = float(os.environ.get('AI_RETRY_MAX_DELAY', 4))
+
+class CircuitOpenError(Exception):
+    """斷路器開啟中，呼叫被立即拒絕"""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"{name} 斷路器開啟中，{retry_after:.0f}秒後重新探測")
+        self.retry_after = retry_after
+
+class CircuitBreaker:
+    """以最近N次呼叫的錯誤率與慢呼叫比例判斷上游是否降級
+
+    closed：正常放行，錯誤率或慢呼叫比例超過門檻時轉為open。
+    open：立即拒絕（CircuitOpenError），經過open_seconds後轉為half_open。
+    half_open：只放行少量探測呼叫，全部成功則回到closed，任一失敗則重新open。
+    """
+
+    def __init__(self, name, failure_rate=AI_BREAKER_FAILURE_RATE,
+                 slow_call_seconds=AI_BREAKER_SLOW_CALL_SECONDS,
+                 slow_call_rate=AI_BREAKER_SLOW_CALL_RATE,
+                 window_size=AI_BREAKER_WINDOW, minimum_calls=AI_BREAKER_MIN_CALLS,
+                 open_seconds=AI_BREAKER_OPEN_SECONDS,
+                 half_open_calls=AI_BREAKER_HALF_OPEN_CALLS,
+                 is_failure=None):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.minimum_calls = minimum_calls
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        # 判斷例外是否代表上游故障（例如401等用戶端錯誤不計入）
+        self.is_failure = is_failure or (lambda error: True)
+
+        self._lock = threading.Lock()
+        self._outcomes = deque(maxlen=window_size)  # (failed, slow)
+        self._state = 'closed'
+        self._opened_at = None
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+
+        # 累計統計
+        self._calls = 0
+        self._failures = 0
+        self._slow_calls = 0
+        self._rejected = 0
+        self._fallbacks = 0
+        self._retries = 0
+        self._times_opened = 0
+        self._last_error = None
+
+    @property
+    def state(self):
+        with self._lock:
+            self._refresh_state()
+            return self._state
+
+    def _refresh_state(self):
+        if self._state == 'open' and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._state = 'half_open'
+            self._probes_in_flight = 0
+            self._probe_successes = 0
+
+    def _open(self):
+        self._state = 'open'
+        self._opened_at = time.monotonic()
+        self._times_opened += 1
+
+    def before_call(self):
+        """呼叫前檢查狀態，開啟中時拋出CircuitOpenError"""
+        with self._lock:
+            self._refresh_state()
+            if self._state == 'open':
+                self._rejected += 1
+                retry_after = self.open_seconds - (time.monotonic() - self._opened_at)
+                raise CircuitOpenError(self.name, max(retry_after, 0))
+            if self._state == 'half_open':
+                if self._probes_in_flight >= self.half_open_calls:
+                    self._rejected += 1
+                    raise CircuitOpenError(self.name, 0)
+                self._probes_in_flight += 1
+
+    def record_success(self, duration):
+        slow = duration >= self.slow_call_seconds
+        with self._lock:
+            self._calls += 1
+            self._slow_calls += slow
+            if self._state == 'half_open':
+                self._probes_in_flight = max(self._probes_in_flight - 1, 0)
+                if slow:
+                    self._open()
+                    return
+                self._probe_successes += 1
+                if self._probe_successes >= self.half_open_calls:
+                    # 探測成功，重新開始統計
+                    self._state = 'closed'
+                    self._outcomes.clear()
+                return
+            self._outcomes.append((False, slow))
+            self._evaluate()
+
+    def record_failure(self, error):
+        with self._lock:
+            self._calls += 1
+            self._failures += 1
+            self._last_error = str(error)
+            if self._state == 'half_open':
+                self._probes_in_flight = max(self._probes_in_flight - 1, 0)
+                self._open()
+                return
+            self._outcomes.append((True, False))
+            self._evaluate()
+
+    def record_ignored(self):
+        """呼叫以非上游故障的錯誤結束（例如請求無效），釋放探測名額但不計入統計"""
+        with self._lock:
+            self._calls += 1
+            if self._state == 'half_open':
+                self._probes_in_flight = max(self._probes_in_flight - 1, 0)
+
+    def record_fallback(self):
+        with self._lock:
+            self._fallbacks += 1
+
+    def _evaluate(self):
+        if self._state != 'closed' or len(self._outcomes) < self.minimum_calls:
+            return
+        total = len(self._outcomes)
+        failed = sum(1 for failure, _ in self._outcomes if failure)
+        slow = sum(1 for _, is_slow in self._outcomes if is_slow)
+        if failed / total >= self.failure_rate or slow / total >= self.slow_call_rate:
+            self._open()
+
+    def call(self, fn, *args, is_retryable=None, attempts=AI_RETRY_ATTEMPTS, **kwargs):
+        """透過斷路器呼叫fn，可重試的錯誤以指數退避加隨機抖動重試"""
+        attempt = 0
+        while True:
+            attempt += 1
+            self.before_call()
+            start = time.monotonic()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                if not self.is_failure(e):
+                    self.record_ignored()
+                    raise
+                self.record_failure(e)
+                if attempt >= attempts or not (is_retryable and is_retryable(e)):
+                    raise
+                with self._lock:
+                    self._retries += 1
+                delay = min(AI_RETRY_MAX_DELAY, AI_RETRY_BASE_DELAY * (2 ** (attempt - 1)))
+                time.sleep(random.uniform(0, delay))
+                continue
+            self.record_success(time.monotonic() - start)
+            return result
+
+    def reset(self):
+        """手動重設為closed"""
+        with self._lock:
+            self._state = 'closed'
+            self._outcomes.clear()
+            self._opened_at = None
+
+    def stats(self):
+        """斷路器狀態與統計"""
+        with self._lock:
+            self._refresh_state()
+            total = len(self._outcomes)
+            failed = sum(1 for failure, _ in self._outcomes if failure)
+            slow = sum(1 for _, is_slow in self._outcomes if is_slow)
+            retry_after = None
+            if self._state == 'open':
+                retry_after = round(max(self.open_seconds - (time.monotonic() - self._opened_at), 0), 1)
+            return {
+                'name': self.name,
+                'state': self._state,
+                'retry_after_seconds': retry_after,
+                'window': {
+                    'calls': total,
+                    'failure_rate': round(failed / total, 3) if total else 0.0,
+                    'slow_call_rate': round(slow / total, 3) if total else 0.0
+                },
+                'thresholds': {
+                    'failure_rate': self.failure_rate,
+                    'slow_call_seconds': self.slow_call_seconds,
+                    'slow_call_rate': self.slow_call_rate,
+                    'minimum_calls': self.minimum_calls,
+                    'open_seconds': self.open_seconds,
+                    'half_open_calls': self.half_open_calls
+                },
+                'totals': {
+                    'calls': self._calls,
+                    'failures': self._failures,
+                    'slow_calls': self._slow_calls,
+                    'rejected': self._rejected,
+                    'fallbacks': self._fallbacks,
+                    'retries': self._retries,
+                    'times_opened': self._times_opened
+                },
+                'last_error': self._last_error
+            }
@@ -1,25 +1,59 @@
 import os
 import base64
-from cryptography.fernet import Fernet
+import threading
+from cryptography.fernet import Fernet, MultiFernet, InvalidToken
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 
+# 已推導的Fernet實例快取，以(master_key, salt)為鍵，於整個行程生命週期內共用
+_fernet_cache = {}
+_fernet_cache_lock = threading.Lock()
+
+def _derive_fernet(master_key, salt):
+    """以PBKDF2推導Fernet密鑰（每組master_key/salt只計算一次）"""
+    cache_key = (master_key, salt)
+    fernet = _fernet_cache.get(cache_key)
+    if fernet is not None:
+        return fernet
+    
+    with _fernet_cache_lock:
+        fernet = _fernet_cache.get(cache_key)
+        if fernet is None:
+            kdf = PBKDF2HMAC(
+                algorithm=hashes.SHA256(),
+                length=32,
+                salt=salt,
+                iterations=100000,
+            )
+            key = base64.urlsafe_b64encode(kdf.derive(master_key.encode()))
+            fernet = Fernet(key)
+            _fernet_cache[cache_key] = fernet
+    return fernet
+
+def clear_fernet_cache():
+    """清除已推導的密鑰快取（例如測試或更換MASTER_KEY後）"""
+    with _fernet_cache_lock:
+        _fernet_cache.clear()
+
 class EncryptionManager:
     def __init__(self):
         # 使用環境變數或預設密鑰
         self.master_key = os.environ.get('MASTER_KEY', 'default_master_key_777tech_2024')
         self.salt = b'777tech_salt_2024'  # 在生產環境中應該使用隨機鹽值
+        # 輪替前使用過的舊密鑰（逗號分隔，新到舊），僅用於解密
+        self.previous_master_keys = [
+            k.strip() for k in os.environ.get('PREVIOUS_MASTER_KEYS', '').split(',') if k.strip()
+        ]
         
     def _get_fernet_key(self):
-        """生成Fernet加密密鑰"""
-        kdf = PBKDF2HMAC(
-            algorithm=hashes.SHA256(),
-            length=32,
-            salt=self.salt,
-            iterations=100000,
-        )
-        key = base64.urlsafe_b64encode(kdf.derive(self.master_key.encode()))
-        return Fernet(key)
+        """獲取目前（最新）的Fernet加密密鑰（PBKDF2推導結果會被快取）"""
+        return _derive_fernet(self.master_key, self.salt)
+    
+    def _get_multi_fernet(self):
+        """獲取可用所有已知密鑰解密、以最新密鑰加密的MultiFernet"""
+        fernets = [self._get_fernet_key()]
+        fernets.extend(_derive_fernet(k, self.salt) for k in self.previous_master_keys)
+        return MultiFernet(fernets)
     
     def encrypt_api_key(self, api_key):
         """加密API密鑰"""
@@ -32,9 +66,9 @@ class EncryptionManager:
             return None
     
     def decrypt_api_key(self, encrypted_key):
-        """解密API密鑰"""
+        """解密API密鑰（支援輪替前的舊密鑰）"""
         try:
-            f = self._get_fernet_key()
+            f = self._get_multi_fernet()
             encrypted_data = base64.urlsafe_b64decode(encrypted_key.encode())
             decrypted_key = f.decrypt(encrypted_data)
             return decrypted_key.decode()
@@ -42,6 +76,65 @@ class EncryptionManager:
             print(f"解密失敗: {e}")
             return None
     
+    def encrypt_many(self, values):
+        """批次加密，只推導一次密鑰；空值以None回傳"""
+        try:
+            f = self._get_fernet_key()
+        except Exception as e:
+            print(f"加密失敗: {e}")
+            return [None for _ in values]
+        
+        results = []
+        for value in values:
+            if not value:
+                results.append(None)
+                continue
+            try:
+                encrypted_key = f.encrypt(value.encode())
+                results.append(base64.urlsafe_b64encode(encrypted_key).decode())
+            except Exception as e:
+                print(f"加密失敗: {e}")
+                results.append(None)
+        return results
+    
+    def decrypt_many(self, encrypted_values):
+        """批次解密，只推導一次密鑰；空值或解密失敗以None回傳"""
+        try:
+            f = self._get_multi_fernet()
+        except Exception as e:
+            print(f"解密失敗: {e}")
+            return [None for _ in encrypted_values]
+        
+        results = []
+        for encrypted_value in encrypted_values:
+            if not encrypted_value:
+                results.append(None)
+                continue
+            try:
+                encrypted_data = base64.urlsafe_b64decode(encrypted_value.encode())
+                results.append(f.decrypt(encrypted_data).decode())
+            except Exception as e:
+                print(f"解密失敗: {e}")
+                results.append(None)
+        return results
+    
+    def needs_rotation(self, encrypted_value):
+        """檢查密文是否尚未使用最新密鑰加密"""
+        if not encrypted_value:
+            return False
+        try:
+            encrypted_data = base64.urlsafe_b64decode(encrypted_value.encode())
+            self._get_fernet_key().decrypt(encrypted_data)
+            return False
+        except InvalidToken:
+            return True
+    
+    def rotate(self, encrypted_value):
+        """以最新密鑰重新加密密文（任一已知密鑰皆可解密），無法解密時拋出InvalidToken"""
+        encrypted_data = base64.urlsafe_b64decode(encrypted_value.encode())
+        rotated = self._get_multi_fernet().rotate(encrypted_data)
+        return base64.urlsafe_b64encode(rotated).decode()
+    
     def validate_openai_key(self, api_key):
         """驗證OpenAI API密鑰格式"""
         if not api_key:
@@ -0,0 +1,217 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+# 文件內容提取設定
+EXTRACTION_WORKERS = int(os.environ.get('EXTRACTION_WORKERS', 2))
+EXTRACTION_TIMEOUT = float(os.environ.get('EXTRACTION_TIMEOUT', 20))
+EXTRACTION_MAX_PAGES = int(os.environ.get('EXTRACTION_MAX_PAGES', 50))
+EXTRACTION_MAX_CHARS = int(os.environ.get('EXTRACTION_MAX_CHARS', 100000))
+# 工作行程未在期限內自行返回時，額外等待的秒數
+EXTRACTION_GRACE_SECONDS = 5
+
+PDF_TYPE = 'application/pdf'
+DOCX_TYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+
+def extraction_result(parts, truncated, pages_processed=None, total_pages=None, timed_out=False):
+    text = '\n'.join(parts).strip()
+    return {
+        'text': text,
+        'truncated': truncated,
+        'timed_out': timed_out,
+        'pages_processed': pages_processed,
+        'total_pages': total_pages,
+        'chars': len(text)
+    }
+
+def iter_pdf_blocks(path, max_pages=None, info=None):
+    """逐頁產生PDF文字（info會記錄總頁數）"""
+    import PyPDF2
+
+    reader = PyPDF2.PdfReader(path)
+    pages = reader.pages
+    if info is not None:
+        info['total_pages'] = len(pages)
+    for index in range(min(len(pages), max_pages or len(pages))):
+        yield pages[index].extract_text() or ''
+
+W_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+def _iter_docx_part(source):
+    """以iterparse串流解析一個WordprocessingML部分，依文件順序產生段落與表格列
+
+    表格的每一列以「 | 」連接各儲存格；處理完的元素會立即清除，
+    記憶體用量與文件大小無關。
+    """
+    from lxml import etree
+
+    table_depth = 0
+    row_cells = []
+    cell_parts = []
+    context = etree.iterparse(source, events=('start', 'end'), tag=(
+        f'{W_NS}tbl', f'{W_NS}tr', f'{W_NS}tc', f'{W_NS}p'
+    ))
+    for event, element in context:
+        tag = element.tag
+        if event == 'start':
+            if tag == f'{W_NS}tbl':
+                table_depth += 1
+            elif tag == f'{W_NS}tr' and table_depth == 1:
+                row_cells = []
+            elif tag == f'{W_NS}tc' and table_depth == 1:
+                cell_parts = []
+            continue
+
+        if tag == f'{W_NS}p':
+            text = ''.join(element.itertext(f'{W_NS}t'))
+            if table_depth:
+                if text:
+                    cell_parts.append(text)
+            elif text:
+                yield text
+        elif tag == f'{W_NS}tc' and table_depth == 1:
+            row_cells.append(' '.join(cell_parts))
+        elif tag == f'{W_NS}tr' and table_depth == 1:
+            if any(row_cells):
+                yield ' | '.join(row_cells)
+        elif tag == f'{W_NS}tbl':
+            table_depth -= 1
+        else:
+            # 巢狀表格內的列與儲存格只保留段落文字
+            continue
+
+        if table_depth == 0 or tag == f'{W_NS}p':
+            # 釋放已處理的元素與先前的兄弟節點
+            element.clear()
+            parent = element.getparent()
+            if parent is not None and table_depth == 0:
+                while element.getprevious() is not None:
+                    del parent[0]
+
+def iter_docx_blocks(path):
+    """依序產生DOCX頁首與內文（含表格）的文字區塊"""
+    import re
+    import zipfile
+
+    with zipfile.ZipFile(path) as archive:
+        names = archive.namelist()
+        headers = sorted(
+            (name for name in names if re.fullmatch(r'word/header\d*\.xml', name)),
+            key=lambda name: int(re.sub(r'\D', '', name) or 0)
+        )
+        for name in headers + ['word/document.xml']:
+            if name not in names:
+                continue
+            with archive.open(name) as part:
+                yield from _iter_docx_part(part)
+
+def collect_blocks(blocks, max_chars, time_limit, info=None):
+    """從區塊產生器收集文字，達到字數或時間上限時提早停止"""
+    deadline = time.monotonic() + time_limit
+    parts = []
+    chars = 0
+    count = 0
+    truncated = False
+    timed_out = False
+    for block in blocks:
+        count += 1
+        if chars + len(block) >= max_chars:
+            parts.append(block[:max_chars - chars])
+            truncated = True
+            break
+        parts.append(block)
+        chars += len(block) + 1
+        if time.monotonic() >= deadline:
+            truncated = timed_out = True
+            break
+    if hasattr(blocks, 'close'):
+        # 提早停止時關閉產生器，釋放檔案與解析器
+        blocks.close()
+    return parts, count, truncated, timed_out
+
+def extract_pdf_text(path, max_pages, max_chars, time_limit):
+    """在工作行程中逐頁提取PDF文字，超過頁數、字數或時間上限時回傳已提取的部分"""
+    info = {}
+    parts, pages_processed, truncated, timed_out = collect_blocks(
+        iter_pdf_blocks(path, max_pages, info), max_chars, time_limit
+    )
+    total_pages = info.get('total_pages', pages_processed)
+    truncated = truncated or total_pages > pages_processed
+    return extraction_result(parts, truncated, pages_processed, total_pages, timed_out)
+
+def extract_docx_text(path, max_pages, max_chars, time_limit):
+    """在工作行程中提取Word頁首、段落與表格文字（無頁數資訊，以字數與時間為上限）"""
+    parts, _, truncated, timed_out = collect_blocks(iter_docx_blocks(path), max_chars, time_limit)
+    return extraction_result(parts, truncated, timed_out=timed_out)
+
+EXTRACTORS = {
+    PDF_TYPE: extract_pdf_text,
+    DOCX_TYPE: extract_docx_text
+}
+
+class ExtractionError(Exception):
+    """工作行程提取失敗或異常結束"""
+
+# 同時執行的提取行程數；超過時在呼叫端排隊，排隊時間不計入時限
+_slots = threading.BoundedSemaphore(EXTRACTION_WORKERS)
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _run_worker(command, timeout):
+    """執行一個提取工作行程並回傳其輸出；逾時時只終止該行程並回傳None"""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        filter(None, [SRC_DIR, os.environ.get('PYTHONPATH')])
+    ))
+    process = subprocess.Popen(
+        command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env, close_fds=True
+    )
+    try:
+        output, errors = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.communicate()
+        return None
+    if process.returncode != 0:
+        message = errors.decode('utf-8', errors='replace').strip().splitlines()
+        raise ExtractionError(message[-1] if message else f'工作行程異常結束（exitcode={process.returncode}）')
+    return output
+
+def extract_document(stream, file_type, max_pages=EXTRACTION_MAX_PAGES,
+                     max_chars=EXTRACTION_MAX_CHARS, time_limit=EXTRACTION_TIMEOUT):
+    """在獨立的工作行程中提取PDF/DOCX文字，回傳含truncated旗標的結果
+
+    文件先分段複製到暫存檔，只將路徑傳給工作行程；每份文件使用一個新的直譯器行程
+    （不從多執行緒的伺服器行程fork），同時最多EXTRACTION_WORKERS個，時限從行程啟動時起算。
+    工作行程會在時限內自行停止並回傳部分結果；若單頁處理卡住超過寬限時間，
+    則只終止該行程並回傳空的部分結果。
+    """
+    if file_type not in EXTRACTORS:
+        raise KeyError(file_type)
+
+    with tempfile.NamedTemporaryFile(suffix='.extract', delete=False) as temp:
+        shutil.copyfileobj(stream, temp, 64 * 1024)
+        path = temp.name
+
+    try:
+        arguments = json.dumps([file_type, path, max_pages, max_chars, time_limit])
+        with _slots:
+            output = _run_worker(
+                [sys.executable, '-m', 'utils.extraction', arguments],
+                time_limit + EXTRACTION_GRACE_SECONDS
+            )
+        if output is None:
+            print(f"文件內容提取逾時（{time_limit}秒），終止工作行程")
+            return extraction_result([], True, timed_out=True)
+        return json.loads(output)
+    finally:
+        os.unlink(path)
+
+if __name__ == '__main__':
+    # 工作行程進入點：python -m utils.extraction '[file_type, path, max_pages, max_chars, time_limit]'
+    file_type, path, max_pages, max_chars, time_limit = json.loads(sys.argv[1])
+    result = EXTRACTORS[file_type](path, max_pages, max_chars, time_limit)
+    sys.stdout.write(json.dumps(result, ensure_ascii=False))
@@ -0,0 +1,137 @@
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+
+class GDriveCache:
+    """Google Drive文件處理結果的快取（gdrive_files資料表）
+
+    在ttl秒內重複貼上同一個文件連結時直接回傳快取結果，不連線；
+    超過ttl後以If-None-Match/If-Modified-Since重新驗證，304時沿用快取。
+    項目數超過max_entries時刪除最久未驗證的項目。
+    """
+
+    def __init__(self, enabled=True, ttl=600, max_entries=5000):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self.fresh_hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.downloads = 0
+        self.bytes_downloaded = 0
+
+    def lookup(self, file_id):
+        """查詢快取，回傳含result、fresh與驗證標頭的dict（未命中時回傳None）"""
+        from models.ai_chat import GDriveFile
+
+        entry = GDriveFile.query.filter_by(file_id=file_id).first()
+        if not entry:
+            with self._lock:
+                self.misses += 1
+            return None
+        fresh = entry.checked_at and datetime.utcnow() - entry.checked_at < timedelta(seconds=self.ttl)
+        return {
+            'fresh': bool(fresh),
+            'etag': entry.etag,
+            'last_modified': entry.last_modified,
+            'result': self._result(entry)
+        }
+
+    def hit(self, file_id, revalidated=False):
+        """記錄命中；重新驗證成功（304）時同時更新驗證時間"""
+        from models.ai_chat import GDriveFile, db
+
+        entry = GDriveFile.query.filter_by(file_id=file_id).first()
+        if not entry:
+            return
+        entry.hit_count += 1
+        if revalidated:
+            entry.checked_at = datetime.utcnow()
+        db.session.commit()
+        with self._lock:
+            if revalidated:
+                self.revalidated += 1
+            else:
+                self.fresh_hits += 1
+
+    def store(self, file_id, result, etag=None, last_modified=None, size=None):
+        """寫入下載後的處理結果"""
+        from models.ai_chat import GDriveFile, db
+
+        entry = GDriveFile.query.filter_by(file_id=file_id).first()
+        if not entry:
+            entry = GDriveFile(file_id=file_id)
+            db.session.add(entry)
+        stored = {key: value for key, value in result.items() if key not in ('content', 'original_url')}
+        entry.result = json.dumps(stored, ensure_ascii=False)
+        entry.extracted_text = result.get('content')
+        entry.etag = etag
+        entry.last_modified = last_modified
+        entry.content_type = result.get('content_type')
+        entry.size = size
+        entry.checked_at = datetime.utcnow()
+        db.session.commit()
+
+        with self._lock:
+            self.downloads += 1
+            self.bytes_downloaded += size or 0
+        self._evict()
+
+    @staticmethod
+    def _result(entry):
+        result = json.loads(entry.result)
+        if entry.extracted_text is not None:
+            result['content'] = entry.extracted_text
+        return result
+
+    def _evict(self):
+        from models.ai_chat import GDriveFile, db
+
+        overflow = GDriveFile.query.count() - self.max_entries
+        if overflow <= 0:
+            return
+        stale_ids = [
+            row_id for (row_id,) in db.session.query(GDriveFile.id)
+            .order_by(GDriveFile.checked_at.asc())
+            .limit(overflow)
+        ]
+        GDriveFile.query.filter(GDriveFile.id.in_(stale_ids)).delete(synchronize_session=False)
+        db.session.commit()
+
+    def clear(self):
+        from models.ai_chat import GDriveFile, db
+
+        GDriveFile.query.delete()
+        db.session.commit()
+
+    def stats(self):
+        from models.ai_chat import GDriveFile, db
+
+        entries, total_hits = db.session.query(
+            db.func.count(GDriveFile.id),
+            db.func.coalesce(db.func.sum(GDriveFile.hit_count), 0)
+        ).one()
+        with self._lock:
+            lookups = self.fresh_hits + self.revalidated + self.downloads
+            return {
+                'enabled': self.enabled,
+                'entries': entries,
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'total_hits': total_hits,
+                'fresh_hits': self.fresh_hits,
+                'revalidated': self.revalidated,
+                'misses': self.misses,
+                'downloads': self.downloads,
+                'bytes_downloaded': self.bytes_downloaded,
+                'hit_rate': ((self.fresh_hits + self.revalidated) / lookups) if lookups else 0.0
+            }
+
+# 全域Google Drive快取（設定GDRIVE_CACHE_ENABLED=false停用）
+gdrive_cache = GDriveCache(
+    enabled=os.environ.get('GDRIVE_CACHE_ENABLED', 'true').lower() == 'true',
+    ttl=int(os.environ.get('GDRIVE_CACHE_TTL', 600)),
+    max_entries=int(os.environ.get('GDRIVE_CACHE_MAX_ENTRIES', 5000))
+)
@@ -0,0 +1,169 @@
+import base64
+import binascii
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+# 各視覺模型的圖片長邊上限（OpenAI高解析度模式會再將短邊縮至768，超過此尺寸只增加傳輸量）
+MODEL_IMAGE_MAX_SIDE = {
+    'gpt-4-vision-preview': 1024,
+    'gpt-4o': 1024,
+    'gpt-4o-mini': 1024,
+}
+DEFAULT_IMAGE_MAX_SIDE = 1024
+# 設定時覆蓋所有模型的長邊上限
+IMAGE_MAX_SIDE = int(os.environ.get('IMAGE_MAX_SIDE', 0)) or None
+IMAGE_QUALITY = int(os.environ.get('IMAGE_QUALITY', 82))
+IMAGE_DETAIL = os.environ.get('IMAGE_DETAIL', 'auto')  # auto, low, high
+IMAGE_CACHE_SIZE = int(os.environ.get('IMAGE_CACHE_SIZE', 256))
+# 本機處理data URL圖片時，解碼後的大小上限（超過時沿用原網址）
+IMAGE_DATA_URL_LIMIT = int(float(os.environ.get('IMAGE_DATA_URL_LIMIT_MB', 20)) * 1024 * 1024)
+
+# Cloudinary圖片傳遞網址：.../image/upload/[既有轉換/][v123/]public_id.ext
+CLOUDINARY_UPLOAD_PATTERN = re.compile(r'^(https?://res\.cloudinary\.com/[^/]+/image/upload/)(.+)$')
+
+def get_max_side(model):
+    """獲取模型的圖片長邊上限"""
+    return IMAGE_MAX_SIDE or MODEL_IMAGE_MAX_SIDE.get(model, DEFAULT_IMAGE_MAX_SIDE)
+
+def cloudinary_variant_url(url, max_side):
+    """產生Cloudinary轉換網址：等比縮至長邊max_side以內、自動品質、JPEG
+
+    Cloudinary轉換後的圖片預設不保留EXIF等中繼資料，且依EXIF方向自動旋轉。
+    不是Cloudinary圖片網址時回傳None。
+    """
+    match = CLOUDINARY_UPLOAD_PATTERN.match(url or '')
+    if not match:
+        return None
+    transformation = f'c_limit,w_{max_side},h_{max_side},q_auto:good,f_jpg'
+    return f'{match.group(1)}{transformation}/{match.group(2)}'
+
+def downscale_image(data, max_side, quality=IMAGE_QUALITY):
+    """以Pillow縮圖並重新編碼為JPEG（依EXIF轉正後移除中繼資料），回傳(bytes, 寬, 高)"""
+    with Image.open(BytesIO(data)) as image:
+        # JPEG可在解碼時直接以1/2、1/4、1/8比例縮小，大幅減少解碼時間與記憶體
+        image.draft('RGB', (max_side, max_side))
+        image = ImageOps.exif_transpose(image)
+        if image.mode in ('RGBA', 'LA', 'P'):
+            # JPEG不支援透明度，以白色背景合成
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+        output = BytesIO()
+        # 不傳入exif/icc_profile，輸出不含中繼資料
+        image.save(output, format='JPEG', quality=quality, optimize=True, progressive=True)
+        return output.getvalue(), image.width, image.height
+
+class ImagePreparer:
+    """視覺模型呼叫前的圖片前處理
+
+    Cloudinary圖片直接改用轉換網址（由CDN產生縮圖，不需下載）；
+    data URL則解碼後以Pillow縮圖。其他網址不在伺服器端下載（避免SSRF），原樣傳給模型。
+    本機產生的縮圖以「內容SHA-256＋長邊上限」為鍵快取於行程內LRU。
+    """
+
+    def __init__(self, cache_size=IMAGE_CACHE_SIZE):
+        self.cache_size = cache_size
+        self._cache = OrderedDict()  # (sha256, max_side) -> data URL
+        self._lock = threading.Lock()
+        self.cloudinary_variants = 0
+        self.local_variants = 0
+        self.cache_hits = 0
+        self.bytes_before = 0
+        self.bytes_after = 0
+        self.passthrough = 0
+        self.failures = 0
+
+    def prepare_url(self, url, model):
+        """回傳送給模型的圖片網址（無法處理時回傳原網址）
+
+        只處理伺服器上傳的Cloudinary圖片（轉換網址）與data URL（本機縮圖）；
+        其他網址不在伺服器端下載，原樣交給模型。
+        """
+        max_side = get_max_side(model)
+        variant = cloudinary_variant_url(url, max_side)
+        if variant:
+            with self._lock:
+                self.cloudinary_variants += 1
+            return variant
+
+        if not url.startswith('data:'):
+            with self._lock:
+                self.passthrough += 1
+            return url
+
+        data = self._decode_data_url(url)
+        if data is None:
+            with self._lock:
+                self.failures += 1
+            return url
+        return self.prepare_bytes(data, max_side) or url
+
+    @staticmethod
+    def _decode_data_url(url):
+        """解碼base64 data URL（超過大小上限或格式錯誤時回傳None）"""
+        header, _, encoded = url.partition(',')
+        if not header.endswith(';base64') or not encoded:
+            return None
+        if len(encoded) * 3 // 4 > IMAGE_DATA_URL_LIMIT:
+            print("圖片超過大小上限，使用原網址")
+            return None
+        try:
+            return base64.b64decode(encoded, validate=True)
+        except (binascii.Error, ValueError) as e:
+            print(f"圖片data URL解碼失敗，使用原網址: {e}")
+            return None
+
+    def prepare_bytes(self, data, max_side):
+        """以Pillow產生縮圖並回傳data URL（無法解析時回傳None）"""
+        key = (hashlib.sha256(data).hexdigest(), max_side)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached:
+                self._cache.move_to_end(key)
+                self.cache_hits += 1
+                return cached
+
+        try:
+            prepared, _, _ = downscale_image(data, max_side)
+        except Exception as e:
+            print(f"圖片前處理失敗: {e}")
+            with self._lock:
+                self.failures += 1
+            return None
+
+        data_url = f"data:image/jpeg;base64,{base64.b64encode(prepared).decode()}"
+        with self._lock:
+            self.local_variants += 1
+            self.bytes_before += len(data)
+            self.bytes_after += len(prepared)
+            self._cache[key] = data_url
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return data_url
+
+    def stats(self):
+        with self._lock:
+            return {
+                'cloudinary_variants': self.cloudinary_variants,
+                'local_variants': self.local_variants,
+                'cache_hits': self.cache_hits,
+                'cache_size': len(self._cache),
+                'bytes_before': self.bytes_before,
+                'bytes_after': self.bytes_after,
+                'passthrough': self.passthrough,
+                'failures': self.failures
+            }
+
+# 全域圖片前處理器
+image_preparer = ImagePreparer()
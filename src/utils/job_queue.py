@@ -0,0 +1,313 @@
+import json
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+# 工作類型 -> 處理函式(payload) -> 可JSON序列化的結果
+_handlers = {}
+
+# 執行中的工作超過此秒數未更新locked_at（心跳），視為工作者已中止並重新排入佇列
+JOB_LOCK_TIMEOUT = int(os.environ.get('AI_JOB_LOCK_TIMEOUT', 600))
+JOB_POLL_INTERVAL = float(os.environ.get('AI_JOB_POLL_INTERVAL', 0.5))
+JOB_RETRY_BASE_DELAY = float(os.environ.get('AI_JOB_RETRY_BASE_DELAY', 2))
+# 回收逾時工作的間隔秒數（每個行程），避免每次輪詢都取得SQLite寫入鎖
+JOB_RECLAIM_INTERVAL = float(os.environ.get('AI_JOB_RECLAIM_INTERVAL', 30))
+# 執行中的工作更新locked_at的間隔秒數，執行時間超過JOB_LOCK_TIMEOUT的工作不會被回收
+JOB_HEARTBEAT_INTERVAL = float(os.environ.get('AI_JOB_HEARTBEAT_INTERVAL', min(60, JOB_LOCK_TIMEOUT / 4)))
+
+class JobCancelled(Exception):
+    """工作在執行期間被取消"""
+
+class PermanentJobError(Exception):
+    """不應重試的錯誤（例如請求內容無效）"""
+
+def register_handler(job_type, handler):
+    """註冊工作類型的處理函式"""
+    _handlers[job_type] = handler
+
+def enqueue(job_type, payload, max_attempts=3):
+    """建立工作並回傳AIJob（由呼叫端所在的應用程式上下文寫入）"""
+    from models.ai_job import AIJob, db
+
+    if job_type not in _handlers:
+        raise ValueError(f"未知的工作類型: {job_type}")
+
+    job = AIJob(
+        id=str(uuid.uuid4()),
+        job_type=job_type,
+        payload=json.dumps(payload, ensure_ascii=False),
+        max_attempts=max_attempts,
+        run_after=datetime.utcnow()
+    )
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+# 目前執行緒正在執行的工作（供處理函式提交寫入前檢查取消）
+_current = threading.local()
+
+def cancel(job_id):
+    """取消工作：排隊中的工作立即取消；執行中的工作在寫入結果前停止
+
+    處理函式以commit_unless_cancelled提交寫入，取消請求若晚於該次提交則不再生效，
+    工作仍會完成；沒有寫入資料的工作（例如只產生內容）在完成時捨棄結果。
+    """
+    from models.ai_job import AIJob, db
+
+    job = db.session.get(AIJob, job_id)
+    if not job:
+        return None
+    if job.status == 'queued':
+        job.status = 'cancelled'
+        job.finished_at = datetime.utcnow()
+    elif job.status == 'running':
+        job.cancel_requested = True
+    db.session.commit()
+    return job
+
+def is_cancel_requested(job_id):
+    """供處理函式在耗時步驟之間檢查是否已被取消"""
+    from models.ai_job import AIJob, db
+
+    return bool(db.session.query(AIJob.cancel_requested).filter_by(id=job_id).scalar())
+
+def commit_unless_cancelled():
+    """提交處理函式的寫入；所屬工作已被要求取消時改為回滾並拋出JobCancelled
+
+    以條件式UPDATE鎖定工作資料列，與寫入在同一個交易中提交，
+    檢查與提交之間不會遺漏取消請求；工作已被回收給其他工作者時同樣不寫入。
+    不在背景工作中執行時直接提交。
+    """
+    from models.ai_job import AIJob, db
+
+    job_id = getattr(_current, 'job_id', None)
+    if job_id:
+        guarded = AIJob.query.filter(
+            AIJob.id == job_id,
+            AIJob.status == 'running',
+            AIJob.worker_id == _current.worker_id,
+            AIJob.cancel_requested.is_(False)
+        ).update({'locked_at': datetime.utcnow()}, synchronize_session=False)
+        if guarded != 1:
+            db.session.rollback()
+            raise JobCancelled()
+    db.session.commit()
+    if job_id:
+        _current.committed = True
+
+_reclaim_lock = threading.Lock()
+_last_reclaim = float('-inf')
+
+def _reclaim_stale():
+    """回收鎖定逾時的工作（工作者已中止，未再更新locked_at），每JOB_RECLAIM_INTERVAL秒最多執行一次"""
+    global _last_reclaim
+    from models.ai_job import AIJob, db
+
+    with _reclaim_lock:
+        now = time.monotonic()
+        if now - _last_reclaim < JOB_RECLAIM_INTERVAL:
+            return
+        _last_reclaim = now
+
+    AIJob.query.filter(
+        AIJob.status == 'running',
+        AIJob.locked_at < datetime.utcnow() - timedelta(seconds=JOB_LOCK_TIMEOUT)
+    ).update({'status': 'queued', 'worker_id': None, 'locked_at': None}, synchronize_session=False)
+    db.session.commit()
+
+def _claim_next(worker_id):
+    """以條件式UPDATE原子地領取下一個可執行的工作"""
+    from models.ai_job import AIJob, db
+
+    _reclaim_stale()
+    now = datetime.utcnow()
+
+    candidate = db.session.query(AIJob.id).filter(
+        AIJob.status == 'queued',
+        AIJob.run_after <= now
+    ).order_by(AIJob.run_after.asc(), AIJob.created_at.asc()).first()
+    if not candidate:
+        return None
+
+    claimed = AIJob.query.filter(
+        AIJob.id == candidate[0],
+        AIJob.status == 'queued'
+    ).update({
+        'status': 'running',
+        'worker_id': worker_id,
+        'locked_at': now,
+        'attempts': AIJob.attempts + 1
+    }, synchronize_session=False)
+    db.session.commit()
+
+    if claimed != 1:
+        # 已被其他工作者領取
+        return None
+    return db.session.get(AIJob, candidate[0])
+
+def _update_owned(job_id, worker_id, values):
+    """只在工作仍由worker_id執行時更新狀態；工作已被回收給其他工作者時不覆寫並回傳False"""
+    from models.ai_job import AIJob, db
+
+    updated = AIJob.query.filter(
+        AIJob.id == job_id,
+        AIJob.status == 'running',
+        AIJob.worker_id == worker_id
+    ).update(values, synchronize_session=False)
+    db.session.commit()
+    if updated != 1:
+        print(f"AI工作已不屬於此工作者，略過狀態更新 ({job_id}, {worker_id})")
+        return False
+    return True
+
+def _finish(job_id, worker_id, status, result=None, error=None):
+    return _update_owned(job_id, worker_id, {
+        'status': status,
+        'result': json.dumps(result, ensure_ascii=False) if result is not None else None,
+        'error': error,
+        'locked_at': None,
+        'finished_at': datetime.utcnow()
+    })
+
+def _schedule_retry(job_id, worker_id, attempts, error):
+    # 指數退避加上隨機抖動，避免同時重試
+    delay = JOB_RETRY_BASE_DELAY * (2 ** (attempts - 1)) * (0.5 + random.random())
+    return _update_owned(job_id, worker_id, {
+        'status': 'queued',
+        'error': error,
+        'worker_id': None,
+        'locked_at': None,
+        'run_after': datetime.utcnow() + timedelta(seconds=delay)
+    })
+
+def _heartbeat(engine, job_id, worker_id, stopped):
+    """工作執行期間定期更新locked_at（使用獨立連線，不影響處理函式的交易）"""
+    from models.ai_job import AIJob
+
+    jobs = AIJob.__table__
+    while not stopped.wait(JOB_HEARTBEAT_INTERVAL):
+        try:
+            with engine.begin() as connection:
+                updated = connection.execute(
+                    jobs.update()
+                    .where(jobs.c.id == job_id, jobs.c.status == 'running', jobs.c.worker_id == worker_id)
+                    .values(locked_at=datetime.utcnow())
+                ).rowcount
+            if updated != 1:
+                return
+        except Exception as e:
+            print(f"AI工作心跳更新失敗 ({job_id}): {e}")
+
+def run_job(job):
+    """執行單一已領取的工作"""
+    from models.ai_job import db
+
+    job_id = job.id
+    worker_id = job.worker_id
+    attempts = job.attempts
+    max_attempts = job.max_attempts
+    handler = _handlers.get(job.job_type)
+    payload = json.loads(job.payload)
+    payload['_job_id'] = job_id
+
+    _current.job_id = job_id
+    _current.worker_id = worker_id
+    _current.committed = False
+    stopped = threading.Event()
+    threading.Thread(
+        target=_heartbeat, args=(db.engine, job_id, worker_id, stopped),
+        name=f'ai-job-heartbeat-{job_id[:8]}', daemon=True
+    ).start()
+    try:
+        if handler is None:
+            raise PermanentJobError(f"未知的工作類型: {job.job_type}")
+        if is_cancel_requested(job_id):
+            raise JobCancelled()
+        result = handler(payload)
+        # 已寫入資料的工作無法撤回；沒有寫入時捨棄結果
+        if not _current.committed and is_cancel_requested(job_id):
+            raise JobCancelled()
+        _finish(job_id, worker_id, 'succeeded', result=result)
+    except JobCancelled:
+        db.session.rollback()
+        _finish(job_id, worker_id, 'cancelled')
+    except PermanentJobError as e:
+        db.session.rollback()
+        _finish(job_id, worker_id, 'failed', error=str(e))
+    except Exception as e:
+        db.session.rollback()
+        print(f"AI工作執行失敗 ({job_id}): {e}")
+        if attempts < max_attempts and not is_cancel_requested(job_id):
+            _schedule_retry(job_id, worker_id, attempts, str(e))
+        else:
+            _finish(job_id, worker_id, 'failed', error=str(e))
+    finally:
+        stopped.set()
+        _current.job_id = None
+        _current.worker_id = None
+
+class JobWorkerPool:
+    """輪詢ai_jobs資料表並執行工作的執行緒池
+
+    可在web行程中啟動，也可透過 worker.py 以獨立行程執行；
+    多個行程同時輪詢時，條件式UPDATE確保每個工作只會被領取一次。
+    """
+
+    def __init__(self, app, workers=2):
+        self.app = app
+        self.workers = workers
+        self._stop_event = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for index in range(self.workers):
+            worker_id = f"{socket.gethostname()}:{os.getpid()}:{index}"
+            thread = threading.Thread(
+                target=self._loop, args=(worker_id,),
+                name=f'ai-job-worker-{index}', daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self, timeout=None):
+        self._stop_event.set()
+        self.join(timeout)
+
+    def join(self, timeout=None):
+        """等待所有工作者執行緒結束"""
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _loop(self, worker_id):
+        from models.ai_job import db
+
+        while not self._stop_event.is_set():
+            with self.app.app_context():
+                try:
+                    job = _claim_next(worker_id)
+                    if job:
+                        run_job(job)
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"AI工作者錯誤 ({worker_id}): {e}")
+                    job = None
+                finally:
+                    db.session.remove()
+
+            if not job:
+                self._stop_event.wait(JOB_POLL_INTERVAL)
+
+# web行程中的工作者池（由main.py啟動）
+worker_pool = None
+
+def start_workers(app, workers):
+    """啟動行程內的工作者池（workers為0時不啟動）"""
+    global worker_pool
+    if workers > 0 and worker_pool is None:
+        worker_pool = JobWorkerPool(app, workers).start()
+    return worker_pool
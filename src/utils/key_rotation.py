@@ -0,0 +1,194 @@
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from utils.encryption import encryption_manager
+
+# 執行中的輪替超過此秒數未提交任何批次，視為執行的行程已中止，可重新啟動
+KEY_ROTATION_STALE_SECONDS = int(os.environ.get('KEY_ROTATION_STALE_SECONDS', 300))
+
+class KeyRotationJob:
+    """以批次方式將AIConfig的加密欄位改用最新MASTER_KEY重新加密
+
+    依主鍵順序分批讀取，每批提交一次以避免長時間佔用SQLite寫入鎖。
+    已使用最新密鑰的欄位會被略過，因此中斷後可從last_id續跑或整批重跑。
+    進度、取消請求與執行鎖存放在key_rotation_state資料表，任何worker都能查詢或取消，
+    同一時間只會有一個輪替工作執行。欄位只在仍是讀取時的密文時才寫入，
+    不會覆寫輪替期間經由設定頁面儲存的新值。
+    """
+
+    def __init__(self, batch_size=100, pause_seconds=0.0):
+        self.batch_size = batch_size
+        self.pause_seconds = pause_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    def claim(self, start_after_id=0):
+        """取得執行鎖並重設進度；已有輪替執行中（且未逾時）時回傳False"""
+        from models.ai_config import AIConfig, KeyRotationState, db
+
+        KeyRotationState.load()
+        total_rows = AIConfig.query.filter(AIConfig.id > start_after_id).count()
+        now = datetime.utcnow()
+        claimed = KeyRotationState.query.filter(
+            KeyRotationState.id == 1,
+            (KeyRotationState.status != 'running') |
+            (KeyRotationState.heartbeat_at < now - timedelta(seconds=KEY_ROTATION_STALE_SECONDS))
+        ).update({
+            'status': 'running',
+            'owner': self.owner,
+            'batch_size': self.batch_size,
+            'total_rows': total_rows,
+            'processed_rows': 0,
+            'rotated_fields': 0,
+            'failed_fields': 0,
+            'conflict_rows': 0,
+            'last_id': start_after_id,
+            'cancel_requested': False,
+            'error': None,
+            'started_at': now,
+            'heartbeat_at': now,
+            'finished_at': None
+        }, synchronize_session=False)
+        db.session.commit()
+        return claimed == 1
+
+    def _owned(self):
+        from models.ai_config import KeyRotationState
+
+        return KeyRotationState.query.filter(
+            KeyRotationState.id == 1,
+            KeyRotationState.owner == self.owner,
+            KeyRotationState.status == 'running'
+        )
+
+    def _rotate_row(self, table, columns, row, counts):
+        """以條件式UPDATE重新加密一筆資料列中尚未使用最新密鑰的欄位
+
+        只在欄位仍是讀取時的密文時寫入；資料列在讀取後被儲存時重新讀取再試一次，
+        仍然衝突時略過（可重跑輪替補齊）。
+        """
+        from models.ai_config import db
+
+        for _ in range(2):
+            values = {}
+            failed = 0
+            for column in columns:
+                value = getattr(row, column.name)
+                try:
+                    if encryption_manager.needs_rotation(value):
+                        values[column.name] = encryption_manager.rotate(value)
+                except Exception as e:
+                    failed += 1
+                    print(f"密鑰輪替失敗 (ai_configs.id={row.id}, {column.name}): {e}")
+            if not values:
+                break
+
+            updated = db.session.execute(
+                table.update()
+                .where(table.c.id == row.id, *(table.c[name] == getattr(row, name) for name in values))
+                .values(**values)
+            ).rowcount
+            if updated:
+                counts['rotated_fields'] += len(values)
+                break
+            row = db.session.execute(db.select(table.c.id, *columns).where(table.c.id == row.id)).first()
+            if row is None:
+                break
+        else:
+            counts['conflict_rows'] += 1
+        counts['failed_fields'] += failed
+
+    def run(self, start_after_id=0):
+        """同步執行輪替（需先以claim取得執行鎖，並在應用程式上下文中呼叫）"""
+        from models.ai_config import AIConfig, ENCRYPTED_FIELDS, db
+
+        table = AIConfig.__table__
+        columns = [table.c[column] for column in ENCRYPTED_FIELDS.values()]
+        counts = {'processed_rows': 0, 'rotated_fields': 0, 'failed_fields': 0, 'conflict_rows': 0}
+        last_id = start_after_id
+        status, error = 'completed', None
+
+        try:
+            while True:
+                rows = db.session.execute(
+                    db.select(table.c.id, *columns)
+                    .where(table.c.id > last_id)
+                    .order_by(table.c.id.asc())
+                    .limit(self.batch_size)
+                ).all()
+                if not rows:
+                    break
+
+                for row in rows:
+                    self._rotate_row(table, columns, row, counts)
+                    last_id = row.id
+                counts['processed_rows'] += len(rows)
+
+                # 進度與本批寫入在同一個交易中提交（同時作為心跳）；執行鎖已被取走時放棄本批
+                progress = dict(counts, last_id=last_id, heartbeat_at=datetime.utcnow())
+                if self._owned().update(progress, synchronize_session=False) != 1:
+                    db.session.rollback()
+                    print(f"密鑰輪替工作已失去執行鎖，停止 ({self.owner})")
+                    return None
+                db.session.commit()
+
+                if self._owned().filter_by(cancel_requested=True).count():
+                    status = 'cancelled'
+                    break
+                if self.pause_seconds:
+                    time.sleep(self.pause_seconds)
+        except Exception as e:
+            db.session.rollback()
+            status, error = 'failed', str(e)
+            print(f"密鑰輪替工作失敗: {e}")
+
+        self._owned().update({
+            'status': status,
+            'error': error,
+            'finished_at': datetime.utcnow()
+        }, synchronize_session=False)
+        db.session.commit()
+        return get_rotation_status()
+
+    def start_in_background(self, app, start_after_id=0):
+        """在背景執行緒中執行輪替（需先以claim取得執行鎖）"""
+        def target():
+            from models.ai_config import db
+
+            with app.app_context():
+                try:
+                    self.run(start_after_id=start_after_id)
+                finally:
+                    db.session.remove()
+
+        thread = threading.Thread(target=target, name='ai-config-key-rotation', daemon=True)
+        thread.start()
+        return thread
+
+def get_rotation_status():
+    """目前（或最近一次）輪替工作的進度，未曾執行時status為idle"""
+    from models.ai_config import KeyRotationState
+
+    return KeyRotationState.load().to_dict()
+
+def start_key_rotation(app, batch_size=100, start_after_id=0, pause_seconds=0.0):
+    """啟動背景輪替工作，若已有工作執行中（任何worker）則回傳None"""
+    job = KeyRotationJob(batch_size=batch_size, pause_seconds=pause_seconds)
+    if not job.claim(start_after_id=start_after_id):
+        return None
+    job.start_in_background(app, start_after_id=start_after_id)
+    return job
+
+def cancel_key_rotation():
+    """要求執行中的輪替在目前批次完成後停止，沒有執行中的工作時回傳False"""
+    from models.ai_config import KeyRotationState, db
+
+    requested = KeyRotationState.query.filter(
+        KeyRotationState.id == 1,
+        KeyRotationState.status == 'running'
+    ).update({'cancel_requested': True}, synchronize_session=False)
+    db.session.commit()
+    return requested == 1
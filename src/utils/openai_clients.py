@@ -0,0 +1,135 @@
+import hashlib
+import os
+import threading
+
+import httpx
+import openai
+
+from utils.circuit_breaker import CircuitBreaker
+
+# 連線池與逾時設定
+OPENAI_MAX_CONNECTIONS = int(os.environ.get('OPENAI_MAX_CONNECTIONS', 20))
+OPENAI_MAX_KEEPALIVE = int(os.environ.get('OPENAI_MAX_KEEPALIVE', 10))
+OPENAI_KEEPALIVE_EXPIRY = float(os.environ.get('OPENAI_KEEPALIVE_EXPIRY', 60))
+OPENAI_TIMEOUT = float(os.environ.get('OPENAI_TIMEOUT', 60))
+OPENAI_CONNECT_TIMEOUT = float(os.environ.get('OPENAI_CONNECT_TIMEOUT', 5))
+# 重試改由斷路器處理（每次嘗試都計入統計），客戶端預設不再自行重試
+OPENAI_MAX_RETRIES = int(os.environ.get('OPENAI_MAX_RETRIES', 0))
+# 透過斷路器呼叫時每次嘗試的逾時，讓卡住的上游盡早計入失敗
+OPENAI_BREAKER_TIMEOUT = float(os.environ.get('OPENAI_BREAKER_TIMEOUT', 30))
+
+def credential_fingerprint(api_key, base_url=None):
+    """以憑證與端點計算指紋（不在記憶體中以明文作為鍵）"""
+    raw = f"{base_url or ''}\0{api_key}".encode()
+    return hashlib.sha256(raw).hexdigest()
+
+class OpenAIClientRegistry:
+    """行程內的OpenAI客戶端登錄表
+
+    以憑證指紋為鍵重用客戶端，所有客戶端共用同一個httpx連線池，
+    讓後續請求沿用keep-alive連線而不必重新進行TLS交握。
+    每個擁有者（用戶或全域設定）只保留目前密鑰對應的客戶端，密鑰變更時舊客戶端會被移除。
+    """
+
+    def __init__(self):
+        self._clients = {}  # fingerprint -> openai.OpenAI
+        self._owners = {}   # owner -> fingerprint
+        self._lock = threading.Lock()
+        self._http_client = None
+
+    def _get_http_client(self):
+        if self._http_client is None:
+            self._http_client = httpx.Client(
+                limits=httpx.Limits(
+                    max_connections=OPENAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+                    keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY
+                ),
+                timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT)
+            )
+        return self._http_client
+
+    def get(self, api_key, owner='global', base_url=None):
+        """獲取（或建立）憑證對應的客戶端"""
+        base_url = base_url or os.environ.get('OPENAI_BASE_URL') or None
+        fingerprint = credential_fingerprint(api_key, base_url)
+
+        with self._lock:
+            previous = self._owners.get(owner)
+            if previous and previous != fingerprint:
+                # 密鑰已變更，移除舊客戶端（若無其他擁有者使用）
+                self._owners.pop(owner)
+                self._discard_unused(previous)
+
+            client = self._clients.get(fingerprint)
+            if client is None:
+                client = openai.OpenAI(
+                    api_key=api_key,
+                    base_url=base_url,
+                    http_client=self._get_http_client(),
+                    timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+                    max_retries=OPENAI_MAX_RETRIES
+                )
+                self._clients[fingerprint] = client
+            self._owners[owner] = fingerprint
+            return client
+
+    def evict(self, owner):
+        """移除擁有者目前的客戶端（例如設定更新時）"""
+        with self._lock:
+            fingerprint = self._owners.pop(owner, None)
+            if fingerprint:
+                self._discard_unused(fingerprint)
+
+    def _discard_unused(self, fingerprint):
+        # 客戶端共用httpx連線池，因此只移除參照，不關閉連線池
+        if fingerprint not in self._owners.values():
+            self._clients.pop(fingerprint, None)
+
+    def clear(self):
+        """移除所有客戶端並關閉共用連線池"""
+        with self._lock:
+            self._clients.clear()
+            self._owners.clear()
+            if self._http_client is not None:
+                self._http_client.close()
+                self._http_client = None
+
+    def stats(self):
+        """登錄表統計"""
+        with self._lock:
+            return {
+                'clients': len(self._clients),
+                'owners': len(self._owners),
+                'max_connections': OPENAI_MAX_CONNECTIONS,
+                'max_keepalive_connections': OPENAI_MAX_KEEPALIVE
+            }
+
+# 全域OpenAI客戶端登錄表
+openai_clients = OpenAIClientRegistry()
+
+def breaker_client(client):
+    """回傳供斷路器呼叫的客戶端副本：不自行重試（不受OPENAI_MAX_RETRIES影響），逾時較短
+
+    副本共用原客戶端的連線池。
+    """
+    return client.with_options(
+        max_retries=0,
+        timeout=httpx.Timeout(OPENAI_BREAKER_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT)
+    )
+
+def is_retryable_error(error):
+    """連線錯誤、逾時、429與5xx可重試"""
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    status_code = getattr(error, 'status_code', None)
+    return status_code in (408, 409, 429) or (status_code is not None and status_code >= 500)
+
+def is_upstream_failure(error):
+    """是否計入斷路器的錯誤率（401、400等用戶端錯誤不代表服務降級）"""
+    if isinstance(error, openai.APIStatusError):
+        return is_retryable_error(error)
+    return isinstance(error, (openai.APIError, httpx.HTTPError))
+
+# 所有模型呼叫共用的斷路器
+openai_breaker = CircuitBreaker('openai', is_failure=is_upstream_failure)
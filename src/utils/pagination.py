@@ -0,0 +1,169 @@
+import base64
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import event
+
+# 列表總數快取的有效秒數（游標分頁模式只在要求時計算總數）
+LIST_COUNT_CACHE_TTL = float(os.environ.get('LIST_COUNT_CACHE_TTL', 30))
+
+class InvalidCursor(ValueError):
+    """游標格式錯誤"""
+
+def encode_cursor(timestamp, row_id):
+    """將(時間, id)編碼為不透明的游標字串"""
+    raw = json.dumps([timestamp.isoformat() if timestamp else None, row_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """解碼游標，回傳(時間, id)"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        return (datetime.fromisoformat(timestamp) if timestamp else None), int(row_id)
+    except Exception:
+        raise InvalidCursor('無效的分頁游標')
+
+def parse_limit(value, default=20, maximum=100):
+    """解析每頁筆數並限制在1~maximum之間"""
+    try:
+        limit = int(value) if value is not None else default
+    except (TypeError, ValueError):
+        limit = default
+    return max(1, min(limit, maximum))
+
+def keyset_before(query, time_column, id_column, cursor):
+    """套用由新到舊排序的keyset條件（time, id）<（cursor）
+
+    時間為NULL的資料列排在最後（依id由大到小）：來自這些資料列的游標只以id比較；
+    其他游標只涵蓋時間不為NULL的資料列，其後的NULL資料列由keyset_rows補上。
+    """
+    if cursor:
+        timestamp, row_id = decode_cursor(cursor)
+        if timestamp is None:
+            query = query.filter(time_column.is_(None), id_column < row_id)
+        else:
+            # 先以time <= cursor限定索引範圍，再排除同一時間中較新的資料列
+            query = query.filter(
+                time_column <= timestamp,
+                (time_column < timestamp) | (id_column < row_id)
+            )
+    return query.order_by(time_column.desc().nulls_last(), id_column.desc())
+
+def keyset_after(query, time_column, id_column, cursor):
+    """套用由舊到新排序的keyset條件（time, id）>（cursor）
+
+    時間為NULL的資料列排在最前（依id由小到大）：來自這些資料列的游標只涵蓋其餘的NULL資料列，
+    其後時間不為NULL的資料列由keyset_rows補上。
+    """
+    if cursor:
+        timestamp, row_id = decode_cursor(cursor)
+        if timestamp is None:
+            query = query.filter(time_column.is_(None), id_column > row_id)
+        else:
+            query = query.filter(
+                time_column >= timestamp,
+                (time_column > timestamp) | (id_column > row_id)
+            )
+    return query.order_by(time_column.asc().nulls_first(), id_column.asc())
+
+def keyset_rows(query, time_column, id_column, cursor, count, newest_first=True):
+    """依keyset條件取出最多count筆資料列（newest_first為False時由舊到新）
+
+    時間為NULL的資料列與其他資料列分兩段查詢，各自沿索引範圍讀取；
+    游標所在的一段不足count筆時再由另一段補足，不會遺漏時間為NULL的資料列。
+    """
+    build = keyset_before if newest_first else keyset_after
+    rows = build(query, time_column, id_column, cursor).limit(count).all()
+    if not cursor or len(rows) >= count:
+        return rows
+
+    timestamp, _ = decode_cursor(cursor)
+    if newest_first and timestamp is not None:
+        rest = query.filter(time_column.is_(None)).order_by(id_column.desc())
+    elif not newest_first and timestamp is None:
+        rest = query.filter(time_column.isnot(None)).order_by(time_column.asc(), id_column.asc())
+    else:
+        return rows
+    return rows + rest.limit(count - len(rows)).all()
+
+def is_cursor_mode(args):
+    """是否使用游標分頁（pagination=cursor或帶有cursor參數）"""
+    return args.get('pagination') == 'cursor' or 'cursor' in args
+
+def keyset_page(query, time_column, id_column, cursor, limit):
+    """以keyset取得由新到舊的一頁（多取一筆判斷是否還有下一頁），回傳(資料列, 下一頁游標)
+
+    不使用OFFSET，任何深度的頁面都只需沿索引讀取limit + 1筆。
+    """
+    rows = keyset_rows(query, time_column, id_column, cursor, limit + 1)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, time_column.key), getattr(last, id_column.key))
+    return rows, next_cursor
+
+class CountCache:
+    """列表總數的快取（鍵為資料表與篩選條件）
+
+    總數在ttl秒內沿用；透過track()註冊的模型在ORM新增、修改或刪除時清除該資料表的快取。
+    """
+
+    def __init__(self, ttl=LIST_COUNT_CACHE_TTL, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._counts = {}  # (資料表, 篩選條件...) -> (總數, 過期時間)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key, query):
+        """取得快取的總數，未命中或過期時執行COUNT查詢"""
+        now = time.time()
+        with self._lock:
+            entry = self._counts.get(key)
+            if entry and entry[1] > now:
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        total = query.order_by(None).count()
+        with self._lock:
+            if len(self._counts) >= self.max_entries:
+                self._counts = {k: v for k, v in self._counts.items() if v[1] > now}
+            if len(self._counts) < self.max_entries:
+                self._counts[key] = (total, now + self.ttl)
+        return total
+
+    def invalidate(self, table_name):
+        with self._lock:
+            stale = [key for key in self._counts if key[0] == table_name]
+            for key in stale:
+                del self._counts[key]
+            self.invalidations += 1
+
+    def track(self, model):
+        """模型資料異動時清除其總數快取"""
+        def invalidate(mapper, connection, target):
+            self.invalidate(model.__tablename__)
+
+        for name in ('after_insert', 'after_update', 'after_delete'):
+            event.listen(model, name, invalidate)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._counts),
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations
+            }
+
+# 全域列表總數快取
+list_count_cache = CountCache()
@@ -0,0 +1,202 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+def normalize_prompt(prompt):
+    """正規化提示詞：全形/半形統一、去除多餘空白、英文轉小寫"""
+    text = unicodedata.normalize('NFKC', prompt or '')
+    text = re.sub(r'\s+', ' ', text).strip()
+    return text.lower()
+
+class ResponseCache:
+    """AI內容生成的兩層回應快取
+
+    第一層為行程內LRU，第二層為SQLite資料表（generated_content_cache），
+    兩層皆有TTL；資料表超過max_entries時依最後存取時間淘汰。
+    清除快取時會遞增資料庫中的世代（cache_generations），其他gunicorn worker
+    在下次查詢時發現世代改變即捨棄自己的LRU；世代每generation_check_interval秒最多檢查一次。
+    """
+
+    def __init__(self, enabled=False, ttl=86400, lru_size=256, max_entries=5000,
+                 name='generate_content', generation_check_interval=1.0):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.lru_size = lru_size
+        self.max_entries = max_entries
+        self.name = name
+        self.generation_check_interval = generation_check_interval
+        self._generation = None
+        self._generation_checked_at = float('-inf')
+        self._lru = OrderedDict()  # key -> (content, expires_at)
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.stores = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(content_type, platform, model, temperature, prompt):
+        """以正規化提示詞、內容類型、平台、模型與溫度產生快取鍵"""
+        raw = json.dumps(
+            [content_type, platform, model, round(float(temperature), 3), normalize_prompt(prompt)],
+            ensure_ascii=False
+        )
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def _check_generation(self):
+        """定期讀取快取世代，其他worker清除快取後捨棄本行程的LRU"""
+        from models.ai_chat import CacheGeneration
+
+        checked_at = time.monotonic()
+        with self._lock:
+            if checked_at - self._generation_checked_at < self.generation_check_interval:
+                return
+            self._generation_checked_at = checked_at
+
+        generation = CacheGeneration.get_generation(self.name)
+        with self._lock:
+            if generation != self._generation:
+                self._lru.clear()
+                self._generation = generation
+
+    def get(self, key):
+        """查詢快取，未命中時回傳None"""
+        from models.ai_chat import GeneratedContentCache, db
+
+        self._check_generation()
+        now = time.time()
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry and entry[1] > now:
+                self._lru.move_to_end(key)
+                self.memory_hits += 1
+                return entry[0]
+            if entry:
+                del self._lru[key]
+
+        row = GeneratedContentCache.query.filter(
+            GeneratedContentCache.cache_key == key,
+            GeneratedContentCache.expires_at > datetime.utcnow()
+        ).first()
+        if not row:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        row.hit_count = (row.hit_count or 0) + 1
+        row.last_accessed_at = datetime.utcnow()
+        db.session.commit()
+
+        remaining = (row.expires_at - datetime.utcnow()).total_seconds()
+        self._remember(key, row.content, now + remaining)
+        with self._lock:
+            self.persistent_hits += 1
+        return row.content
+
+    def set(self, key, content, content_type=None, platform=None, model=None):
+        """寫入兩層快取"""
+        from models.ai_chat import GeneratedContentCache, db
+
+        self._remember(key, content, time.time() + self.ttl)
+
+        now = datetime.utcnow()
+        row = GeneratedContentCache.query.filter_by(cache_key=key).first()
+        if not row:
+            row = GeneratedContentCache(cache_key=key)
+            db.session.add(row)
+        row.content = content
+        row.content_type = content_type
+        row.platform = platform
+        row.model = model
+        row.created_at = now
+        row.last_accessed_at = now
+        row.expires_at = now + timedelta(seconds=self.ttl)
+        db.session.commit()
+
+        with self._lock:
+            self.stores += 1
+        self._evict_persistent()
+
+    def _remember(self, key, content, expires_at):
+        with self._lock:
+            self._lru[key] = (content, expires_at)
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.lru_size:
+                self._lru.popitem(last=False)
+
+    def _evict_persistent(self):
+        """刪除過期項目，並在超過上限時淘汰最久未存取的項目"""
+        from models.ai_chat import GeneratedContentCache, db
+
+        removed = GeneratedContentCache.query.filter(
+            GeneratedContentCache.expires_at <= datetime.utcnow()
+        ).delete(synchronize_session=False)
+
+        overflow = GeneratedContentCache.query.count() - self.max_entries
+        if overflow > 0:
+            stale_ids = [
+                row_id for (row_id,) in db.session.query(GeneratedContentCache.id)
+                .order_by(GeneratedContentCache.last_accessed_at.asc())
+                .limit(overflow)
+            ]
+            removed += GeneratedContentCache.query.filter(
+                GeneratedContentCache.id.in_(stale_ids)
+            ).delete(synchronize_session=False)
+
+        if removed:
+            db.session.commit()
+            with self._lock:
+                self.evictions += removed
+
+    def record_bypass(self):
+        with self._lock:
+            self.bypassed += 1
+
+    def clear(self):
+        """清除兩層快取，並遞增世代讓其他worker捨棄各自的LRU"""
+        from models.ai_chat import CacheGeneration, GeneratedContentCache, db
+
+        GeneratedContentCache.query.delete()
+        generation = CacheGeneration.bump(self.name)
+        db.session.commit()
+        with self._lock:
+            self._lru.clear()
+            self._generation = generation
+            self._generation_checked_at = time.monotonic()
+
+    def stats(self):
+        """命中率等統計"""
+        with self._lock:
+            lookups = self.memory_hits + self.persistent_hits + self.misses
+            hits = self.memory_hits + self.persistent_hits
+            return {
+                'enabled': self.enabled,
+                'ttl': self.ttl,
+                'lru_size': len(self._lru),
+                'lru_max_size': self.lru_size,
+                'max_entries': self.max_entries,
+                'memory_hits': self.memory_hits,
+                'persistent_hits': self.persistent_hits,
+                'misses': self.misses,
+                'bypassed': self.bypassed,
+                'stores': self.stores,
+                'evictions': self.evictions,
+                'hit_rate': (hits / lookups) if lookups else 0.0
+            }
+
+# 全域內容生成快取（預設關閉，設定GENERATE_CACHE_ENABLED=true啟用）
+generate_content_cache = ResponseCache(
+    enabled=os.environ.get('GENERATE_CACHE_ENABLED', 'false').lower() == 'true',
+    ttl=int(os.environ.get('GENERATE_CACHE_TTL', 86400)),
+    lru_size=int(os.environ.get('GENERATE_CACHE_LRU_SIZE', 256)),
+    max_entries=int(os.environ.get('GENERATE_CACHE_MAX_ENTRIES', 5000)),
+    generation_check_interval=float(os.environ.get('GENERATE_CACHE_GENERATION_CHECK_INTERVAL', 1.0))
+)
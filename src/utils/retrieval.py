@@ -0,0 +1,284 @@
+import math
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+
+from utils.tokens import count_tokens, split_to_tokens
+
+# 文件分段與檢索設定
+DOCUMENT_CHUNK_TOKENS = int(os.environ.get('DOCUMENT_CHUNK_TOKENS', 300))
+DOCUMENT_CHUNK_OVERLAP = int(os.environ.get('DOCUMENT_CHUNK_OVERLAP', 40))
+RETRIEVAL_TOP_K = int(os.environ.get('RETRIEVAL_TOP_K', 6))
+# 每個回合放入提示詞的文件段落token上限；會話文件總量不超過此值時直接放入全文
+RETRIEVAL_MAX_TOKENS = int(os.environ.get('RETRIEVAL_MAX_TOKENS', 1800))
+# 分數低於最高分此比例的段落不放入（只命中常見詞彙的段落）
+RETRIEVAL_MIN_SCORE_RATIO = float(os.environ.get('RETRIEVAL_MIN_SCORE_RATIO', 0.3))
+RETRIEVAL_CACHE_SESSIONS = int(os.environ.get('RETRIEVAL_CACHE_SESSIONS', 64))
+
+# BM25參數
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# 英數字詞與連續的中日韓文字
+WORD_PATTERN = re.compile(r'[0-9a-z]+(?:[._\-][0-9a-z]+)*|[㐀-䶿一-鿿぀-ヿ가-힯]+')
+ASCII_WORD_PATTERN = re.compile(r'[0-9a-z]')
+
+def tokenize(text):
+    """將文字切成檢索用的詞彙：英數字詞轉小寫，中日韓文字切成二元組（單字時保留單字）"""
+    tokens = []
+    for word in WORD_PATTERN.findall((text or '').lower()):
+        if ASCII_WORD_PATTERN.match(word):
+            tokens.append(word)
+        elif len(word) == 1:
+            tokens.append(word)
+        else:
+            tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+    return tokens
+
+def chunk_text(text, max_tokens=DOCUMENT_CHUNK_TOKENS, overlap=DOCUMENT_CHUNK_OVERLAP):
+    """依行將文字切成約max_tokens的段落，相鄰段落重疊約overlap個token"""
+    chunks = []
+    lines = []
+    tokens = 0
+    for line in (text or '').splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        line_tokens = count_tokens(line)
+        # 單行超過上限時先切開（一次切成多段，最後一段與後續各行合併）
+        if line_tokens > max_tokens:
+            if lines:
+                chunks.append('\n'.join(lines))
+                lines, tokens = [], 0
+            pieces = [piece.strip() for piece in split_to_tokens(line, max_tokens)]
+            pieces = [piece for piece in pieces if piece]
+            chunks.extend(pieces[:-1])
+            line = pieces[-1] if pieces else ''
+            line_tokens = count_tokens(line)
+        if not line:
+            continue
+
+        if lines and tokens + line_tokens > max_tokens:
+            chunks.append('\n'.join(lines))
+            # 保留結尾的幾行作為下一段的開頭
+            carried = []
+            carried_tokens = 0
+            for previous in reversed(lines):
+                previous_tokens = count_tokens(previous)
+                if carried_tokens + previous_tokens > overlap:
+                    break
+                carried.insert(0, previous)
+                carried_tokens += previous_tokens
+            lines, tokens = carried, carried_tokens
+        lines.append(line)
+        tokens += line_tokens
+    if lines:
+        chunks.append('\n'.join(lines))
+    return chunks
+
+class BM25Index:
+    """記憶體內的BM25倒排索引（可逐段加入）"""
+
+    def __init__(self):
+        self.postings = {}  # 詞彙 -> {段落序號: 詞頻}
+        self.lengths = []
+        self.payloads = []
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.payloads)
+
+    def add(self, tokens, payload):
+        doc = len(self.payloads)
+        for term, tf in Counter(tokens).items():
+            self.postings.setdefault(term, {})[doc] = tf
+        self.lengths.append(len(tokens))
+        self.payloads.append(payload)
+        self.total_length += len(tokens)
+
+    def search(self, query_tokens, k, extra=None):
+        """回傳分數最高的k個(分數, payload)
+
+        extra為尚未寫入資料庫的段落（另一個BM25Index），與本索引合併計算文件頻率。
+        """
+        indexes = [index for index in (self, extra) if index is not None and len(index)]
+        count = sum(len(index) for index in indexes)
+        if not count:
+            return []
+        average_length = sum(index.total_length for index in indexes) / count or 1.0
+
+        scores = {}
+        for term in set(query_tokens):
+            df = sum(len(index.postings.get(term, ())) for index in indexes)
+            if not df:
+                continue
+            idf = math.log(1 + (count - df + 0.5) / (df + 0.5))
+            for number, index in enumerate(indexes):
+                for doc, tf in index.postings.get(term, {}).items():
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * index.lengths[doc] / average_length)
+                    key = (number, doc)
+                    scores[key] = scores.get(key, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(score, indexes[number].payloads[doc]) for (number, doc), score in best]
+
+class SessionIndex:
+    """單一會話的文件段落索引（last_id為已載入的最大段落id）"""
+
+    def __init__(self):
+        self.index = BM25Index()
+        self.last_id = 0
+        self.total_tokens = 0
+        self.lock = threading.Lock()
+
+class DocumentRetriever:
+    """會話文件的分段檢索
+
+    上傳的文件切成段落存於document_chunks資料表，每個會話在行程內保有一份
+    BM25索引（LRU），之後的回合只從資料庫增量載入新段落。
+    每個回合只將與目前問題最相關的前k段放入提示詞。
+    """
+
+    def __init__(self, top_k=RETRIEVAL_TOP_K, max_tokens=RETRIEVAL_MAX_TOKENS,
+                 cache_sessions=RETRIEVAL_CACHE_SESSIONS):
+        self.top_k = top_k
+        self.max_tokens = max_tokens
+        self.cache_sessions = cache_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.queries = 0
+        self.full_text_turns = 0
+        self.chunks_indexed = 0
+        self.tokens_available = 0
+        self.tokens_used = 0
+
+    @staticmethod
+    def build_chunks(session_id, attachment, label):
+        """將附件提取的文字切成DocumentChunk（隨附件一併寫入）"""
+        from models.ai_chat import DocumentChunk
+
+        chunks = []
+        for position, text in enumerate(chunk_text(attachment.extracted_text)):
+            chunk = DocumentChunk(
+                session_id=session_id,
+                position=position,
+                label=label,
+                text=text,
+                token_count=count_tokens(text)
+            )
+            attachment.chunks.append(chunk)
+            chunks.append(chunk)
+        return chunks
+
+    def _get_session(self, session_id):
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                entry = self._sessions[session_id] = SessionIndex()
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.cache_sessions:
+                self._sessions.popitem(last=False)
+            return entry
+
+    def _load(self, entry, session_id):
+        """從資料庫增量載入會話的新段落（呼叫端需持有entry.lock）"""
+        from models.ai_chat import DocumentChunk
+
+        rows = DocumentChunk.query.filter(
+            DocumentChunk.session_id == session_id,
+            DocumentChunk.id > entry.last_id
+        ).order_by(DocumentChunk.id).all()
+        for chunk in rows:
+            entry.index.add(tokenize(chunk.text), chunk_payload(chunk, (0, chunk.attachment_id)))
+            entry.last_id = chunk.id
+            entry.total_tokens += chunk.token_count
+        with self._lock:
+            self.chunks_indexed += len(rows)
+
+    def retrieve(self, session_id, query, new_chunks=()):
+        """依目前問題從會話文件（含本回合新上傳的段落）挑選段落，依文件順序回傳
+
+        會話文件總量不超過token上限時回傳全部段落；
+        沒有問題文字或沒有命中時，放入本回合新文件的開頭段落。
+        """
+        pending = BM25Index()
+        for chunk in new_chunks:
+            pending.add(tokenize(chunk.text), chunk_payload(chunk, (1, chunk.attachment.position)))
+
+        entry = self._get_session(session_id)
+        with entry.lock:
+            self._load(entry, session_id)
+            total_tokens = entry.total_tokens + sum(chunk.token_count for chunk in new_chunks)
+            if not total_tokens:
+                return []
+
+            if total_tokens <= self.max_tokens:
+                selected = list(entry.index.payloads) + list(pending.payloads)
+                with self._lock:
+                    self.full_text_turns += 1
+            else:
+                query_tokens = tokenize(query)
+                results = entry.index.search(query_tokens, self.top_k, extra=pending)
+                cutoff = results[0][0] * RETRIEVAL_MIN_SCORE_RATIO if results else 0
+                ranked = [payload for score, payload in results if score >= cutoff]
+                if not ranked:
+                    # 沒有問題文字或沒有命中時，放入本回合新文件的開頭段落
+                    ranked = list(pending.payloads)
+                selected = []
+                budget = self.max_tokens
+                for payload in ranked:
+                    if len(selected) >= self.top_k or payload['token_count'] > budget:
+                        continue
+                    selected.append(payload)
+                    budget -= payload['token_count']
+
+        used = sum(payload['token_count'] for payload in selected)
+        with self._lock:
+            self.queries += 1
+            self.tokens_available += total_tokens
+            self.tokens_used += used
+        return sorted(selected, key=lambda payload: (payload['order'], payload['position']))
+
+    def invalidate(self, session_id=None):
+        with self._lock:
+            if session_id is None:
+                self._sessions.clear()
+            else:
+                self._sessions.pop(session_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'cached_sessions': len(self._sessions),
+                'chunks_indexed': self.chunks_indexed,
+                'queries': self.queries,
+                'full_text_turns': self.full_text_turns,
+                'tokens_available': self.tokens_available,
+                'tokens_used': self.tokens_used,
+                'top_k': self.top_k,
+                'max_tokens': self.max_tokens
+            }
+
+def chunk_payload(chunk, order):
+    """索引中保存的段落資料（不保留ORM物件）
+
+    order用於依文件順序排列：已寫入的段落以附件id排序，本回合的新段落依附件位置排在最後。
+    """
+    return {
+        'order': order,
+        'position': chunk.position,
+        'label': chunk.label,
+        'text': chunk.text,
+        'token_count': chunk.token_count
+    }
+
+def format_chunks(chunks):
+    """將檢索到的段落組成提示詞文字"""
+    if not chunks:
+        return None
+    parts = [f"[{chunk['label']} 第{chunk['position'] + 1}段]\n{chunk['text']}" for chunk in chunks]
+    return "[相關文件段落]\n" + "\n\n".join(parts)
+
+# 全域文件檢索器
+document_retriever = DocumentRetriever()
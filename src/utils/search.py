@@ -0,0 +1,236 @@
+import html
+import os
+import re
+import time
+
+from sqlalchemy import column, event, func, inspect, literal_column, table, text
+
+from utils.retrieval import ASCII_WORD_PATTERN, WORD_PATTERN
+
+# 是否使用SQLite FTS5全文檢索（停用或不支援時改用LIKE搜尋）
+SEARCH_FTS_ENABLED = os.environ.get('SEARCH_FTS_ENABLED', 'true').lower() == 'true'
+# 排序時標題命中的權重（相對於內容）
+SEARCH_TITLE_WEIGHT = float(os.environ.get('SEARCH_TITLE_WEIGHT', 5.0))
+SNIPPET_CHARS = int(os.environ.get('SEARCH_SNIPPET_CHARS', 80))
+# 建立索引遇到資料庫鎖定等錯誤時的重試次數
+SEARCH_INDEX_RETRIES = int(os.environ.get('SEARCH_INDEX_RETRIES', 5))
+
+# 建立全文檢索索引的資料表與欄位
+FTS_TABLES = {
+    'posts': ('title', 'content'),
+    'marketing_items': ('title', 'content'),
+    'operation_items': ('title', 'content'),
+}
+
+# 已確認存在的索引資料表（索引建立與補齊在同一個交易中完成，存在即代表索引完整）
+_fts_ready = set()
+
+def has_search_index(connection, table_name):
+    """資料表的FTS5索引是否存在（以資料庫為準，不依賴各行程的啟動結果）"""
+    if not SEARCH_FTS_ENABLED or connection.dialect.name != 'sqlite':
+        return False
+    if table_name in _fts_ready:
+        return True
+    exists = connection.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"
+    ), {'name': f'{table_name}_fts'}).first() is not None
+    if exists:
+        _fts_ready.add(table_name)
+    return exists
+
+def index_text(value):
+    """轉換為索引用的詞彙字串
+
+    SQLite內建的分詞器會把連續的中文視為一個詞，無法搜尋其中的詞語，
+    因此中日韓文字以二元組（另加每段的最後一個字）建立索引，英數字詞轉小寫。
+    """
+    tokens = []
+    for word in WORD_PATTERN.findall((value or '').lower()):
+        if ASCII_WORD_PATTERN.match(word) or len(word) == 1:
+            tokens.append(word)
+        else:
+            tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+            tokens.append(word[-1])
+    return ' '.join(tokens)
+
+def match_expression(search):
+    """將搜尋字串轉為FTS5查詢（各詞之間為AND，無可搜尋的詞時回傳None）
+
+    中文詞語以二元組片語比對（等同子字串比對），單一中文字與最後一個英數字詞以前綴比對。
+    """
+    words = WORD_PATTERN.findall((search or '').lower())
+    terms = []
+    for index, word in enumerate(words):
+        if ASCII_WORD_PATTERN.match(word):
+            prefix = '*' if index == len(words) - 1 else ''
+            terms.append(f'"{word}"{prefix}')
+        elif len(word) == 1:
+            terms.append(f'"{word}"*')
+        else:
+            terms.append('"' + ' '.join(word[i:i + 2] for i in range(len(word) - 1)) + '"')
+    return ' AND '.join(terms) or None
+
+def index_rows(connection, table_name, rows):
+    """寫入（或重寫）資料列的索引內容，rows為含id與各索引欄位的dict"""
+    columns = FTS_TABLES[table_name]
+    fts = f'{table_name}_fts'
+    params = [
+        dict({'id': row['id']}, **{name: index_text(row[name]) for name in columns})
+        for row in rows
+    ]
+    if not params:
+        return
+    connection.execute(text(f"DELETE FROM {fts} WHERE rowid = :id"), params)
+    connection.execute(text(
+        f"INSERT INTO {fts}(rowid, {', '.join(columns)}) "
+        f"VALUES (:id, {', '.join(f':{name}' for name in columns)})"
+    ), params)
+
+def track_search(model):
+    """以ORM事件在同一個交易中維護模型的全文檢索索引
+
+    索引內容由應用程式計算，不使用觸發器，因此其他連線（sqlite3命令列、備份或移轉腳本）
+    寫入資料表時不會失敗；新增與刪除的資料列會在下次啟動時由ensure_search_index補齊
+    （外部修改既有資料列的內容則需經由應用程式再次儲存才會更新索引）。
+    只要索引資料表存在就會寫入，即使本行程啟動時建立索引失敗。
+    """
+    table_name = model.__tablename__
+    columns = FTS_TABLES[table_name]
+
+    def index_row(mapper, connection, target):
+        if has_search_index(connection, table_name):
+            index_rows(connection, table_name, [
+                dict({'id': target.id}, **{name: getattr(target, name) for name in columns})
+            ])
+
+    def update_row(mapper, connection, target):
+        state = inspect(target)
+        if any(state.attrs[name].history.has_changes() for name in columns):
+            index_row(mapper, connection, target)
+
+    def delete_row(mapper, connection, target):
+        if has_search_index(connection, table_name):
+            connection.execute(text(f"DELETE FROM {table_name}_fts WHERE rowid = :id"), {'id': target.id})
+
+    event.listen(model, 'after_insert', index_row)
+    event.listen(model, 'after_update', update_row)
+    event.listen(model, 'after_delete', delete_row)
+
+def _sync_search_index(connection, table_name):
+    """補齊索引：刪除已不存在的資料列，為尚未索引的資料列建立索引"""
+    columns = FTS_TABLES[table_name]
+    fts = f'{table_name}_fts'
+    connection.execute(text(f"DELETE FROM {fts} WHERE rowid NOT IN (SELECT id FROM {table_name})"))
+    result = connection.execute(text(
+        f"SELECT id, {', '.join(columns)} FROM {table_name} "
+        f"WHERE id NOT IN (SELECT rowid FROM {fts})"
+    ))
+    while True:
+        rows = result.mappings().fetchmany(1000)
+        if not rows:
+            break
+        index_rows(connection, table_name, rows)
+
+def _build_search_index(engine):
+    """在單一交易中移除舊版觸發器、建立索引資料表並補齊索引"""
+    with engine.begin() as connection:
+        schema = dict(connection.execute(text(
+            "SELECT name, sql FROM sqlite_master WHERE type IN ('table', 'trigger')"
+        )).all())
+        for table_name, columns in FTS_TABLES.items():
+            if table_name not in schema:
+                continue
+            fts = f'{table_name}_fts'
+            for suffix in ('insert', 'delete', 'update'):
+                connection.execute(text(f"DROP TRIGGER IF EXISTS {fts}_{suffix}"))
+            if fts in schema and "content=''" in (schema[fts] or ''):
+                connection.execute(text(f"DROP TABLE {fts}"))
+                del schema[fts]
+
+            if fts not in schema:
+                # 只儲存索引用的詞彙字串（原文仍在原資料表），可直接依rowid刪除
+                connection.execute(text(f"CREATE VIRTUAL TABLE {fts} USING fts5({', '.join(columns)})"))
+            _sync_search_index(connection, table_name)
+
+def ensure_search_index(engine):
+    """建立FTS5索引並補齊未索引的資料（只支援SQLite）
+
+    舊版以觸發器同步、無內容（contentless）的索引會被移除後重建。
+    多個行程同時啟動時可能遇到資料庫鎖定，此時以退避重試SEARCH_INDEX_RETRIES次。
+    """
+    if not SEARCH_FTS_ENABLED or engine.dialect.name != 'sqlite':
+        return False
+
+    for attempt in range(SEARCH_INDEX_RETRIES + 1):
+        try:
+            _build_search_index(engine)
+            return True
+        except Exception as e:
+            error = e
+            if 'locked' not in str(e) or attempt == SEARCH_INDEX_RETRIES:
+                break
+            time.sleep(0.5 * (2 ** attempt))
+
+    # 例如SQLite未編譯FTS5；已存在的索引仍會由ORM事件維護，沒有索引的資料表使用LIKE搜尋
+    print(f"錯誤：建立全文檢索索引失敗，未建立索引的資料表將使用LIKE搜尋: {str(error)}")
+    return False
+
+def apply_search(query, model, search, ranked=False):
+    """套用搜尋條件：有FTS5索引時以全文檢索比對，ranked時依相關度（bm25）排序
+
+    沒有索引或搜尋字串沒有可索引的詞（例如只有標點符號）時，改用標題與內容的LIKE比對。
+    """
+    table_name = model.__tablename__
+    expression = match_expression(search)
+    if expression is None or not has_search_index(query.session.connection(), table_name):
+        return query.filter(model.title.contains(search) | model.content.contains(search))
+
+    fts_name = f'{table_name}_fts'
+    fts = table(fts_name, column('rowid'))
+    fts_ref = literal_column(fts_name)
+    query = query.join(fts, fts.c.rowid == model.id).filter(fts_ref.op('MATCH')(expression))
+    if ranked:
+        query = query.order_by(func.bm25(fts_ref, SEARCH_TITLE_WEIGHT, 1.0))
+    return query
+
+def _highlight_pattern(search):
+    words = sorted(set(WORD_PATTERN.findall((search or '').lower())), key=len, reverse=True)
+    if not words:
+        return None
+    return re.compile('|'.join(re.escape(word) for word in words), re.IGNORECASE)
+
+def _mark(value, pattern):
+    """跳脫HTML後以<mark>標示命中的詞"""
+    parts = []
+    position = 0
+    for match in pattern.finditer(value):
+        parts.append(html.escape(value[position:match.start()]))
+        parts.append(f'<mark>{html.escape(match.group(0))}</mark>')
+        position = match.end()
+    parts.append(html.escape(value[position:]))
+    return ''.join(parts)
+
+def highlight(search, title, content, chars=SNIPPET_CHARS):
+    """產生搜尋結果的標示標題與內容摘要（以第一個命中處為中心擷取chars個字元）"""
+    pattern = _highlight_pattern(search)
+    title = title or ''
+    content = content or ''
+    if pattern is None:
+        return {'title': html.escape(title), 'snippet': html.escape(content[:chars])}
+
+    match = pattern.search(content)
+    start = max(0, match.start() - chars // 3) if match else 0
+    end = start + chars
+    snippet = _mark(content[start:end], pattern)
+    if start > 0:
+        snippet = '…' + snippet
+    if end < len(content):
+        snippet += '…'
+    return {'title': _mark(title, pattern), 'snippet': snippet}
+
+def search_result(item, search):
+    """列表項目的to_dict()；搜尋時附上標示命中詞的標題與內容摘要"""
+    data = item.to_dict()
+    if search:
+        data['highlight'] = highlight(search, item.title, item.content)
+    return data
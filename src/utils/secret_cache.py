@@ -0,0 +1,77 @@
+import copy
+import os
+import threading
+import time
+from collections import OrderedDict
+
+class SecretCache:
+    """行程內的已解密憑證快取（TTL + 數量上限的LRU）
+
+    每筆快取會記錄載入時的版本號；版本號存放在資料庫中，
+    其他gunicorn worker更新設定時會遞增版本號，本行程在下次檢查時即會重新載入。
+    為避免每次呼叫都查詢版本號，同一筆快取在version_check_interval秒內只檢查一次。
+    """
+
+    def __init__(self, ttl=300, max_size=256, version_check_interval=1.0):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.version_check_interval = version_check_interval
+        self._entries = OrderedDict()  # key -> [value, version, expires_at, checked_at]
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, loader, version_getter):
+        """取得快取值，過期或版本不符時以loader重新載入"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+
+        if entry and entry[2] > now:
+            recently_checked = now - entry[3] < self.version_check_interval
+            if recently_checked or version_getter(key) == entry[1]:
+                with self._lock:
+                    if not recently_checked:
+                        entry[3] = now
+                    if key in self._entries:
+                        self._entries.move_to_end(key)
+                    self.hits += 1
+                return copy.deepcopy(entry[0])
+
+        version = version_getter(key)
+        value = loader(key)
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = [value, version, now + self.ttl, now]
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return copy.deepcopy(value)
+
+    def invalidate(self, key=None):
+        """移除單筆快取（key為None時清除全部）"""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self):
+        """快取統計"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits / total) if total else 0.0
+            }
+
+# 全域已解密憑證快取實例
+secret_cache = SecretCache(
+    ttl=float(os.environ.get('AI_SECRET_CACHE_TTL', 300)),
+    max_size=int(os.environ.get('AI_SECRET_CACHE_SIZE', 256)),
+    version_check_interval=float(os.environ.get('AI_SECRET_CACHE_VERSION_CHECK_INTERVAL', 1.0))
+)
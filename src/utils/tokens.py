@@ -0,0 +1,165 @@
+import math
+
+try:
+    import tiktoken
+except ImportError:  # 未安裝時使用估算器
+    tiktoken = None
+
+# 每則訊息的格式開銷（role、分隔符號等）
+MESSAGE_OVERHEAD_TOKENS = 4
+# 每張圖片的估計token數（高解析度模式、長邊不超過1024時的上限）
+IMAGE_TOKENS = 765
+LOW_DETAIL_IMAGE_TOKENS = 85
+
+# 估算器係數（以cl100k_base對繁體中文與英文混合內容校準）
+CJK_TOKENS_PER_CHAR = 1.3
+ASCII_TOKENS_PER_CHAR = 0.25
+OTHER_TOKENS_PER_CHAR = 0.5
+
+# 各模型的提示詞token預算（已預留回應所需的max_tokens）
+MODEL_PROMPT_BUDGETS = {
+    'gpt-3.5-turbo': 12000,
+    'gpt-4o-mini': 32000,
+    'gpt-4o': 32000,
+    'gpt-4-vision-preview': 32000,
+}
+DEFAULT_PROMPT_BUDGET = 8000
+
+_encoding = None
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None and tiktoken is not None:
+        _encoding = tiktoken.get_encoding('cl100k_base')
+    return _encoding
+
+def _is_cjk(char):
+    code = ord(char)
+    return (
+        0x4E00 <= code <= 0x9FFF or    # CJK統一漢字
+        0x3400 <= code <= 0x4DBF or    # 擴充A
+        0x3000 <= code <= 0x303F or    # CJK標點
+        0xFF00 <= code <= 0xFFEF or    # 全形字元
+        0x3040 <= code <= 0x30FF or    # 日文假名
+        0xAC00 <= code <= 0xD7AF       # 韓文
+    )
+
+def count_tokens(text):
+    """計算文字的token數（有tiktoken時精確計算，否則估算）"""
+    if not text:
+        return 0
+
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+
+    cjk = ascii_chars = other = 0
+    for char in text:
+        if ord(char) < 128:
+            ascii_chars += 1
+        elif _is_cjk(char):
+            cjk += 1
+        else:
+            other += 1
+    return math.ceil(
+        cjk * CJK_TOKENS_PER_CHAR +
+        ascii_chars * ASCII_TOKENS_PER_CHAR +
+        other * OTHER_TOKENS_PER_CHAR
+    )
+
+def image_tokens(width, height, detail='high'):
+    """依OpenAI視覺模型的計費方式估算圖片token數
+
+    high：先縮放至2048x2048內，再將短邊縮至768，每個512x512區塊170 token，另加85 token。
+    low：固定85 token。
+    """
+    if detail == 'low':
+        return LOW_DETAIL_IMAGE_TOKENS
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    tiles = math.ceil(width / 512) * math.ceil(height / 512)
+    return LOW_DETAIL_IMAGE_TOKENS + 170 * tiles
+
+def count_content_tokens(content):
+    """計算OpenAI訊息content（字串或多模態陣列）的token數"""
+    if isinstance(content, list):
+        total = 0
+        for part in content:
+            if part.get('type') == 'image_url':
+                detail = (part.get('image_url') or {}).get('detail')
+                total += LOW_DETAIL_IMAGE_TOKENS if detail == 'low' else IMAGE_TOKENS
+            else:
+                total += count_tokens(part.get('text', ''))
+        return total + MESSAGE_OVERHEAD_TOKENS
+    return count_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+
+def truncate_to_tokens(text, max_tokens):
+    """將文字截斷至大約max_tokens個token"""
+    if max_tokens <= 0:
+        return ''
+    if count_tokens(text) <= max_tokens:
+        return text
+
+    # 以二分搜尋找出可容納的最長前綴
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if count_tokens(text[:mid]) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low]
+
+def _char_tokens(char):
+    if ord(char) < 128:
+        return ASCII_TOKENS_PER_CHAR
+    if _is_cjk(char):
+        return CJK_TOKENS_PER_CHAR
+    return OTHER_TOKENS_PER_CHAR
+
+def split_to_tokens(text, max_tokens):
+    """將文字依序切成每段約max_tokens個token的片段
+
+    只編碼（或估算）一次後依序切開，耗時與文字長度成正比，適合切分很長的文字。
+    """
+    if not text or max_tokens <= 0:
+        return []
+
+    encoding = _get_encoding()
+    if encoding is not None:
+        tokens = encoding.encode(text, disallowed_special=())
+        pieces = []
+        pending = b''
+        for start in range(0, len(tokens), max_tokens):
+            data = pending + encoding.decode_bytes(tokens[start:start + max_tokens])
+            # token邊界可能切在多位元組字元中間，不完整的位元組併入下一段
+            try:
+                piece, pending = data.decode('utf-8'), b''
+            except UnicodeDecodeError as e:
+                piece, pending = data[:e.start].decode('utf-8'), data[e.start:]
+            if piece:
+                pieces.append(piece)
+        if pending:
+            pieces.append(pending.decode('utf-8', errors='replace'))
+        return pieces
+
+    pieces = []
+    start = 0
+    estimate = 0.0
+    for index, char in enumerate(text):
+        char_tokens = _char_tokens(char)
+        if index > start and math.ceil(estimate + char_tokens) > max_tokens:
+            pieces.append(text[start:index])
+            start, estimate = index, 0.0
+        estimate += char_tokens
+    pieces.append(text[start:])
+    return pieces
+
+def get_prompt_budget(model, override=None):
+    """獲取模型的提示詞token預算"""
+    budget = MODEL_PROMPT_BUDGETS.get(model, DEFAULT_PROMPT_BUDGET)
+    if override:
+        budget = min(budget, override)
+    return budget
@@ -0,0 +1,249 @@
+import os
+import threading
+from datetime import datetime
+
+class UploadIndex:
+    """以內容SHA-256為鍵的上傳去重索引（uploaded_assets資料表）
+
+    相同內容再次上傳時直接沿用既有的Cloudinary資源與提取的文字，
+    略過上傳與解析。提取的文字總量超過max_text_bytes時，依最後使用時間
+    淘汰最舊的文字（保留資源連結）；項目數超過max_entries時刪除最舊的項目。
+    每次上傳另外寫入以public_id為鍵、不會被淘汰的上傳記錄（upload_records），
+    供聊天訊息驗證引用的文件（停用去重時也會寫入）。
+    """
+
+    def __init__(self, enabled=True, max_text_bytes=100 * 1024 * 1024, max_entries=20000):
+        self.enabled = enabled
+        self.max_text_bytes = max_text_bytes
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.text_evictions = 0
+        self.entry_evictions = 0
+
+    def lookup(self, digest, size):
+        """查詢索引，命中時記錄節省的位元組數並回傳資源資訊（dict）"""
+        from models.ai_chat import UploadedAsset, db
+
+        asset = UploadedAsset.query.filter_by(sha256=digest).first()
+        if not asset or asset.size != size:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        asset.hit_count += 1
+        asset.bytes_saved += size
+        asset.last_used_at = datetime.utcnow()
+        result = {
+            'url': asset.url,
+            'public_id': asset.public_id,
+            'file_type': asset.file_type,
+            'resource_type': asset.resource_type,
+            'text': asset.extracted_text,
+            'content_truncated': asset.content_truncated,
+            'text_evicted': asset.text_evicted
+        }
+        db.session.commit()
+
+        with self._lock:
+            self.hits += 1
+        return result
+
+    def find(self, url, public_id):
+        """查詢伺服器上傳過的資源（依public_id與網址），回傳資源資訊（dict），不存在時回傳None
+
+        聊天訊息引用已上傳的文件時，以此確認網址與提取的文字來自伺服器的上傳記錄。
+        索引項目或其文字已被淘汰時text_evicted為True，由呼叫端重新提取。
+        """
+        from models.ai_chat import UploadRecord, UploadedAsset, db
+
+        if not url or not public_id:
+            return None
+        record = UploadRecord.query.filter_by(public_id=public_id, url=url).first()
+        if not record:
+            return None
+
+        asset = UploadedAsset.query.filter_by(
+            sha256=record.sha256, resource_type=record.resource_type
+        ).first()
+        available = asset is not None and not asset.text_evicted
+        result = {
+            'url': record.url,
+            'public_id': record.public_id,
+            'sha256': record.sha256,
+            'file_type': record.file_type,
+            'size': record.size,
+            'resource_type': record.resource_type,
+            'text': asset.extracted_text if available else None,
+            'content_truncated': asset.content_truncated if available else False,
+            'text_evicted': not available
+        }
+        if asset:
+            asset.last_used_at = datetime.utcnow()
+            db.session.commit()
+        return result
+
+    def restore_text(self, asset, extracted):
+        """為find()回傳的資源補回重新提取的文字（索引項目已被淘汰時重新建立）"""
+        from models.ai_chat import UploadedAsset
+
+        existing = UploadedAsset.query.filter_by(sha256=asset['sha256']).first()
+        if existing is None:
+            self.store(
+                asset['sha256'], asset['size'], asset['file_type'], asset['resource_type'],
+                asset['url'], asset['public_id'], extracted
+            )
+        elif existing.resource_type == asset['resource_type']:
+            self.store_text(asset['sha256'], extracted)
+
+    def store(self, digest, size, file_type, resource_type, url, public_id, extracted=None):
+        """寫入新上傳的資源、上傳記錄與提取結果"""
+        from models.ai_chat import UploadRecord, UploadedAsset, db
+
+        record = UploadRecord.query.filter_by(public_id=public_id).first()
+        if not record:
+            record = UploadRecord(public_id=public_id)
+            db.session.add(record)
+        # 相同public_id重新上傳時Cloudinary會覆寫資源，記錄隨之更新
+        record.url = url
+        record.sha256 = digest
+        record.size = size
+        record.file_type = file_type
+        record.resource_type = resource_type
+
+        asset = UploadedAsset.query.filter_by(sha256=digest).first()
+        if not asset:
+            asset = UploadedAsset(sha256=digest)
+            db.session.add(asset)
+        asset.size = size
+        asset.file_type = file_type
+        asset.resource_type = resource_type
+        asset.url = url
+        asset.public_id = public_id
+        asset.last_used_at = datetime.utcnow()
+        self._set_text(asset, extracted)
+        db.session.commit()
+
+        with self._lock:
+            self.stores += 1
+        self._evict()
+
+    def store_text(self, digest, extracted):
+        """為文字已被淘汰的項目補回重新提取的內容"""
+        from models.ai_chat import UploadedAsset, db
+
+        asset = UploadedAsset.query.filter_by(sha256=digest).first()
+        if asset:
+            self._set_text(asset, extracted)
+            db.session.commit()
+            self._evict()
+
+    @staticmethod
+    def _set_text(asset, extracted):
+        text = extracted['text'] if extracted else None
+        asset.extracted_text = text
+        asset.content_truncated = bool(extracted and extracted['truncated'])
+        asset.text_bytes = len(text.encode('utf-8')) if text else 0
+        asset.text_evicted = False
+
+    def _evict(self):
+        """依最後使用時間淘汰文字與項目，直到低於上限"""
+        from models.ai_chat import UploadedAsset, db
+
+        overflow = UploadedAsset.query.count() - self.max_entries
+        if overflow > 0:
+            stale_ids = [
+                row_id for (row_id,) in db.session.query(UploadedAsset.id)
+                .order_by(UploadedAsset.last_used_at.asc())
+                .limit(overflow)
+            ]
+            removed = UploadedAsset.query.filter(
+                UploadedAsset.id.in_(stale_ids)
+            ).delete(synchronize_session=False)
+            db.session.commit()
+            with self._lock:
+                self.entry_evictions += removed
+
+        excess = (db.session.query(db.func.sum(UploadedAsset.text_bytes)).scalar() or 0) - self.max_text_bytes
+        if excess <= 0:
+            return
+
+        evicted = 0
+        rows = (db.session.query(UploadedAsset.id, UploadedAsset.text_bytes)
+                .filter(UploadedAsset.text_bytes > 0)
+                .order_by(UploadedAsset.last_used_at.asc()))
+        stale_ids = []
+        for row_id, text_bytes in rows:
+            if excess <= 0:
+                break
+            stale_ids.append(row_id)
+            excess -= text_bytes
+        if stale_ids:
+            evicted = UploadedAsset.query.filter(UploadedAsset.id.in_(stale_ids)).update({
+                'extracted_text': None,
+                'text_bytes': 0,
+                'text_evicted': True
+            }, synchronize_session=False)
+            db.session.commit()
+        with self._lock:
+            self.text_evictions += evicted
+
+    def backfill_records(self):
+        """為既有的索引項目補建上傳記錄（上傳記錄資料表新增前上傳的文件）"""
+        from models.ai_chat import UploadRecord, UploadedAsset, db
+
+        columns = ['public_id', 'url', 'sha256', 'size', 'file_type', 'resource_type', 'created_at']
+        # 同一public_id有多個項目時（相同名稱重新上傳）取最新的一筆
+        latest = db.session.query(db.func.max(UploadedAsset.id)).filter(
+            UploadedAsset.public_id.isnot(None)
+        ).group_by(UploadedAsset.public_id)
+        missing = db.session.query(*(getattr(UploadedAsset, name) for name in columns)).filter(
+            UploadedAsset.id.in_(latest),
+            ~UploadedAsset.public_id.in_(db.session.query(UploadRecord.public_id))
+        )
+        db.session.execute(UploadRecord.__table__.insert().from_select(columns, missing))
+        db.session.commit()
+
+    def clear(self):
+        """清除去重索引（不影響上傳記錄）"""
+        from models.ai_chat import UploadedAsset, db
+
+        UploadedAsset.query.delete()
+        db.session.commit()
+
+    def stats(self):
+        """命中率與節省的上傳量等統計（累計值來自資料表）"""
+        from models.ai_chat import UploadedAsset, db
+
+        entries, text_bytes, total_hits, bytes_saved = db.session.query(
+            db.func.count(UploadedAsset.id),
+            db.func.coalesce(db.func.sum(UploadedAsset.text_bytes), 0),
+            db.func.coalesce(db.func.sum(UploadedAsset.hit_count), 0),
+            db.func.coalesce(db.func.sum(UploadedAsset.bytes_saved), 0)
+        ).one()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'entries': entries,
+                'max_entries': self.max_entries,
+                'text_bytes': text_bytes,
+                'max_text_bytes': self.max_text_bytes,
+                'total_hits': total_hits,
+                'bytes_saved': bytes_saved,
+                'hits': self.hits,
+                'misses': self.misses,
+                'stores': self.stores,
+                'text_evictions': self.text_evictions,
+                'entry_evictions': self.entry_evictions,
+                'hit_rate': (self.hits / lookups) if lookups else 0.0
+            }
+
+# 全域上傳去重索引（設定UPLOAD_DEDUPE_ENABLED=false停用）
+upload_index = UploadIndex(
+    enabled=os.environ.get('UPLOAD_DEDUPE_ENABLED', 'true').lower() == 'true',
+    max_text_bytes=int(float(os.environ.get('UPLOAD_INDEX_MAX_TEXT_MB', 100)) * 1024 * 1024),
+    max_entries=int(os.environ.get('UPLOAD_INDEX_MAX_ENTRIES', 20000))
+)
@@ -0,0 +1,23 @@
+import os
+import sys
+import signal
+# 獨立的背景AI工作者行程：python src/worker.py
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+# 不在此行程的web應用中再啟動行程內工作者
+os.environ['AI_JOB_WORKERS'] = '0'
+
+from main import app
+from utils.job_queue import JobWorkerPool
+
+if __name__ == '__main__':
+    workers = int(os.environ.get('AI_WORKER_THREADS', 4))
+    pool = JobWorkerPool(app, workers).start()
+    print(f"AI工作者已啟動（{workers}個執行緒）")
+    
+    stop = lambda signum, frame: pool.stop(timeout=30)
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    
+    pool.join()